@@ -0,0 +1,71 @@
+"""
+Benchmark: query_fda_api with and without the label cache.
+
+Queries the stub openFDA server (benchmarks/stub_servers.py) once per
+drug, then repeats the same lookups (written differently, so they only match
+after normalization) from the in-memory tier and from the SQLite tier of a
+fresh process-level cache.
+
+Usage (from the backend directory):
+    python benchmarks/bench_fda_cache.py [--repeat 1000] [--upstream-delay 0.05]
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+# Add the backend directory to the path so the application modules can be imported
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stub_servers import StubUpstreamServer
+
+DRUGS = ["omeprazole", "ibuprofen", "metformin", "warfarin", "atorvastatin"]
+
+
+def timed(func, *args):
+    started = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=1000)
+    parser.add_argument("--upstream-delay", type=float, default=0.05)
+    args = parser.parse_args()
+
+    upstream = StubUpstreamServer(delay=args.upstream_delay).start()
+    os.environ.update(upstream.env())
+    os.environ["FDA_CACHE_PATH"] = os.path.join(tempfile.mkdtemp(prefix="drugsy_fda_cache_"), "fda.sqlite3")
+
+    from storage import ResponseCache
+    from tools import fda_api
+
+    try:
+        live = [timed(fda_api._query_fda_api, f"search=active_ingredient:{drug}") for drug in DRUGS]
+        # Same lookups with different spelling, answered from memory
+        memory = [
+            timed(fda_api._query_fda_api, f'search=ACTIVE_INGREDIENT:"{DRUGS[i % len(DRUGS)].title()}"')
+            for i in range(args.repeat)
+        ]
+        # A new cache on the same file, as after a restart, answers from disk once per drug
+        fda_api.fda_cache = ResponseCache("fda_label", path=os.environ["FDA_CACHE_PATH"])
+        disk = [timed(fda_api._query_fda_api, f"search=active_ingredient:{drug}") for drug in DRUGS]
+    finally:
+        upstream.stop()
+
+    def report(name, samples):
+        print(f"{name:<8} n={len(samples):<6} median {statistics.median(samples) * 1e6:>10.1f} us"
+              f"   max {max(samples) * 1e6:>10.1f} us")
+
+    print(f"Upstream delay {args.upstream_delay * 1000:.0f} ms")
+    report("live", live)
+    report("memory", memory)
+    report("disk", disk)
+    print(f"Cache stats: {fda_api.fda_cache.stats()}")
+
+
+if __name__ == "__main__":
+    main()
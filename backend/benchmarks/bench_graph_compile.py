@@ -0,0 +1,90 @@
+"""
+Micro-benchmark: per-request graph overhead with and without a shared compiled graph.
+
+"before" rebuilds and compiles the LangGraph for every request (what /chat did
+for authenticated users); "after" reuses one compiled graph and passes the
+personalized system prompt through the config. The LLM is a stub that answers
+instantly, so the numbers only measure graph construction and invocation.
+
+Usage (from the backend directory):
+    python benchmarks/bench_graph_compile.py [--requests 200]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+# Add the backend directory to the path so the application modules can be imported
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_core.messages import AIMessage
+from langchain_core.tools import tool
+
+from config.prompts import DRUG_INTERACTION_BOT, WELCOME_MSG
+from graph.api_graph import create_api_graph, process_message
+
+
+class StubLLM:
+    """Chat model stand-in that answers immediately without tool calls."""
+
+    def invoke(self, messages):
+        return AIMessage(content="ok")
+
+    def with_config(self, **kwargs):
+        return self
+
+
+@tool
+def stub_tool(query: str) -> str:
+    """Stand-in tool so the graph has a tools node like the real one."""
+    return query
+
+
+def personalized_prompt(i):
+    system_type, system_content = DRUG_INTERACTION_BOT
+    return (system_type, f"You are assisting Dr. Doctor {i}.\n\n{system_content}")
+
+
+def run(label, handle_request, requests):
+    timings = []
+    for i in range(requests):
+        start = time.perf_counter()
+        handle_request(i)
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    print(f"{label:<28} mean {statistics.mean(timings):8.3f} ms   "
+          f"p50 {timings[len(timings) // 2]:8.3f} ms   p95 {timings[int(len(timings) * 0.95)]:8.3f} ms")
+    return statistics.mean(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+
+    llm = StubLLM()
+    tools = [stub_tool]
+    state = {"messages": [AIMessage(content=WELCOME_MSG)]}
+
+    def rebuild_per_request(i):
+        graph = create_api_graph(llm, tools, personalized_prompt(i), WELCOME_MSG)
+        process_message(graph, state, "Does ibuprofen interact with warfarin?")
+
+    shared_graph = create_api_graph(llm, tools, DRUG_INTERACTION_BOT, WELCOME_MSG)
+
+    def shared_graph_with_config(i):
+        process_message(shared_graph, state, "Does ibuprofen interact with warfarin?",
+                        system_prompt=personalized_prompt(i))
+
+    # Warm up imports and caches before measuring
+    rebuild_per_request(0)
+    shared_graph_with_config(0)
+
+    before = run("before (compile per request)", rebuild_per_request, args.requests)
+    after = run("after (shared graph)", shared_graph_with_config, args.requests)
+    print(f"\nPer-request overhead removed: {before - after:.3f} ms ({before / after:.1f}x faster)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Benchmark: E-utilities traffic with and without the shared NCBI scheduler.
+
+The stub E-utilities server (benchmarks/stub_servers.py) answers 429 beyond
+--rate requests in any second, like NCBI. The same load (--background-workers
+threads and --interactive-tasks asyncio tasks, --requests each) is sent twice:
+straight through the HTTP client, then through tools/eutils.py with the
+threads at background priority and the tasks at interactive priority.
+
+Reports the successful requests per second, the number of 429 answers and the
+latency of each priority.
+
+Usage (from the backend directory):
+    python benchmarks/bench_ncbi_scheduler.py [--rate 3] [--requests 5]
+        [--background-workers 6] [--interactive-tasks 4] [--upstream-delay 0.02]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import threading
+import time
+
+# Add the backend directory to the path so the application modules can be imported
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stub_servers import StubUpstreamServer
+
+PARAMS = {"db": "pubmed", "term": "warfarin", "retmode": "json"}
+
+
+def run_load(args, send, asend) -> dict:
+    """Send the load with the given sync and async senders; return latencies by priority and successes."""
+    latencies = {"background": [], "interactive": []}
+    successes = []
+    lock = threading.Lock()
+
+    def record(priority, started, response):
+        with lock:
+            latencies[priority].append(time.perf_counter() - started)
+            successes.append(response is not None and response.status_code == 200)
+
+    def worker():
+        for _ in range(args.requests):
+            started = time.perf_counter()
+            record("background", started, send())
+
+    async def task():
+        for _ in range(args.requests):
+            started = time.perf_counter()
+            record("interactive", started, await asend())
+
+    async def interactive():
+        await asyncio.gather(*(task() for _ in range(args.interactive_tasks)))
+
+    threads = [threading.Thread(target=worker) for _ in range(args.background_workers)]
+    threads.append(threading.Thread(target=asyncio.run, args=(interactive(),)))
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return {"elapsed": time.perf_counter() - started, "latencies": latencies, "ok": sum(successes)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rate", type=float, default=3, help="Requests per second allowed by the stub")
+    parser.add_argument("--requests", type=int, default=5, help="Requests per worker and per task")
+    parser.add_argument("--background-workers", type=int, default=6)
+    parser.add_argument("--interactive-tasks", type=int, default=4)
+    parser.add_argument("--upstream-delay", type=float, default=0.02)
+    args = parser.parse_args()
+
+    upstream = StubUpstreamServer(delay=args.upstream_delay, eutils_rate_limit=args.rate).start()
+    os.environ.update(upstream.env())
+    os.environ["NCBI_RATE_LIMIT"] = str(args.rate)
+
+    from tools import eutils, http_client
+
+    url = f"{eutils.EUTILS_BASE_URL}/esearch.fcgi"
+
+    def direct():
+        try:
+            return http_client.get(url, params=PARAMS, retry=False)
+        except Exception:
+            return None
+
+    async def adirect():
+        try:
+            return await http_client.aget(url, params=PARAMS, retry=False)
+        except Exception:
+            return None
+
+    def scheduled():
+        return eutils.get("esearch.fcgi", PARAMS, priority=eutils.BACKGROUND)
+
+    async def ascheduled():
+        return await eutils.aget("esearch.fcgi", PARAMS, priority=eutils.INTERACTIVE)
+
+    total = args.requests * (args.background_workers + args.interactive_tasks)
+    print(f"{total} requests, stub limit {args.rate:g}/s, upstream delay {args.upstream_delay * 1000:.0f} ms")
+    print(f"{'path':<11}{'ok':>5}{'429s':>6}{'ok/s':>7}{'elapsed s':>11}"
+          f"{'interactive p50/max s':>23}{'background p50/max s':>22}")
+    try:
+        for name, send, asend in (("direct", direct, adirect), ("scheduled", scheduled, ascheduled)):
+            # Start from an empty rate limit window
+            time.sleep(1.1)
+            throttled_before = upstream.throttled
+            result = run_load(args, send, asend)
+            columns = [
+                f"{statistics.median(values):.2f}/{max(values):.2f}"
+                for values in (result["latencies"]["interactive"], result["latencies"]["background"])
+            ]
+            print(f"{name:<11}{result['ok']:>5}{upstream.throttled - throttled_before:>6}"
+                  f"{result['ok'] / result['elapsed']:>7.2f}{result['elapsed']:>11.2f}{columns[0]:>23}{columns[1]:>22}")
+    finally:
+        upstream.stop()
+
+
+if __name__ == "__main__":
+    main()
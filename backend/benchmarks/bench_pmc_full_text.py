@@ -0,0 +1,89 @@
+"""
+Benchmark: PMC full-text retrieval, one article at a time against batched and
+concurrent requests.
+
+The previous search_pubmed fetched each full text with its own efetch request,
+one after another; fetch_pmc_full_texts asks for --batch-size PMC IDs per
+request with up to --concurrency requests in flight, and gives each request
+--timeout seconds. Both run against the stub E-utilities server
+(benchmarks/stub_servers.py) under the NCBI rate limit, with one article
+taking --slow-delay extra seconds to stand in for a slow download. The
+article store is emptied before each run.
+
+Usage (from the backend directory):
+    python benchmarks/bench_pmc_full_text.py [--articles 12] [--batch-size 5] [--concurrency 3]
+        [--timeout 3] [--slow-delay 10] [--upstream-delay 0.3] [--ncbi-rate 3]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+# Add the backend directory to the path so the application modules can be imported
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stub_servers import StubUpstreamServer
+
+
+async def one_at_a_time(pmcids: list) -> dict:
+    """The request pattern of the previous _fetch_pmc_full_text loop."""
+    from tools import eutils, pubmed_xml
+
+    full_texts = {}
+    for pmcid in pmcids:
+        response = await eutils.aget("efetch.fcgi", {"db": "pmc", "id": pmcid, "retmode": "xml"})
+        stream = pubmed_xml.ArticleStream("article", pubmed_xml.pmc_article)
+        for _, full_text in pubmed_xml.iter_records(stream, [response.content]):
+            full_texts[pmcid] = full_text
+    return full_texts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--articles", type=int, default=12)
+    parser.add_argument("--batch-size", type=int, default=5)
+    parser.add_argument("--concurrency", type=int, default=3)
+    parser.add_argument("--timeout", type=float, default=3, help="Seconds per PMC request")
+    parser.add_argument("--slow-delay", type=float, default=10, help="Extra seconds taken by the slow article")
+    parser.add_argument("--upstream-delay", type=float, default=0.3)
+    parser.add_argument("--ncbi-rate", type=float, default=3)
+    args = parser.parse_args()
+
+    pmcids = [str(10900000 + index) for index in range(args.articles)]
+    upstream = StubUpstreamServer(delay=args.upstream_delay, eutils_rate_limit=args.ncbi_rate,
+                                  pmc_article_delays={pmcids[1]: args.slow_delay}).start()
+    os.environ.update(upstream.env())
+    os.environ.update({
+        "NCBI_RATE_LIMIT": str(args.ncbi_rate),
+        "PUBMED_STORE_PATH": "",
+        "PMC_FETCH_BATCH_SIZE": str(args.batch_size),
+        "PMC_FETCH_CONCURRENCY": str(args.concurrency),
+        "PMC_FETCH_TIMEOUT": str(args.timeout),
+    })
+    # models.llm builds its client at import time; the LLM isn't called here
+    os.environ.setdefault("GOOGLE_API_KEY", "unused")
+
+    from storage import ArticleStore
+    from tools import query_pubmed_api
+
+    print(f"{args.articles} articles (PMC ID {pmcids[1]} {args.slow_delay:g}s slower), upstream delay "
+          f"{args.upstream_delay * 1000:.0f} ms, NCBI rate {args.ncbi_rate:g}/s")
+    print(f"{'path':<14}{'requests':>10}{'full texts':>12}{'elapsed s':>11}")
+    try:
+        for name, func in (("one at a time", one_at_a_time), ("batched", query_pubmed_api.fetch_pmc_full_texts)):
+            query_pubmed_api.article_store = ArticleStore(None)
+            # Start from an empty rate limit window
+            time.sleep(1.1)
+            upstream.requests.clear()
+            started = time.perf_counter()
+            full_texts = asyncio.run(func(pmcids))
+            elapsed = time.perf_counter() - started
+            print(f"{name:<14}{sum(upstream.requests.values()):>10}"
+                  f"{sum(1 for text in full_texts.values() if text):>12}{elapsed:>11.2f}")
+    finally:
+        upstream.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Benchmark: tools/pubmed_api.py with batched E-utilities calls against the
+previous request pattern.
+
+The previous implementation made an esearch, a batch efetch it didn't use, and
+then one esummary and one efetch per PMID (2N+2 requests); the batched path
+makes an esearch, one esummary and one efetch (3 requests). Both run against
+the stub E-utilities server (benchmarks/stub_servers.py) for several result
+counts.
+
+Usage (from the backend directory):
+    python benchmarks/bench_pubmed_batching.py [--retmax 3,10] [--repeat 5] [--upstream-delay 0.05]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+# Add the backend directory to the path so the application modules can be imported
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stub_servers import StubUpstreamServer
+
+QUERY = "warfarin aspirin bleeding"
+
+
+def n_plus_one(search_query: str, retmax: int) -> list:
+    """The request pattern of the previous query_pubmed_api."""
+    from tools import http_client
+    from tools.eutils import EUTILS_BASE_URL
+
+    search_params = {"db": "pubmed", "term": search_query, "retmode": "json", "retmax": retmax}
+    id_list = http_client.get(f"{EUTILS_BASE_URL}/esearch.fcgi", params=search_params).json()["esearchresult"]["idlist"][:retmax]
+    http_client.get(f"{EUTILS_BASE_URL}/efetch.fcgi", params={"db": "pubmed", "id": ",".join(id_list), "retmode": "xml"})
+
+    articles = []
+    for article_id in id_list:
+        summary = http_client.get(f"{EUTILS_BASE_URL}/esummary.fcgi", params={"db": "pubmed", "id": article_id, "retmode": "json"})
+        article_data = summary.json().get("result", {}).get(article_id, {})
+        abstract_text = http_client.get(f"{EUTILS_BASE_URL}/efetch.fcgi", params={"db": "pubmed", "id": article_id, "retmode": "xml"}).text
+        abstract = "Abstract not available"
+        if "<AbstractText>" in abstract_text and "</AbstractText>" in abstract_text:
+            start = abstract_text.find("<AbstractText>") + len("<AbstractText>")
+            abstract = abstract_text[start:abstract_text.find("</AbstractText>")].strip()
+        articles.append({"pmid": article_id, "title": article_data.get("title"), "abstract": abstract})
+    return articles
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--retmax", default="3,10", help="Comma-separated result counts")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--upstream-delay", type=float, default=0.05)
+    args = parser.parse_args()
+
+    upstream = StubUpstreamServer(delay=args.upstream_delay).start()
+    os.environ.update(upstream.env())
+    # Compare round-trips, not the NCBI rate limit the batched path is scheduled under
+    os.environ["NCBI_RATE_LIMIT"] = "1000"
+
+    from tools import pubmed_api
+
+    def run(func, retmax):
+        samples = []
+        upstream.requests.clear()
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            articles = func(QUERY, retmax)
+            samples.append(time.perf_counter() - started)
+        with_abstract = sum(article["abstract"] != "Abstract not available" for article in articles)
+        return samples, sum(upstream.requests.values()) // args.repeat, len(articles), with_abstract
+
+    print(f"Upstream delay {args.upstream_delay * 1000:.0f} ms, {args.repeat} runs each")
+    print(f"{'path':<10}{'retmax':>7}{'requests':>10}{'articles':>10}{'abstracts':>11}{'median ms':>11}{'max ms':>9}")
+    try:
+        for retmax in [int(value) for value in args.retmax.split(",")]:
+            for name, func in (("n+1", n_plus_one), ("batched", pubmed_api.search_articles)):
+                samples, requests, articles, abstracts = run(func, retmax)
+                print(f"{name:<10}{retmax:>7}{requests:>10}{articles:>10}{abstracts:>11}"
+                      f"{statistics.median(samples) * 1000:>11.1f}{max(samples) * 1000:>9.1f}")
+    finally:
+        upstream.stop()
+
+
+if __name__ == "__main__":
+    main()
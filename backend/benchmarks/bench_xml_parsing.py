@@ -0,0 +1,162 @@
+"""
+Benchmark: parsing PubMed and PMC efetch XML with a whole-document tree against
+the streaming parser in tools/pubmed_xml.py.
+
+The previous code built the tree of the whole response with ET.fromstring and
+gathered text with repeated string concatenation; ArticleStream is fed the
+response in 64 KB chunks and keeps one article's tree at a time. Both parse
+the same payload; the time is the median of --repeat runs and the peak is the
+memory allocated while parsing (tracemalloc, payload excluded).
+
+By default the payloads are built from the fixtures: --articles PMC articles
+with their body repeated --sections times, and the PubMed fixture repeated
+--pubmed-copies times. Pass recorded efetch responses with --pmc-file and
+--pubmed-file to measure real data.
+
+Usage (from the backend directory):
+    python benchmarks/bench_xml_parsing.py [--articles 25] [--sections 60] [--pubmed-copies 10]
+        [--pmc-file recorded_pmc.xml] [--pubmed-file recorded_pubmed.xml] [--repeat 5]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+import xml.etree.ElementTree as ET
+
+# Add the backend directory to the path so the application modules can be imported
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tools import pubmed_xml
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+def tree_pmc(content: bytes) -> int:
+    """The previous PMC full-text extraction; returns the number of articles."""
+    root = ET.fromstring(content)
+    count = 0
+    for article in root.iter("article"):
+        full_text = ""
+        for body in article.findall(".//body"):
+            for p in body.findall(".//p"):
+                if p.text:
+                    full_text += p.text.strip() + "\n\n"
+                for child in p:
+                    if child.tail:
+                        full_text += child.tail.strip() + " "
+                full_text += "\n"
+            for title in body.findall(".//title"):
+                if title.text:
+                    full_text += title.text.strip() + "\n\n"
+            for caption in body.findall(".//table-wrap/caption"):
+                if caption.text:
+                    full_text += "Table Caption: " + caption.text.strip() + "\n\n"
+            for fig_caption in body.findall(".//fig/caption"):
+                if fig_caption.text:
+                    full_text += "Figure Caption: " + fig_caption.text.strip() + "\n\n"
+        full_text = "\n".join([line.strip() for line in full_text.split("\n") if line.strip()])
+        count += 1
+    return count
+
+
+def tree_pubmed(content: bytes) -> int:
+    """The previous PubMed article parsing; returns the number of articles."""
+    root = ET.fromstring(content)
+    count = 0
+    for article in root.findall(".//PubmedArticle"):
+        abstract = ""
+        for elem in article.findall(".//AbstractText"):
+            label = elem.get("Label")
+            if label:
+                abstract += f"{label}: {elem.text}\n" if elem.text else ""
+            else:
+                abstract += f"{elem.text}\n" if elem.text else ""
+        record = {
+            "pmid": article.findtext(".//PMID"),
+            "title": article.findtext(".//ArticleTitle"),
+            "abstract": abstract.strip(),
+            "year": article.findtext(".//PubDate/Year"),
+            "journal": article.findtext(".//Journal/Title"),
+        }
+        count += 1
+    return count
+
+
+def stream_pmc(content: bytes) -> int:
+    stream = pubmed_xml.ArticleStream("article", pubmed_xml.pmc_article)
+    return sum(1 for _ in pubmed_xml.iter_records(stream, pubmed_xml.chunks(content)))
+
+
+def stream_pubmed(content: bytes) -> int:
+    stream = pubmed_xml.ArticleStream("PubmedArticle", pubmed_xml.pubmed_article)
+    return sum(1 for _ in pubmed_xml.iter_records(stream, pubmed_xml.chunks(content)))
+
+
+def pmc_payload(articles: int, sections: int) -> bytes:
+    """The PMC fixture with --articles articles whose body is repeated --sections times."""
+    with open(os.path.join(FIXTURES_DIR, "efetch_pmc.xml"), "rb") as f:
+        fixture = f.read()
+    head, rest = fixture.split(b"<article ", 1)
+    article, tail = rest.rsplit(b"</article>", 1)
+    before_body, rest = article.split(b"<body>", 1)
+    body, after_body = rest.split(b"</body>", 1)
+    article = b"<article " + before_body + b"<body>" + body * sections + b"</body>" + after_body + b"</article>"
+    return head + article * articles + tail
+
+
+def pubmed_payload(copies: int) -> bytes:
+    """The PubMed fixture with its articles repeated --pubmed-copies times."""
+    with open(os.path.join(FIXTURES_DIR, "efetch_pubmed.xml"), "rb") as f:
+        fixture = f.read()
+    start, end = fixture.index(b"<PubmedArticle>"), fixture.rindex(b"</PubmedArticleSet>")
+    return fixture[:start] + fixture[start:end] * copies + fixture[end:]
+
+
+def measure(func, content: bytes, repeat: int):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        articles = func(content)
+        samples.append(time.perf_counter() - started)
+    tracemalloc.start()
+    func(content)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return articles, statistics.median(samples), peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--articles", type=int, default=25)
+    parser.add_argument("--sections", type=int, default=60)
+    parser.add_argument("--pubmed-copies", type=int, default=10)
+    parser.add_argument("--pmc-file", help="Recorded PMC efetch response")
+    parser.add_argument("--pubmed-file", help="Recorded PubMed efetch response")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.pmc_file:
+        with open(args.pmc_file, "rb") as f:
+            pmc = f.read()
+    else:
+        pmc = pmc_payload(args.articles, args.sections)
+    if args.pubmed_file:
+        with open(args.pubmed_file, "rb") as f:
+            pubmed = f.read()
+    else:
+        pubmed = pubmed_payload(args.pubmed_copies)
+
+    print(f"{'payload':<9}{'parser':<9}{'MB':>7}{'articles':>10}{'median ms':>11}{'peak MB':>9}")
+    for payload, content, paths in (
+            ("pmc", pmc, (("tree", tree_pmc), ("stream", stream_pmc))),
+            ("pubmed", pubmed, (("tree", tree_pubmed), ("stream", stream_pubmed)))):
+        for name, func in paths:
+            articles, elapsed, peak = measure(func, content, args.repeat)
+            print(f"{payload:<9}{name:<9}{len(content) / 1e6:>7.1f}{articles:>10}"
+                  f"{elapsed * 1000:>11.1f}{peak / 1e6:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
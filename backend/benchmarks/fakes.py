@@ -0,0 +1,190 @@
+"""
+Offline stand-ins for the external services used by the backend, shared by the
+benchmark and stress scripts: deterministic chat models, a hashing embedding
+model and a helper importing the FastAPI app with them.
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import uuid
+import zlib
+
+import numpy as np
+
+# Add the backend directory to the path so the application modules can be imported
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+# Tool calls made by ScriptedChatModel for prompts starting with "[<scenario>]"
+SCENARIOS = {
+    "plain": [],
+    "fda": [("query_fda_api", {"search_query": "search=openfda.generic_name:ibuprofen&limit=1"})],
+    "fda_batch": [("query_fda_api_batch", {"drug_names": ["warfarin", "ibuprofen", "omeprazole", "metformin"]})],
+    "usda": [("query_usda_food_data", {"food_query": "grapefruit"})],
+    "pubmed": [("query_pubmed_api", {"query": "warfarin ibuprofen bleeding risk"})],
+    "pubmed_multi": [
+        ("query_pubmed_api", {"query": "warfarin NSAID bleeding risk"}),
+        ("query_pubmed_api", {"query": "warfarin proton pump inhibitor gastrointestinal bleeding"}),
+        ("query_pubmed_api", {"query": "ibuprofen anticoagulant elderly"}),
+    ],
+    "mixed": [
+        ("query_fda_api", {"search_query": "search=openfda.generic_name:warfarin&limit=1"}),
+        ("query_usda_food_data", {"food_query": "grapefruit"}),
+        ("query_pubmed_api", {"query": "warfarin grapefruit interaction"}),
+    ],
+}
+
+
+def _text(message) -> str:
+    return message.content if isinstance(message.content, str) else str(message.content)
+
+
+def _usage(messages, output: str) -> dict:
+    """Token counts estimated like the context window does, so LLM metrics are populated."""
+    input_tokens = sum(len(_text(m)) for m in messages) // 4
+    output_tokens = len(output) // 4
+    return {"input_tokens": input_tokens, "output_tokens": output_tokens,
+            "total_tokens": input_tokens + output_tokens}
+
+
+class SlowEchoChatModel(BaseChatModel):
+    """Chat model stand-in that echoes the last user message after a delay."""
+
+    delay: float = 0.05
+
+    @property
+    def _llm_type(self) -> str:
+        return "slow-echo"
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    def _reply(self, messages):
+        last_prompt = next((m.content for m in reversed(messages) if isinstance(m, HumanMessage)), "")
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=f"echo: {last_prompt}"))])
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.delay)
+        return self._reply(messages)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self.delay)
+        return self._reply(messages)
+
+
+class ScriptedChatModel(BaseChatModel):
+    """
+    Deterministic chat model that scripts tool calls.
+
+    A user message starting with the name of a scenario in brackets, e.g. "[fda]", is
+    answered with the tool calls of that scenario (see SCENARIOS); once the
+    tool results are in, or for any other message, it answers with plain text.
+    Every call takes ``delay`` seconds to stand in for the model latency.
+    """
+
+    delay: float = 0.2
+
+    @property
+    def _llm_type(self) -> str:
+        return "scripted"
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    def _reply(self, messages):
+        conversation = [m for m in messages if not isinstance(m, SystemMessage)]
+        last = conversation[-1] if conversation else None
+
+        if isinstance(last, ToolMessage):
+            results = []
+            for message in reversed(conversation):
+                if not isinstance(message, ToolMessage):
+                    break
+                results.append(f"{message.name}: {_text(message)[:80]}")
+            content = "Based on the tool results: " + " | ".join(reversed(results))
+            message = AIMessage(content=content, usage_metadata=_usage(messages, content))
+        else:
+            prompt = _text(last) if last is not None else ""
+            scenario = prompt[1:prompt.index("]")] if prompt.startswith("[") and "]" in prompt else "plain"
+            calls = SCENARIOS.get(scenario, [])
+            if calls:
+                tool_calls = [{"name": name, "args": args, "id": f"call_{uuid.uuid4().hex[:12]}"}
+                              for name, args in calls]
+                message = AIMessage(content="", tool_calls=tool_calls, usage_metadata=_usage(messages, str(calls)))
+            else:
+                content = f"Answer to: {prompt[:200]}"
+                message = AIMessage(content=content, usage_metadata=_usage(messages, content))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.delay)
+        return self._reply(messages)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self.delay)
+        return self._reply(messages)
+
+
+class HashingEmbedder:
+    """
+    Embedding model stand-in with the SentenceTransformer ``encode`` interface.
+
+    Words are hashed into a fixed number of dimensions, so texts sharing words
+    get similar vectors and no model has to be downloaded.
+    """
+
+    def __init__(self, model_name: str = "hashing", dimensions: int = 384):
+        self.model_name = model_name
+        self.dimensions = dimensions
+
+    def _encode_one(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        for word in text.lower().split():
+            vector[zlib.crc32(word.encode("utf-8")) % self.dimensions] += 1.0
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def encode(self, texts, **kwargs):
+        if isinstance(texts, str):
+            return self._encode_one(texts)
+        return np.stack([self._encode_one(text) for text in texts]) if texts else np.zeros((0, self.dimensions), dtype=np.float32)
+
+
+def load_app(chat_model, env=None):
+    """
+    Import the FastAPI app with a stand-in chat model and embedding model and a
+    throwaway database and conversation store.
+
+    Args:
+        chat_model: The chat model replacing Gemini
+        env: Extra environment variables, such as the base URLs of stub servers
+
+    Returns:
+        The imported main module
+    """
+    workdir = tempfile.mkdtemp(prefix="drugsy_bench_")
+    os.environ.update(env or {})
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(workdir, 'bench.db')}")
+    os.environ.setdefault("CONVERSATION_STORE", "journal")
+    os.environ.setdefault("CONVERSATIONS_DIR", os.path.join(workdir, "conversations"))
+    os.environ.setdefault("PUBMED_RESULTS_LOG", os.path.join(workdir, "pubmed_tool_results.log"))
+    os.environ.setdefault("FDA_CACHE_PATH", os.path.join(workdir, "fda_labels.sqlite3"))
+    os.environ.setdefault("PUBMED_STORE_PATH", os.path.join(workdir, "pubmed_articles.sqlite3"))
+    os.environ.setdefault("VECTOR_INDEX_PATH", os.path.join(workdir, "pubmed_chroma"))
+    os.environ.setdefault("EMBEDDING_CACHE_DIR", os.path.join(workdir, "embeddings"))
+    os.environ.setdefault("PORT", "8080")
+    # models.llm builds the real client at import time; it is replaced right after
+    os.environ.setdefault("GOOGLE_API_KEY", "unused")
+
+    import models.llm
+    models.llm.llm = chat_model
+    # The RAG pipeline creates its embedding model on first use
+    import tools.query_pubmed_api
+    tools.query_pubmed_api.SentenceTransformer = HashingEmbedder
+    import main
+    return main
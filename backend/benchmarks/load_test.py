@@ -0,0 +1,308 @@
+"""
+Offline load test for /chat and /chat/stream.
+
+Starts the FastAPI app under uvicorn with the scripted chat model from
+fakes.py and the stub upstream server from stub_servers.py, so no network
+access, Gemini key or embedding model download is needed. Concurrent clients
+send prompts drawn from the --mix scenarios (each scenario scripts the tool
+calls the model makes), continuing each conversation for --turns turns.
+
+Reports client-side p50/p95/p99 latency and throughput, process memory, the
+number of upstream requests, and the mean server-side latencies recorded on
+/metrics (graph nodes, tools, PubMed stages, database and conversation store).
+
+Usage (from the backend directory):
+    python benchmarks/load_test.py [--requests 200] [--concurrency 20]
+        [--mix fda=2,usda=1,pubmed=1,plain=2] [--turns 3] [--endpoint chat|stream]
+        [--llm-delay 0.2] [--upstream-delay 0.05] [--ncbi-rate 1000] [--json results.json]
+"""
+import argparse
+import asyncio
+import json
+
+import random
+import re
+import resource
+import socket
+import sys
+import threading
+import time
+from collections import defaultdict
+
+from fakes import SCENARIOS, ScriptedChatModel, load_app
+from stub_servers import StubUpstreamServer
+
+PROMPTS = {
+    "plain": "Hello, what can you help me with?",
+    "fda": "Does ibuprofen interact with warfarin?",
+    "fda_batch": "My patient takes warfarin, ibuprofen, omeprazole and metformin. Any interactions?",
+    "usda": "What is the vitamin K content of grapefruit?",
+    "pubmed": "What does the literature say about bleeding risk with warfarin and NSAIDs?",
+    "pubmed_multi": "Review the evidence on bleeding with warfarin plus ibuprofen, and whether a PPI helps.",
+    "mixed": "My patient on warfarin eats grapefruit daily, is that a problem?",
+}
+
+
+def parse_mix(mix: str) -> dict:
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in SCENARIOS:
+            raise argparse.ArgumentTypeError(f"Unknown scenario {name!r}, expected one of {', '.join(SCENARIOS)}")
+        weights[name] = float(weight or 1)
+    return weights
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies):
+    values = sorted(latencies)
+    return {
+        "count": len(values),
+        "p50_ms": round(percentile(values, 0.50) * 1000, 1),
+        "p95_ms": round(percentile(values, 0.95) * 1000, 1),
+        "p99_ms": round(percentile(values, 0.99) * 1000, 1),
+        "max_ms": round(values[-1] * 1000, 1) if values else 0.0,
+        "mean_ms": round(sum(values) / len(values) * 1000, 1) if values else 0.0,
+    }
+
+
+def current_rss_mb():
+    """Resident set size of this process (app, stubs and clients), in MB."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return peak_rss_mb()
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes on Linux
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def server_breakdown(metrics_text):
+    """Mean latency in ms and count of every histogram series on /metrics."""
+    sums, counts = {}, {}
+    for line in metrics_text.splitlines():
+        match = re.match(r"^(drugsy_\w+)_(sum|count)(\{.*\})? (\S+)$", line)
+        if not match:
+            continue
+        name, kind, labels, value = match.groups()
+        key = f"{name}{labels or ''}"
+        (sums if kind == "sum" else counts)[key] = float(value)
+    breakdown = {}
+    for key, count in counts.items():
+        if count and not key.startswith("drugsy_llm_tokens"):
+            breakdown[key] = {"count": int(count), "mean_ms": round(sums.get(key, 0) / count * 1000, 2)}
+    return breakdown
+
+
+def start_app_server(app):
+    """Run the app under uvicorn in a background thread and return (server, base_url)."""
+    import uvicorn
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, name="uvicorn", daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise RuntimeError("uvicorn failed to start")
+        time.sleep(0.05)
+    return server, thread, f"http://127.0.0.1:{port}"
+
+
+async def send_turn(client, endpoint, prompt, conversation_id):
+    """Send one turn and return (ok, conversation_id)."""
+    payload = {"prompt": prompt, "conversation_id": conversation_id}
+    if endpoint == "chat":
+        response = await client.post("/chat", json=payload)
+        if response.status_code != 200:
+            return False, conversation_id
+        return True, response.json()["conversation_id"]
+
+    ok = False
+    async with client.stream("POST", "/chat/stream", json=payload) as response:
+        if response.status_code != 200:
+            return False, conversation_id
+        event = None
+        async for line in response.aiter_lines():
+            if line.startswith("event: "):
+                event = line[len("event: "):]
+            elif line.startswith("data: ") and event == "conversation":
+                conversation_id = json.loads(line[len("data: "):])["conversation_id"]
+            elif line.startswith("data: ") and event == "done":
+                ok = True
+            elif event == "error":
+                ok = False
+    return ok, conversation_id
+
+
+async def run_load(base_url, args, weights):
+    import httpx
+
+    rng = random.Random(args.seed)
+    scenarios = list(weights)
+    queue = asyncio.Queue()
+    for _ in range(args.requests):
+        queue.put_nowait(rng.choices(scenarios, weights=[weights[s] for s in scenarios])[0])
+
+    latencies = defaultdict(list)
+    failures = defaultdict(int)
+    peak_rss = [current_rss_mb()]
+
+    async def worker(client):
+        conversation_id, turns = None, 0
+        while True:
+            try:
+                scenario = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            if turns >= args.turns:
+                conversation_id, turns = None, 0
+            prompt = f"[{scenario}] {PROMPTS[scenario]}"
+            started = time.perf_counter()
+            try:
+                ok, conversation_id = await send_turn(client, args.endpoint, prompt, conversation_id)
+            except httpx.HTTPError as e:
+                print(f"Request failed: {e!r}")
+                ok = False
+            elapsed = time.perf_counter() - started
+            turns += 1
+            if ok:
+                latencies[scenario].append(elapsed)
+            else:
+                failures[scenario] += 1
+
+    async def sample_memory(stop):
+        while not stop.is_set():
+            peak_rss[0] = max(peak_rss[0], current_rss_mb())
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=0.5)
+            except asyncio.TimeoutError:
+                pass
+
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as client:
+        stop = asyncio.Event()
+        sampler = asyncio.create_task(sample_memory(stop))
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+        stop.set()
+        await sampler
+        metrics_text = (await client.get("/metrics")).text
+
+    return latencies, failures, elapsed, peak_rss[0], metrics_text
+
+
+async def warm_up(base_url, endpoint, weights):
+    """Send one turn per scenario so one-time setup (pipeline, imports) is not measured."""
+    import httpx
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=120) as client:
+        for scenario in weights:
+            await send_turn(client, endpoint, f"[{scenario}] {PROMPTS[scenario]}", None)
+
+
+def print_report(results):
+    print("\n==== LOAD TEST RESULTS ====")
+    config = results["config"]
+    endpoint = "/chat" if config["endpoint"] == "chat" else "/chat/stream"
+    print(f"{config['requests']} requests, concurrency {config['concurrency']}, endpoint {endpoint}, "
+          f"LLM delay {config['llm_delay']}s, upstream delay {config['upstream_delay']}s")
+    total = results["total"]
+    print(f"Elapsed {results['elapsed_s']}s, throughput {results['throughput_rps']} req/s, {results['failed']} failed")
+    print(f"{'scenario':<10}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for name, stats in list(results["scenarios"].items()) + [("all", total)]:
+        print(f"{name:<10}{stats['count']:>7}{stats['p50_ms']:>10}{stats['p95_ms']:>10}{stats['p99_ms']:>10}{stats['max_ms']:>10}")
+    memory = results["memory_mb"]
+    print(f"Memory (RSS): {memory['before']} MB before, {memory['after']} MB after, {memory['peak']} MB peak")
+    print("Upstream requests: " + ", ".join(f"{path}={count}" for path, count in results["upstream_requests"].items()))
+    print("Server-side mean latencies:")
+    for key, stats in sorted(results["server"].items()):
+        print(f"  {key}: {stats['mean_ms']} ms over {stats['count']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200, help="Total number of chat turns")
+    parser.add_argument("--concurrency", type=int, default=20, help="Number of concurrent clients")
+    parser.add_argument("--mix", type=parse_mix, default="fda=2,usda=1,pubmed=1,plain=2",
+                        help="Scenario weights, from: " + ", ".join(SCENARIOS))
+    parser.add_argument("--turns", type=int, default=3, help="Turns per conversation before starting a new one")
+    parser.add_argument("--endpoint", choices=["chat", "stream"], default="chat",
+                        help="Send turns to /chat or /chat/stream")
+    parser.add_argument("--llm-delay", type=float, default=0.2, help="Seconds per fake model call")
+    parser.add_argument("--upstream-delay", type=float, default=0.05, help="Seconds per stub upstream request")
+    parser.add_argument("--ncbi-rate", type=float, default=1000,
+                        help="E-utilities requests per second allowed by the scheduler (NCBI allows 3, or 10 with a key)")
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-warmup", action="store_true")
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args()
+    weights = args.mix if isinstance(args.mix, dict) else parse_mix(args.mix)
+
+    upstream = StubUpstreamServer(delay=args.upstream_delay).start()
+    app_module = load_app(ScriptedChatModel(delay=args.llm_delay),
+                          env={**upstream.env(), "NCBI_RATE_LIMIT": str(args.ncbi_rate)})
+    server, thread, base_url = start_app_server(app_module.app)
+    try:
+        if not args.no_warmup:
+            asyncio.run(warm_up(base_url, args.endpoint, weights))
+        upstream.requests.clear()
+        rss_before = current_rss_mb()
+        latencies, failures, elapsed, rss_peak, metrics_text = asyncio.run(run_load(base_url, args, weights))
+        rss_after = current_rss_mb()
+    finally:
+        server.should_exit = True
+        thread.join(timeout=10)
+        upstream.stop()
+
+    everything = [value for values in latencies.values() for value in values]
+    results = {
+        "config": {
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "mix": weights,
+            "turns": args.turns,
+            "endpoint": args.endpoint,
+            "llm_delay": args.llm_delay,
+            "upstream_delay": args.upstream_delay,
+        },
+        "elapsed_s": round(elapsed, 2),
+        "throughput_rps": round(len(everything) / elapsed, 2) if elapsed else 0.0,
+        "failed": sum(failures.values()),
+        "total": summarize(everything),
+        "scenarios": {name: {**summarize(values), "failed": failures.get(name, 0)}
+                      for name, values in sorted(latencies.items())},
+        "memory_mb": {"before": round(rss_before, 1), "after": round(rss_after, 1),
+                      "peak": round(max(rss_peak, rss_after), 1)},
+        "upstream_requests": dict(upstream.requests),
+        "server": server_breakdown(metrics_text),
+    }
+    print_report(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.json}")
+    sys.exit(1 if results["failed"] else 0)
+
+
+if __name__ == "__main__":
+    main()
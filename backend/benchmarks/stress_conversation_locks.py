@@ -0,0 +1,77 @@
+"""
+Stress test: overlapping /chat requests on one conversation must not lose turns.
+
+Fires --requests concurrent /chat calls with the same conversation_id (plus
+the same number spread over other conversations) against the app in-process,
+using a chat model stub that takes --delay seconds to answer. Afterwards
+every prompt must appear exactly once in the stored conversation, directly
+followed by its answer. Exits with status 1 if any turn was lost.
+
+Usage (from the backend directory):
+    python benchmarks/stress_conversation_locks.py [--requests 20] [--delay 0.05]
+"""
+import argparse
+import asyncio
+import sys
+import time
+
+from langchain_core.messages import AIMessage, HumanMessage
+
+from fakes import SlowEchoChatModel, load_app
+
+
+async def run(main, requests):
+    import httpx
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://stress", timeout=120) as client:
+        # Create the shared conversation first
+        response = await client.post("/chat", json={"prompt": "start"})
+        conversation_id = response.json()["conversation_id"]
+
+        prompts = [f"shared-{i}" for i in range(requests)]
+        calls = [client.post("/chat", json={"prompt": p, "conversation_id": conversation_id}) for p in prompts]
+        # Independent conversations must keep running in parallel
+        calls += [client.post("/chat", json={"prompt": f"other-{i}"}) for i in range(requests)]
+
+        started = time.perf_counter()
+        responses = await asyncio.gather(*calls)
+        elapsed = time.perf_counter() - started
+
+    failed = [r.status_code for r in responses if r.status_code != 200]
+    state = main.conversations.get(conversation_id)
+    messages = [m for m in state["messages"] if isinstance(m, (HumanMessage, AIMessage))]
+
+    lost = []
+    for prompt in ["start"] + prompts:
+        positions = [i for i, m in enumerate(messages) if isinstance(m, HumanMessage) and m.content == prompt]
+        if len(positions) != 1:
+            lost.append(f"{prompt}: found {len(positions)} times")
+            continue
+        answer = messages[positions[0] + 1] if positions[0] + 1 < len(messages) else None
+        if not isinstance(answer, AIMessage) or answer.content != f"echo: {prompt}":
+            lost.append(f"{prompt}: answer missing or out of order")
+
+    print(f"{len(calls)} requests in {elapsed:.2f}s, {len(failed)} failed responses")
+    print(f"Shared conversation holds {len(messages)} user/assistant messages")
+    if failed or lost:
+        for problem in lost:
+            print(f"LOST: {problem}")
+        return False
+    print("No turns lost")
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--delay", type=float, default=0.05)
+    args = parser.parse_args()
+
+    app_module = load_app(SlowEchoChatModel(delay=args.delay))
+    ok = asyncio.run(run(app_module, args.requests))
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+"""
+Local stand-in for openFDA, NCBI E-utilities and FoodData Central.
+
+A single threaded HTTP server replays the payloads in benchmarks/fixtures for
+the endpoints the tools call, after an optional delay that stands in for the
+network round-trip. Point the tools at it with the FDA_API_BASE_URL,
+EUTILS_BASE_URL and USDA_API_BASE_URL variables returned by ``env()``.
+
+The fixtures have the shape of real responses; replace them with recorded
+payloads (same file names) to benchmark with production-sized data. PMC
+efetch requests get the PMC fixture article once per requested ID, with the
+ID filled in, like a batched efetch.
+
+Usage (from the backend directory), to serve the fixtures for manual testing:
+    python benchmarks/stub_servers.py [--port 8900] [--delay 0.1]
+"""
+import argparse
+import os
+import re
+import threading
+import time
+from collections import Counter, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from urllib.parse import urlparse, parse_qs
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+# Request path (and "db" parameter for efetch) -> (fixture file, content type)
+ROUTES = {
+    ("/drug/label.json", None): ("openfda_label.json", "application/json"),
+    ("/fdc/v1/foods/search", None): ("usda_foods_search.json", "application/json"),
+    ("/entrez/eutils/esearch.fcgi", None): ("esearch.json", "application/json"),
+    ("/entrez/eutils/esummary.fcgi", None): ("esummary.json", "application/json"),
+    ("/entrez/eutils/elink.fcgi", None): ("elink.xml", "text/xml"),
+    ("/entrez/eutils/efetch.fcgi", "pubmed"): ("efetch_pubmed.xml", "text/xml"),
+    ("/entrez/eutils/efetch.fcgi", "pmc"): ("efetch_pmc.xml", "text/xml"),
+}
+PMC_ROUTE = ("/entrez/eutils/efetch.fcgi", "pmc")
+
+
+class StubUpstreamServer:
+    """
+    Threaded HTTP server replaying fixture payloads.
+
+    Can be used as a context manager; ``requests`` counts the requests served
+    per path and ``throttled`` the E-utilities requests answered with 429.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, delay: float = 0.0,
+                 fixtures_dir: str = FIXTURES_DIR, eutils_rate_limit: Optional[float] = None,
+                 pmc_article_delays: Optional[dict] = None):
+        """
+        Args:
+            host: Interface to listen on
+            port: Port to listen on, 0 for any free port
+            delay: Seconds to wait before answering each request
+            fixtures_dir: Directory holding the fixture payloads
+            eutils_rate_limit: Like NCBI, answer 429 to E-utilities requests beyond
+                               this many in the last second
+            pmc_article_delays: Extra seconds taken before sending the articles of
+                                these PMC IDs in PMC efetch answers, to stand in for
+                                slow articles; the articles before them are sent at once
+        """
+        self.delay = delay
+        self.eutils_rate_limit = eutils_rate_limit
+        self.pmc_article_delays = pmc_article_delays or {}
+        self.requests = Counter()
+        self.throttled = 0
+        self._eutils_arrivals = deque()
+        self._payloads = {}
+        for route, (filename, content_type) in ROUTES.items():
+            with open(os.path.join(fixtures_dir, filename), "rb") as f:
+                self._payloads[route] = (f.read(), content_type)
+        self._counter_lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    def _handler_class(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                query = parse_qs(url.query)
+                db = query.get("db", [None])[0]
+                payload = stub._payloads.get((url.path, db)) or stub._payloads.get((url.path, None))
+                delay = stub.delay
+                parts = None
+                if (url.path, db) == PMC_ROUTE:
+                    pmcids = [pmcid for value in query.get("id", []) for pmcid in value.split(",") if pmcid]
+                    parts = stub._pmc_articleset(pmcids)
+                    payload = (b"".join(part for _, part in parts), payload[1])
+                with stub._counter_lock:
+                    stub.requests[url.path] += 1
+                    throttled = url.path.startswith("/entrez/") and stub._over_rate_limit()
+                if delay:
+                    time.sleep(delay)
+                if throttled:
+                    body, content_type, status = b'{"error":"API rate limit exceeded"}', "application/json", 429
+                elif payload is None:
+                    body, content_type, status = b'{"error": "not found"}', "application/json", 404
+                else:
+                    (body, content_type), status = payload, 200
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                if status == 200 and parts:
+                    for part_delay, part in parts:
+                        if part_delay:
+                            self.wfile.flush()
+                            time.sleep(part_delay)
+                        self.wfile.write(part)
+                else:
+                    self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                # Keep benchmark output readable
+                pass
+
+        return Handler
+
+    def _pmc_articleset(self, pmcids: list) -> list:
+        """
+        The PMC fixture with its article repeated for each of pmcids, as
+        (seconds to wait before sending it, bytes) parts.
+        """
+        body = self._payloads[PMC_ROUTE][0]
+        head, rest = body.split(b"<article ", 1)
+        article, tail = rest.rsplit(b"</article>", 1)
+        article = b"<article " + article + b"</article>"
+        articles = [
+            re.sub(rb'(<article-id pub-id-type="pmc">)PMC\d+', rb"\g<1>PMC" + pmcid.upper().removeprefix("PMC").encode(), article)
+            for pmcid in pmcids
+        ]
+        delays = [self.pmc_article_delays.get(pmcid, 0) for pmcid in pmcids]
+        return [(0, head)] + list(zip(delays, articles)) + [(0, tail)]
+
+    def _over_rate_limit(self) -> bool:
+        # Called with the counter lock held
+        if self.eutils_rate_limit is None:
+            return False
+        now = time.monotonic()
+        while self._eutils_arrivals and self._eutils_arrivals[0] <= now - 1:
+            self._eutils_arrivals.popleft()
+        self._eutils_arrivals.append(now)
+        if len(self._eutils_arrivals) > self.eutils_rate_limit:
+            self.throttled += 1
+            return True
+        return False
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def env(self) -> dict:
+        """Environment variables pointing the tools at this server."""
+        return {
+            "FDA_API_BASE_URL": self.base_url,
+            "USDA_API_BASE_URL": f"{self.base_url}/fdc/v1",
+            "EUTILS_BASE_URL": f"{self.base_url}/entrez/eutils",
+        }
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="stub-upstream", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--delay", type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = StubUpstreamServer(port=args.port, delay=args.delay)
+    for name, value in server.env().items():
+        print(f"{name}={value}")
+    try:
+        server._server.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
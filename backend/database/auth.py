@@ -74,7 +74,8 @@ def get_current_active_user(current_user: User = Depends(get_current_user)):
         raise HTTPException(status_code=400, detail="Inactive user")
     return current_user
 
-async def get_current_user_optional(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+# Declared sync so FastAPI runs the database lookup in its threadpool instead of on the event loop
+def get_current_user_optional(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
     if token is None:
         return None
     try:
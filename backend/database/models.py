@@ -1,4 +1,4 @@
-from sqlalchemy import Boolean, Column, Integer, String, DateTime, JSON, Text, ForeignKey
+from sqlalchemy import Boolean, Column, Integer, String, DateTime, JSON, Text, ForeignKey, UniqueConstraint
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from .database import Base
@@ -51,3 +51,31 @@ class Patient(Base):
     
     # Relationship with doctor
     doctor = relationship("User", back_populates="patients")
+
+
+class Conversation(Base):
+    __tablename__ = "conversations"
+
+    id = Column(String, primary_key=True, index=True)
+    fields = Column(JSON, nullable=True)  # Non-message state fields (finished, order, ...)
+    message_count = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+
+    # Relationship with messages
+    messages = relationship("ConversationMessage", back_populates="conversation", order_by="ConversationMessage.position")
+
+
+class ConversationMessage(Base):
+    __tablename__ = "conversation_messages"
+    # A position can only be written once, so concurrent writers cannot overwrite each other
+    __table_args__ = (UniqueConstraint("conversation_id", "position", name="uq_conversation_message_position"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    conversation_id = Column(String, ForeignKey("conversations.id"), index=True, nullable=False)
+    position = Column(Integer, nullable=False)
+    message = Column(JSON, nullable=False)  # Serialized LangChain message
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    # Relationship with conversation
+    conversation = relationship("Conversation", back_populates="messages")
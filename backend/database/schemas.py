@@ -99,3 +99,22 @@ class Patient(PatientBase):
 
     class Config:
         from_attributes = True
+
+# Schemas for the medication interaction scan
+class ScannedMedication(BaseModel):
+    name: str
+    ingredients: List[str]
+    resolved: bool
+
+class DrugInteraction(BaseModel):
+    drugs: List[str]
+    ingredients: List[str]
+    severity: str
+    snippet: str
+    source: str
+
+class InteractionScan(BaseModel):
+    medications: List[ScannedMedication]
+    interactions: List[DrugInteraction]
+    pairs_checked: int
+    elapsed_ms: float
@@ -1,8 +1,15 @@
-from typing import TypedDict, Annotated, Literal
+from typing import TypedDict, Annotated, Literal, AsyncIterator, Tuple, Any
+import time
 from langgraph.graph import add_messages, StateGraph, START, END
-from langgraph.prebuilt import ToolNode
 from langchain_core.messages.ai import AIMessage
 from langchain_core.messages import HumanMessage, SystemMessage
+from langchain_core.runnables import RunnableConfig, RunnableLambda
+from .context_window import ContextWindow
+from .tool_node import ConcurrentToolNode
+from monitoring import METRICS_CALLBACK
+
+# Tag of the chatbot's answer model; astream_message streams only its tokens
+ANSWER_TAG = "chatbot_answer"
 
 # Define the state type
 class ApiState(TypedDict):
@@ -18,22 +25,44 @@ class ApiState(TypedDict):
     
     # Flag indicating that the order is placed and completed.
     finished: bool
+    
+    # Rolling summary of the turns that no longer fit in the context window,
+    # and how many turns it covers.
+    summary: str
+    summarized_turns: int
 
-def create_api_graph(llm_with_tools, tools, system_prompt, welcome_msg):
+def create_api_graph(llm_with_tools, tools, system_prompt, welcome_msg, context_window=None, tool_node=None):
     """
     Create the LangGraph for the Drug Interaction Bot API.
     
+    The graph is meant to be compiled once and shared by every request. A
+    personalized system prompt is passed per invocation through
+    config["configurable"]["system_prompt"]; system_prompt is the default.
+    
     Args:
         llm_with_tools: The LLM with tools attached
         tools: List of tools to use
         system_prompt: The system prompt for the bot
         welcome_msg: The welcome message for the bot
+        context_window: ContextWindow bounding the history sent to the LLM
+                        (defaults to one with an extractive summary)
+        tool_node: ConcurrentToolNode running the tool calls (defaults to one
+                   with the configured concurrency limits and timeouts)
         
     Returns:
         The compiled graph
     """
-    # Define the tools and create a "tools" node.
-    tool_node = ToolNode(tools)
+    # Bound the history sent to the LLM on every step
+    if context_window is None:
+        context_window = ContextWindow()
+    
+    # Run the tool calls of a message concurrently, with per-tool limits and timeouts
+    if tool_node is None:
+        tool_node = ConcurrentToolNode(tools)
+    
+    # Tell the answer apart from other LLM calls made while the graph runs
+    # (the context window summary, the PubMed RAG answer)
+    llm_with_tools = llm_with_tools.with_config(tags=[ANSWER_TAG])
     
     def maybe_route_to_tools(state: ApiState) -> str:
         """Route between tools or end, depending if a tool call is made."""
@@ -50,39 +79,51 @@ def create_api_graph(llm_with_tools, tools, system_prompt, welcome_msg):
             # Use the END constant from langgraph
             return END
     
-    def chatbot_with_tools(state: ApiState) -> ApiState:
+    def get_system_message(config: RunnableConfig, summary_text: str = "") -> SystemMessage:
+        """Build the system message, preferring the personalized prompt of this request."""
+        prompt = config.get("configurable", {}).get("system_prompt") or system_prompt
+        
+        # Convert system_prompt tuple to a SystemMessage if it's a tuple
+        if isinstance(prompt, tuple):
+            prompt = prompt[1]
+        return SystemMessage(content=prompt + summary_text)
+    
+    def chatbot_with_tools(state: ApiState, config: RunnableConfig) -> ApiState:
         """The chatbot with tools. A simple wrapper around the model's own chat interface."""
         defaults = {"order": [], "finished": False}
+        summary_update = {}
     
         if state["messages"]:
-            # Usar el mensaje de sistema personalizado si está disponible
-            if "system_message" in state:
-                system_message = SystemMessage(content=state["system_message"])
-            else:
-                # Convert system_prompt tuple to a SystemMessage if it's a tuple
-                if isinstance(system_prompt, tuple):
-                    system_content = system_prompt[1]
-                    system_message = SystemMessage(content=system_content)
-                else:
-                    system_message = SystemMessage(content=system_prompt)
-            
-            # Mantener el comportamiento original sin modificaciones
-                
-            # Invoke the LLM with the system message and the state messages
-            new_output = llm_with_tools.invoke([system_message] + state["messages"])
+            # Send the recent turns verbatim and older ones as a rolling summary
+            history, summary_text, summary_update = context_window.build(state)
+            # Invoke the LLM with the system message and the bounded history
+            new_output = llm_with_tools.invoke([get_system_message(config, summary_text)] + history)
         else:
             new_output = AIMessage(content=welcome_msg)
     
         # Set up some defaults if not already set, then pass through the provided state,
-        # overriding only the "messages" field.
-        return defaults | state | {"messages": [new_output]}
+        # overriding only the "messages" field and the summary.
+        return defaults | state | summary_update | {"messages": [new_output]}
+    
+    async def achatbot_with_tools(state: ApiState, config: RunnableConfig) -> ApiState:
+        """Async version of chatbot_with_tools, used when the graph runs with ainvoke."""
+        defaults = {"order": [], "finished": False}
+        summary_update = {}
+    
+        if state["messages"]:
+            history, summary_text, summary_update = await context_window.abuild(state)
+            new_output = await llm_with_tools.ainvoke([get_system_message(config, summary_text)] + history)
+        else:
+            new_output = AIMessage(content=welcome_msg)
+    
+        return defaults | state | summary_update | {"messages": [new_output]}
     
     # Build the graph
     graph_builder = StateGraph(ApiState)
     
     # Add the nodes
-    graph_builder.add_node("chatbot", chatbot_with_tools)
-    graph_builder.add_node("tools", tool_node)
+    graph_builder.add_node("chatbot", RunnableLambda(chatbot_with_tools, afunc=achatbot_with_tools))
+    graph_builder.add_node("tools", tool_node.as_runnable())
     
     # Add the edges
     graph_builder.add_conditional_edges("chatbot", maybe_route_to_tools)
@@ -92,7 +133,7 @@ def create_api_graph(llm_with_tools, tools, system_prompt, welcome_msg):
     # Compile the graph
     return graph_builder.compile()
 
-def process_message(graph, state, message_content):
+def process_message(graph, state, message_content, system_prompt=None):
     """
     Process a single message through the graph and return the result.
     
@@ -100,10 +141,93 @@ def process_message(graph, state, message_content):
         graph: The compiled graph
         state: The current state
         message_content: The content of the message to process
+        system_prompt: Optional personalized system prompt for this message,
+                       either a (type, content) tuple or just the content
         
     Returns:
         The updated state after processing the message
     """
+    # Process the message through the graph
+    return graph.invoke(*_prepare_invocation(state, message_content, system_prompt))
+
+async def aprocess_message(graph, state, message_content, system_prompt=None):
+    """
+    Async version of process_message. Runs the graph with ainvoke so model and
+    tool calls do not block the event loop.
+    
+    Args:
+        graph: The compiled graph
+        state: The current state
+        message_content: The content of the message to process
+        system_prompt: Optional personalized system prompt for this message
+        
+    Returns:
+        The updated state after processing the message
+    """
+    return await graph.ainvoke(*_prepare_invocation(state, message_content, system_prompt))
+
+async def astream_message(graph, state, message_content, system_prompt=None) -> AsyncIterator[Tuple[str, Any]]:
+    """
+    Process a message like aprocess_message, yielding progress events as they happen.
+    
+    Args:
+        graph: The compiled graph
+        state: The current state
+        message_content: The content of the message to process
+        system_prompt: Optional personalized system prompt for this message
+        
+    Yields:
+        (event, data) pairs: "token" for the chatbot's answer, "node_start"/"node_end" and
+        "tool_start"/"tool_end" with durations in milliseconds ("error" is set
+        on the tool_end of failed calls, "coalesced" on the events of calls
+        answered by an identical running call), "stage" for custom progress events
+        dispatched by tools, and finally "final_state" with the updated state.
+    """
+    new_state, config = _prepare_invocation(state, message_content, system_prompt)
+    started = {}
+    
+    async for event in graph.astream_events(new_state, config=config, version="v2"):
+        kind = event["event"]
+        name = event.get("name")
+        run_id = event.get("run_id")
+        
+        if kind == "on_chat_model_stream":
+            # Only the chatbot's answer; summaries and tool LLM calls stream too
+            if ANSWER_TAG not in event.get("tags", []) or event.get("metadata", {}).get("langgraph_node") != "chatbot":
+                continue
+            content = event["data"]["chunk"].content
+            if isinstance(content, str) and content:
+                yield "token", {"content": content}
+        elif kind == "on_tool_start":
+            started[run_id] = time.perf_counter()
+            yield "tool_start", {"name": name, "input": event["data"].get("input"), **_coalesced(event)}
+        elif kind == "on_tool_end":
+            duration = (time.perf_counter() - started.pop(run_id, time.perf_counter())) * 1000
+            yield "tool_end", {"name": name, "duration_ms": round(duration, 1), **_coalesced(event)}
+        elif kind == "on_tool_error":
+            # Failed and timed-out tool calls end too, so clients don't wait for them
+            duration = (time.perf_counter() - started.pop(run_id, time.perf_counter())) * 1000
+            yield "tool_end", {"name": name, "duration_ms": round(duration, 1), "error": True, **_coalesced(event)}
+        elif kind == "on_custom_event":
+            yield "stage", {"name": name, **(event["data"] if isinstance(event["data"], dict) else {"data": event["data"]})}
+        elif kind in ("on_chain_start", "on_chain_end") and name == event.get("metadata", {}).get("langgraph_node"):
+            # Only the graph nodes themselves, not the runnables nested inside them
+            if kind == "on_chain_start":
+                started[run_id] = time.perf_counter()
+                yield "node_start", {"name": name}
+            else:
+                duration = (time.perf_counter() - started.pop(run_id, time.perf_counter())) * 1000
+                yield "node_end", {"name": name, "duration_ms": round(duration, 1)}
+        elif kind == "on_chain_end" and not event.get("parent_ids"):
+            # The root run ends with the final state of the graph
+            yield "final_state", event["data"]["output"]
+
+def _coalesced(event: dict) -> dict:
+    """Marks the tool events of a call that shared an identical running call's result."""
+    return {"coalesced": True} if event.get("metadata", {}).get("coalesced") else {}
+
+def _prepare_invocation(state, message_content, system_prompt):
+    """Build the graph input and config for a new user message."""
     # Create a new state with the message
     if not state:
         # Initialize state if it doesn't exist
@@ -115,12 +239,9 @@ def process_message(graph, state, message_content):
     # Add the message to the state
     new_state["messages"] = new_state["messages"] + [HumanMessage(content=message_content)]
     
-    # Si hay un mensaje de sistema personalizado, lo usamos
-    if "system_message" in state:
-        # Guardamos el mensaje de sistema en el nuevo estado
-        new_state["system_message"] = state["system_message"]
-    
-    # Process the message through the graph
-    result_state = graph.invoke(new_state)
+    # Pass the personalized system prompt through the config so the compiled graph can be shared
+    config = {"configurable": {"system_prompt": system_prompt}} if system_prompt else {}
+    # Record node, tool and LLM latencies for /metrics
+    config["callbacks"] = [METRICS_CALLBACK]
     
-    return result_state
+    return new_state, config
@@ -0,0 +1,253 @@
+from typing import List, Tuple
+import os
+import dotenv
+from langchain_core.messages import (
+    AIMessage,
+    BaseMessage,
+    HumanMessage,
+    SystemMessage,
+    ToolMessage,
+)
+
+dotenv.load_dotenv()
+
+# Number of turns (user message plus everything that answered it) sent verbatim,
+# including the turn being answered
+CONTEXT_MAX_TURNS = int(os.getenv("CONTEXT_MAX_TURNS", "6"))
+# Approximate token budget for the history sent to the model
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "24000"))
+# Tool outputs from earlier turns are cut down to this many characters
+STALE_TOOL_OUTPUT_CHARS = int(os.getenv("CONTEXT_STALE_TOOL_OUTPUT_CHARS", "600"))
+# Turns evicted at a time once the verbatim window is full, so the summary is
+# written every this many turns instead of on every turn
+CONTEXT_SUMMARY_EVERY_TURNS = int(os.getenv("CONTEXT_SUMMARY_EVERY_TURNS", "4"))
+# Upper bound for the rolling summary of evicted turns
+SUMMARY_MAX_CHARS = int(os.getenv("CONTEXT_SUMMARY_MAX_CHARS", "4000"))
+
+# Rough characters-per-token ratio used to estimate prompt size without a tokenizer
+CHARS_PER_TOKEN = 4
+
+SUMMARY_PROMPT = """You maintain a running summary of a conversation between a doctor and Drugsy, a medical assistant.
+Update the summary with the new conversation turns below. Keep drugs, doses, patient facts, interactions found,
+recommendations given, cited PMIDs and open questions. Drop greetings and repetition. Answer with the summary only,
+in at most {max_chars} characters.
+
+CURRENT SUMMARY:
+{summary}
+
+NEW TURNS:
+{turns}"""
+
+
+def _content_text(message: BaseMessage) -> str:
+    """Return the text of a message whose content may be a string or a list of parts."""
+    content = message.content
+    if isinstance(content, str):
+        return content
+    parts = []
+    for part in content:
+        if isinstance(part, str):
+            parts.append(part)
+        elif isinstance(part, dict) and "text" in part:
+            parts.append(part["text"])
+    return " ".join(parts)
+
+
+def estimate_tokens(messages: List[BaseMessage]) -> int:
+    """Approximate the number of tokens of a list of messages."""
+    chars = 0
+    for message in messages:
+        chars += len(_content_text(message))
+        for tool_call in getattr(message, "tool_calls", None) or []:
+            chars += len(str(tool_call.get("args", "")))
+    return chars // CHARS_PER_TOKEN
+
+
+def split_turns(messages: List[BaseMessage]) -> List[List[BaseMessage]]:
+    """
+    Split a conversation into turns. A turn starts at a user message and holds
+    every AI and tool message that answered it; messages before the first user
+    message (the welcome message) form their own turn. System messages are
+    dropped because the chatbot node always sends its own.
+    """
+    turns: List[List[BaseMessage]] = []
+    for message in messages:
+        if isinstance(message, SystemMessage):
+            continue
+        if isinstance(message, HumanMessage) or not turns:
+            turns.append([message])
+        else:
+            turns[-1].append(message)
+    return turns
+
+
+def _compact_turn(turn: List[BaseMessage], max_tool_chars: int) -> List[BaseMessage]:
+    """Truncate the tool outputs of an earlier turn, keeping tool calls paired with their results."""
+    compacted = []
+    for message in turn:
+        if isinstance(message, ToolMessage):
+            text = _content_text(message)
+            if len(text) > max_tool_chars:
+                message = message.model_copy(update={
+                    "content": text[:max_tool_chars] + " ... [truncated earlier tool output]"
+                })
+        compacted.append(message)
+    return compacted
+
+
+def _turn_transcript(turn: List[BaseMessage], max_tool_chars: int) -> str:
+    lines = []
+    for message in turn:
+        text = _content_text(message)
+        if isinstance(message, HumanMessage):
+            lines.append(f"Doctor: {text}")
+        elif isinstance(message, ToolMessage):
+            lines.append(f"Tool {message.name or ''} result: {text[:max_tool_chars]}")
+        elif isinstance(message, AIMessage):
+            if text:
+                lines.append(f"Drugsy: {text}")
+            for tool_call in message.tool_calls or []:
+                lines.append(f"Drugsy called {tool_call.get('name')} with {tool_call.get('args')}")
+    return "\n".join(lines)
+
+
+class ContextWindow:
+    """
+    Bounded conversation context for the chatbot node.
+
+    The last ``max_turns`` turns are sent verbatim (tool outputs of earlier
+    turns truncated), older turns are folded into a rolling summary stored in
+    the state, and turns are evicted early when the history would exceed
+    ``token_budget``. The turn being answered is always sent in full.
+
+    Turns are evicted ``summary_every`` at a time: the window grows to
+    ``max_turns + summary_every - 1`` turns and then shrinks back to
+    ``max_turns``, so the summarizer runs once every ``summary_every`` turns
+    rather than before every answer.
+    """
+
+    def __init__(self, summarizer=None, max_turns: int = CONTEXT_MAX_TURNS,
+                 token_budget: int = CONTEXT_TOKEN_BUDGET,
+                 stale_tool_chars: int = STALE_TOOL_OUTPUT_CHARS,
+                 summary_max_chars: int = SUMMARY_MAX_CHARS,
+                 summary_every: int = CONTEXT_SUMMARY_EVERY_TURNS):
+        """
+        Args:
+            summarizer: Optional chat model used to write the rolling summary. Without
+                        one (or if it fails) an extractive summary is used instead.
+            max_turns: Number of most recent turns sent verbatim
+            token_budget: Approximate token budget for history plus summary
+            stale_tool_chars: Characters kept from tool outputs of earlier turns
+            summary_max_chars: Maximum length of the rolling summary
+            summary_every: Number of turns evicted into the summary at a time
+        """
+        self.summarizer = summarizer
+        self.max_turns = max(1, max_turns)
+        self.token_budget = token_budget
+        self.stale_tool_chars = stale_tool_chars
+        self.summary_max_chars = summary_max_chars
+        self.summary_every = max(1, summary_every)
+
+    def _plan(self, state) -> Tuple[List[List[BaseMessage]], int, int]:
+        """
+        Decide which turns are sent verbatim.
+
+        Returns:
+            (turns, summarized_turns, keep_from): turns[summarized_turns:keep_from]
+            must be folded into the summary, turns[keep_from:] are sent.
+        """
+        turns = split_turns(state.get("messages", []))
+        summarized_turns = min(state.get("summarized_turns", 0), max(len(turns) - 1, 0))
+        current = len(turns) - 1
+
+        keep_from = summarized_turns
+        if current - keep_from >= self.max_turns + self.summary_every - 1:
+            keep_from = current - (self.max_turns - 1)
+        summary_tokens = self.summary_max_chars // CHARS_PER_TOKEN
+        budget_from = keep_from
+        while budget_from < current:
+            kept = [m for turn in turns[budget_from:current] for m in _compact_turn(turn, self.stale_tool_chars)]
+            if estimate_tokens(kept + turns[current]) + summary_tokens <= self.token_budget:
+                break
+            budget_from += 1
+        if budget_from > keep_from:
+            # Over the budget, still evict a whole block so the next turns fit without summarizing
+            keep_from = min(current, max(budget_from, summarized_turns + self.summary_every))
+        return turns, summarized_turns, keep_from
+
+    def _extractive_summary(self, summary: str, turns: List[List[BaseMessage]]) -> str:
+        parts = [summary] if summary else []
+        for turn in turns:
+            question = next((_content_text(m) for m in turn if isinstance(m, HumanMessage)), "")
+            answer = next((_content_text(m) for m in reversed(turn)
+                           if isinstance(m, AIMessage) and not m.tool_calls), "")
+            if question:
+                parts.append(f"Doctor asked: {question[:200]}")
+            if answer:
+                parts.append(f"Drugsy answered: {answer[:300]}")
+        # Keep the most recent part of the summary when it grows too long
+        return "\n".join(parts)[-self.summary_max_chars:]
+
+    def _summary_prompt(self, summary: str, turns: List[List[BaseMessage]]) -> str:
+        transcript = "\n\n".join(_turn_transcript(turn, self.stale_tool_chars) for turn in turns)
+        return SUMMARY_PROMPT.format(max_chars=self.summary_max_chars, summary=summary or "(empty)", turns=transcript)
+
+    def _assemble(self, turns, keep_from: int, summary: str) -> Tuple[List[BaseMessage], str]:
+        current = len(turns) - 1
+        messages = []
+        for index in range(keep_from, len(turns)):
+            turn = turns[index]
+            messages.extend(turn if index == current else _compact_turn(turn, self.stale_tool_chars))
+        summary_text = f"\n\nSummary of the earlier conversation:\n{summary}" if summary else ""
+        return messages, summary_text
+
+    def build(self, state) -> Tuple[List[BaseMessage], str, dict]:
+        """
+        Build the bounded history for the next model call.
+
+        Args:
+            state: The conversation state
+
+        Returns:
+            (messages, summary_text, state_update): the messages to send, text to
+            append to the system prompt, and the summary fields to store in the state.
+        """
+        turns, summarized_turns, keep_from = self._plan(state)
+        summary = state.get("summary", "")
+        update = {}
+        if keep_from > summarized_turns:
+            evicted = turns[summarized_turns:keep_from]
+            summary = self._summarize(summary, evicted)
+            update = {"summary": summary, "summarized_turns": keep_from}
+        messages, summary_text = self._assemble(turns, keep_from, summary)
+        return messages, summary_text, update
+
+    async def abuild(self, state) -> Tuple[List[BaseMessage], str, dict]:
+        """Async version of build, used when the graph runs with ainvoke."""
+        turns, summarized_turns, keep_from = self._plan(state)
+        summary = state.get("summary", "")
+        update = {}
+        if keep_from > summarized_turns:
+            evicted = turns[summarized_turns:keep_from]
+            summary = await self._asummarize(summary, evicted)
+            update = {"summary": summary, "summarized_turns": keep_from}
+        messages, summary_text = self._assemble(turns, keep_from, summary)
+        return messages, summary_text, update
+
+    def _summarize(self, summary: str, turns: List[List[BaseMessage]]) -> str:
+        if self.summarizer is not None:
+            try:
+                response = self.summarizer.invoke(self._summary_prompt(summary, turns))
+                return _content_text(response)[:self.summary_max_chars]
+            except Exception as e:
+                print(f"Failed to summarize conversation, using extractive summary: {e}")
+        return self._extractive_summary(summary, turns)
+
+    async def _asummarize(self, summary: str, turns: List[List[BaseMessage]]) -> str:
+        if self.summarizer is not None:
+            try:
+                response = await self.summarizer.ainvoke(self._summary_prompt(summary, turns))
+                return _content_text(response)[:self.summary_max_chars]
+            except Exception as e:
+                print(f"Failed to summarize conversation, using extractive summary: {e}")
+        return self._extractive_summary(summary, turns)
@@ -0,0 +1,123 @@
+"""
+Single-flight execution: while a call for a key is running, callers with the
+same key wait for it and share its result instead of running it again.
+"""
+import asyncio
+import json
+import threading
+import weakref
+from typing import Any, Awaitable, Callable, Hashable, Optional, Tuple
+
+
+def normalize_arguments(value):
+    """Lowercase strings and collapse their whitespace, recursively."""
+    if isinstance(value, str):
+        return " ".join(value.lower().split())
+    if isinstance(value, dict):
+        return {key: normalize_arguments(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [normalize_arguments(item) for item in value]
+    return value
+
+
+def call_key(name: str, args: dict, normalize: Optional[Callable[[dict], Any]] = None) -> Tuple[str, str]:
+    """
+    Key identifying a tool call by its name and normalized arguments.
+
+    Args:
+        name: Name of the tool
+        args: Arguments of the call
+        normalize: Turns the arguments into the value compared; defaults to
+                   normalize_arguments, which is wrong for case-sensitive arguments
+    """
+    value = normalize(args) if normalize is not None else normalize_arguments(args)
+    return name, json.dumps(value, sort_keys=True, default=str)
+
+
+class _Call:
+    """A call running on a thread, waited for by the other threads."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class _Flight:
+    """A call running as a task, with the number of coroutines waiting for it."""
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key.
+
+    Only calls in flight are shared: once a call finishes, the next caller with
+    its key runs it again. Threads share calls with threads, and coroutines with
+    coroutines of the same event loop.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._flights = weakref.WeakKeyDictionary()
+
+    def do(self, key: Hashable, func: Callable[[], Any]) -> Tuple[Any, bool]:
+        """
+        Run func, or wait for the running call with the same key.
+
+        Returns:
+            (result, shared): shared is True when the result came from another caller's call
+
+        Raises:
+            Whatever the call raised, to every caller sharing it
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            shared = call is not None
+            if not shared:
+                call = self._calls[key] = _Call()
+        if shared:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = func()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+    def ain_flight(self, key: Hashable) -> bool:
+        """Whether a call with this key is running on the current event loop, so ado would join it."""
+        return key in self._flights.get(asyncio.get_running_loop(), {})
+
+    async def ado(self, key: Hashable, factory: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """
+        Async version of do. The call runs as its own task, so a caller that is
+        cancelled doesn't cancel it for the others; it is cancelled once every
+        caller has given up on it.
+        """
+        flights = self._flights.setdefault(asyncio.get_running_loop(), {})
+        flight = flights.get(key)
+        shared = flight is not None
+        if not shared:
+            flight = flights[key] = _Flight(asyncio.ensure_future(factory()))
+            flight.task.add_done_callback(lambda _: flights.pop(key, None))
+
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task), shared
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                flight.task.cancel()
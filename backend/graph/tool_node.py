@@ -0,0 +1,299 @@
+"""
+Tools node running the tool calls of a model message concurrently.
+
+The system prompt asks the model to split PubMed searches into several
+subqueries, so one message often carries several independent tool calls.
+They run at the same time, bounded by a per-tool concurrency limit shared by
+every conversation, and each call gets its own timeout. The ToolMessages come
+back in the order of the tool calls, with the call duration in their
+response_metadata.
+
+Identical calls of read-only tools (same tool and normalized arguments) that
+run at the same time, whether repeated within a message or sent by different
+conversations, are executed once and share the result.
+"""
+import asyncio
+import os
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Optional
+from uuid import uuid4
+
+import dotenv
+from langchain_core.callbacks.manager import AsyncCallbackManagerForToolRun
+from langchain_core.messages import ToolMessage
+from langchain_core.runnables import RunnableConfig, RunnableLambda
+from langchain_core.runnables.config import get_async_callback_manager_for_config
+
+from monitoring import TOOL_SINGLE_FLIGHT
+from .single_flight import SingleFlight, call_key
+
+dotenv.load_dotenv()
+
+
+def _parse_overrides(value: str) -> Dict[str, float]:
+    """Parse per-tool settings written as "tool=value,tool=value"."""
+    overrides = {}
+    for item in value.split(","):
+        name, _, setting = item.partition("=")
+        if name.strip() and setting.strip():
+            overrides[name.strip()] = float(setting)
+    return overrides
+
+
+# Calls of the same tool allowed to run at once across all conversations
+TOOL_MAX_CONCURRENCY = int(os.getenv("TOOL_MAX_CONCURRENCY", "4"))
+# Seconds a tool call may take before the model gets a timeout error instead
+TOOL_CALL_TIMEOUT = float(os.getenv("TOOL_CALL_TIMEOUT", "90"))
+# Per-tool overrides, e.g. TOOL_CONCURRENCY_OVERRIDES="query_pubmed_api=2"
+TOOL_CONCURRENCY_OVERRIDES = _parse_overrides(os.getenv("TOOL_CONCURRENCY_OVERRIDES", ""))
+TOOL_TIMEOUT_OVERRIDES = _parse_overrides(os.getenv("TOOL_TIMEOUT_OVERRIDES", ""))
+# Tools whose identical concurrent calls share one execution; only read-only tools belong here
+SINGLE_FLIGHT_TOOLS = [
+    name.strip()
+    for name in os.getenv(
+        "SINGLE_FLIGHT_TOOLS", "query_fda_api,query_fda_api_batch,query_pubmed_api,query_usda_food_data").split(",")
+    if name.strip()
+]
+
+
+class ConcurrentToolNode:
+    """
+    Replacement for LangGraph's ToolNode that runs the tool calls of the last
+    AI message concurrently.
+
+    Args:
+        tools: Tools the model can call
+        max_concurrency: Per-tool limit of simultaneous calls, overriding the default
+        timeouts: Per-tool timeout in seconds, overriding the default
+        default_concurrency: Limit for tools not in max_concurrency
+        default_timeout: Timeout for tools not in timeouts
+        single_flight: Tools whose identical concurrent calls share one execution
+        call_keys: Per-tool functions turning call arguments into the value that
+                   makes calls identical (see single_flight.call_key)
+    """
+
+    def __init__(self, tools, max_concurrency: Optional[Dict[str, int]] = None,
+                 timeouts: Optional[Dict[str, float]] = None,
+                 default_concurrency: int = TOOL_MAX_CONCURRENCY,
+                 default_timeout: float = TOOL_CALL_TIMEOUT,
+                 single_flight: Iterable[str] = SINGLE_FLIGHT_TOOLS,
+                 call_keys: Optional[Dict[str, Callable[[dict], Any]]] = None):
+        self.tools = {tool.name: tool for tool in tools}
+        self.single_flight = set(single_flight)
+        self.call_keys = call_keys or {}
+        self._flights = SingleFlight()
+        self.max_concurrency = {**TOOL_CONCURRENCY_OVERRIDES, **(max_concurrency or {})}
+        self.timeouts = {**TOOL_TIMEOUT_OVERRIDES, **(timeouts or {})}
+        self.default_concurrency = default_concurrency
+        self.default_timeout = default_timeout
+        # Threads and event loops need their own kind of semaphore
+        self._semaphores: Dict[str, threading.BoundedSemaphore] = {}
+        self._async_semaphores = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def limit(self, name: str) -> int:
+        return max(1, int(self.max_concurrency.get(name, self.default_concurrency)))
+
+    def timeout(self, name: str) -> float:
+        return self.timeouts.get(name, self.default_timeout)
+
+    def _semaphore(self, name: str) -> threading.BoundedSemaphore:
+        with self._lock:
+            if name not in self._semaphores:
+                self._semaphores[name] = threading.BoundedSemaphore(self.limit(name))
+            return self._semaphores[name]
+
+    def _async_semaphore(self, name: str) -> asyncio.Semaphore:
+        # asyncio semaphores belong to one event loop
+        semaphores = self._async_semaphores.setdefault(asyncio.get_running_loop(), {})
+        if name not in semaphores:
+            semaphores[name] = asyncio.Semaphore(self.limit(name))
+        return semaphores[name]
+
+    def _call_key(self, call: dict):
+        return call_key(call["name"], call["args"], self.call_keys.get(call["name"]))
+
+    def as_runnable(self) -> RunnableLambda:
+        """Wrap the node so it can be added to a StateGraph."""
+        return RunnableLambda(self.invoke, afunc=self.ainvoke, name="tools")
+
+    @staticmethod
+    def _tool_calls(state) -> list:
+        messages = state.get("messages", []) if isinstance(state, dict) else state
+        if not messages:
+            raise ValueError("No message found in input")
+        return messages[-1].tool_calls
+
+    @staticmethod
+    def _error_message(call: dict, content: str, duration: float, outcome: str) -> ToolMessage:
+        return ToolMessage(
+            content=content,
+            name=call["name"],
+            tool_call_id=call["id"],
+            status="error",
+            response_metadata={"duration_ms": round(duration * 1000, 1), "outcome": outcome},
+        )
+
+    def _unknown_tool(self, call: dict) -> Optional[ToolMessage]:
+        if call["name"] in self.tools:
+            return None
+        return self._error_message(
+            call, f"Error: {call['name']} is not a valid tool, try one of [{', '.join(self.tools)}].", 0, "error")
+
+    def _finish(self, call: dict, output, duration: float) -> ToolMessage:
+        """Turn a tool output into a ToolMessage for the call, carrying the call duration."""
+        if not isinstance(output, ToolMessage):
+            output = ToolMessage(content=str(output), name=call["name"], tool_call_id=call["id"])
+        # The output may be shared with identical calls, so it is copied rather than changed
+        return output.model_copy(update={
+            "tool_call_id": call["id"],
+            "response_metadata": {
+                **output.response_metadata,
+                "duration_ms": round(duration * 1000, 1),
+                "outcome": "error" if output.status == "error" else "success",
+            },
+        })
+
+    @staticmethod
+    def _shared(message: ToolMessage, call: dict) -> ToolMessage:
+        """The message of an identical call, answered to this one."""
+        return message.model_copy(update={
+            "tool_call_id": call["id"],
+            "response_metadata": {**message.response_metadata, "coalesced": True},
+        })
+
+    def _record_flight(self, call: dict, shared: bool):
+        TOOL_SINGLE_FLIGHT.inc(tool=call["name"], result="coalesced" if shared else "executed")
+
+    def _timed_out(self, call: dict, duration: float) -> ToolMessage:
+        return self._error_message(
+            call, f"Error: {call['name']} did not answer within {self.timeout(call['name']):g} seconds.",
+            duration, "timeout")
+
+    def _failed(self, call: dict, error: Exception, duration: float) -> ToolMessage:
+        # Same message as ToolNode, so the model can retry with fixed arguments
+        return self._error_message(call, f"Error: {error!r}\n Please fix your mistakes.", duration, "error")
+
+    @staticmethod
+    def _log(messages: List[ToolMessage], started: float):
+        if len(messages) < 2:
+            return
+        calls = ", ".join(
+            f"{message.name} {message.response_metadata.get('duration_ms')}ms ({message.response_metadata.get('outcome')})"
+            for message in messages
+        )
+        print(f"[Tools] {len(messages)} calls in {(time.perf_counter() - started) * 1000:.1f}ms: {calls}")
+
+    def _run(self, call: dict, config: RunnableConfig, executor: ThreadPoolExecutor) -> ToolMessage:
+        if call["name"] not in self.single_flight:
+            return self._call(call, config, executor)
+        # The first call runs under its tool's semaphore and timeout; identical ones wait for it
+        message, shared = self._flights.do(
+            self._call_key(call), lambda: self._call(call, config, executor))
+        self._record_flight(call, shared)
+        return self._shared(message, call) if shared else message
+
+    def _call(self, call: dict, config: RunnableConfig, executor: ThreadPoolExecutor) -> ToolMessage:
+        name = call["name"]
+        semaphore = self._semaphore(name)
+        semaphore.acquire()
+        # The thread can't be interrupted, so a timed-out call keeps its slot until the tool returns
+        try:
+            future = executor.submit(self.tools[name].invoke, call, config)
+        except BaseException:
+            semaphore.release()
+            raise
+        future.add_done_callback(lambda _: semaphore.release())
+        call_started = time.perf_counter()
+        try:
+            output = future.result(timeout=self.timeout(name))
+            return self._finish(call, output, time.perf_counter() - call_started)
+        except TimeoutError:
+            # Its result is dropped when it ends
+            return self._timed_out(call, self.timeout(name))
+        except Exception as e:
+            return self._failed(call, e, time.perf_counter() - call_started)
+
+    def invoke(self, state, config: RunnableConfig) -> dict:
+        """Run the tool calls of the last message on threads."""
+        calls = [{**call, "type": "tool_call"} for call in self._tool_calls(state)]
+        started = time.perf_counter()
+        messages: List[Optional[ToolMessage]] = [self._unknown_tool(call) for call in calls]
+        pending = [(i, call) for i, call in enumerate(calls) if messages[i] is None]
+        # One thread waits for each call and another runs its tool
+        executor = ThreadPoolExecutor(max_workers=max(1, 2 * len(pending)))
+        try:
+            futures = {i: executor.submit(self._run, call, config, executor) for i, call in pending}
+            for i, _ in pending:
+                messages[i] = futures[i].result()
+        finally:
+            executor.shutdown(wait=False)
+
+        self._log(messages, started)
+        return {"messages": messages}
+
+    async def _arun(self, call: dict, config: RunnableConfig) -> ToolMessage:
+        if (message := self._unknown_tool(call)) is not None:
+            return message
+        if call["name"] not in self.single_flight:
+            return await self._acall(call, config)
+        # The first call runs under its tool's semaphore and timeout; identical ones wait for it
+        key = self._call_key(call)
+        if not self._flights.ain_flight(key):
+            message, shared = await self._flights.ado(key, lambda: self._acall(call, config))
+            self._record_flight(call, shared)
+            return self._shared(message, call) if shared else message
+        
+        # The tool's callbacks only reach the first caller, so a joining call
+        # reports its own tool run, marked coalesced, to its stream
+        manager = get_async_callback_manager_for_config(config)
+        manager.add_metadata({"coalesced": True}, inherit=False)
+        run_manager = await manager.on_tool_start(
+            {"name": call["name"]}, str(call["args"]), run_id=uuid4(), name=call["name"], inputs=call["args"])
+        try:
+            message, shared = await self._flights.ado(key, lambda: self._acall(call, config))
+        except BaseException as e:
+            await run_manager.on_tool_error(e)
+            raise
+        self._record_flight(call, shared)
+        message = self._shared(message, call) if shared else message
+        if message.status == "error":
+            await run_manager.on_tool_error(RuntimeError(message.content))
+        else:
+            await run_manager.on_tool_end(message)
+        return message
+
+    async def _acall(self, call: dict, config: RunnableConfig) -> ToolMessage:
+        name = call["name"]
+        # Choose the tool run's ID so a timed-out run can still be closed in the callbacks
+        run_id = uuid4()
+        async with self._async_semaphore(name):
+            call_started = time.perf_counter()
+            try:
+                output = await asyncio.wait_for(
+                    self.tools[name].ainvoke(call, {**config, "run_id": run_id}), timeout=self.timeout(name))
+                return self._finish(call, output, time.perf_counter() - call_started)
+            except asyncio.TimeoutError as e:
+                # Cancelling the tool skips its error callbacks, so report the timeout for it
+                manager = get_async_callback_manager_for_config(config)
+                await AsyncCallbackManagerForToolRun(
+                    run_id=run_id,
+                    handlers=manager.handlers,
+                    inheritable_handlers=manager.inheritable_handlers,
+                    parent_run_id=manager.parent_run_id,
+                ).on_tool_error(e)
+                return self._timed_out(call, time.perf_counter() - call_started)
+            except Exception as e:
+                return self._failed(call, e, time.perf_counter() - call_started)
+
+    async def ainvoke(self, state, config: RunnableConfig) -> dict:
+        """Run the tool calls of the last message concurrently on the event loop."""
+        calls = [{**call, "type": "tool_call"} for call in self._tool_calls(state)]
+        started = time.perf_counter()
+        # gather keeps the order of the calls
+        messages = list(await asyncio.gather(*(self._arun(call, config) for call in calls)))
+        self._log(messages, started)
+        return {"messages": messages}
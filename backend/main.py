@@ -1,14 +1,24 @@
 from fastapi import FastAPI, HTTPException, Depends
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from typing import Dict, Any
 import uuid
+import json
+import asyncio
+import time
 from models.llm import llm
 from models.chat_models import PromptRequest, BotResponse
-from tools.fda_api import query_fda_api
+from tools.fda_api import query_fda_api, query_fda_api_batch, fda_call_key
 from tools.query_pubmed_api import query_pubmed_api
 from tools.usda_api import query_usda_food_data
-from graph.api_graph import create_api_graph, ApiState, process_message
+from tools import http_client
+from tools.interaction_graph import ascan_medications, format_scan, INTERACTION_SCAN_TIMEOUT
+from graph.api_graph import create_api_graph, aprocess_message, astream_message
+from graph.context_window import ContextWindow
+from graph.tool_node import ConcurrentToolNode
 from config.prompts import DRUG_INTERACTION_BOT, WELCOME_MSG
+from monitoring import REGISTRY, CHAT_SECONDS, CONVERSATION_STORE_SECONDS, instrument_engine
 from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
 import uvicorn
 import os
@@ -25,9 +35,18 @@ dotenv.load_dotenv()
 
 port = int(os.environ.get("PORT"))
 
+# Seconds between keep-alive comments on idle /chat/stream connections
+SSE_HEARTBEAT_SECONDS = float(os.getenv("SSE_HEARTBEAT_SECONDS", "15"))
+# Add the interaction scan of the patient's medications to the system prompt,
+# giving up on it after INTERACTION_SCAN_TIMEOUT seconds
+INTERACTION_SCAN_IN_PROMPT = os.getenv("INTERACTION_SCAN_IN_PROMPT", "true").lower() == "true"
+
 # Create database tables
 Base.metadata.create_all(bind=engine)
 
+# Record the latency of every database statement for /metrics
+instrument_engine(engine)
+
 app = FastAPI(title="Drugsy, the healthy chatbot", description="API for drug interaction bot", version="1.0.0")
 
 if os.getenv("DEV_MODE") == "True":
@@ -62,6 +81,7 @@ app.include_router(patients_routes.router)
 # Define the tools
 tools = [
     query_fda_api, 
+    query_fda_api_batch,
     query_pubmed_api, 
     query_usda_food_data
 ]
@@ -69,72 +89,74 @@ tools = [
 # Attach the tools to the model
 llm_with_tools = llm.bind_tools(tools)
 
-# Create a function to get the graph with the personalized system prompt
-def get_graph_with_tools(user_info=None, patient_info=None):
-    # If there is user information, personalize the system prompt
-    if user_info:
-        # Get the type and content of the original system prompt
-        system_type, system_content = DRUG_INTERACTION_BOT
+# Build the personalized system prompt for a doctor and, optionally, a patient
+def build_system_prompt(user_info=None, patient_info=None):
+    # Without user information, use the original system prompt
+    if not user_info:
+        return DRUG_INTERACTION_BOT
+
+    # Get the type and content of the original system prompt
+    system_type, system_content = DRUG_INTERACTION_BOT
+    
+    # Prepare the basic user information
+    user_info_text = f"You are assisting Dr. {user_info['first_name']} {user_info['last_name']}."
+    # Add patient information if available
+    if patient_info:
+        user_info_text += f"\n\nYou are currently reviewing patient: {patient_info['first_name']} {patient_info['last_name']} (the ID of the patient is: {patient_info['id']})\n"
+        user_info_text += f"IMPORTANT: When using any patient-related tools, you MUST use the patient ID {patient_info['id']}. Never share the patient id with the user."
         
-        # Prepare the basic user information
-        user_info_text = f"You are assisting Dr. {user_info['first_name']} {user_info['last_name']}."
-        # Add patient information if available
-        if patient_info:
-            user_info_text += f"\n\nYou are currently reviewing patient: {patient_info['first_name']} {patient_info['last_name']} (the ID of the patient is: {patient_info['id']})\n"
-            user_info_text += f"IMPORTANT: When using any patient-related tools, you MUST use the patient ID {patient_info['id']}. Never share the patient id with the user."
-            
-            # Add patient medication information if available
-            if 'medications' in patient_info and patient_info['medications']:
-                medications_text = "\n\nThe patient takes the following medications:\n"
-                for med in patient_info['medications']:
-                    medications_text += f"- {med['name']}: {med['dosage']}, {med['frequency']}\n"
-                user_info_text += medications_text
+        # Add patient medication information if available
+        if 'medications' in patient_info and patient_info['medications']:
+            medications_text = "\n\nThe patient takes the following medications:\n"
+            for med in patient_info['medications']:
+                medications_text += f"- {med['name']}: {med['dosage']}, {med['frequency']}\n"
+            user_info_text += medications_text
+
+            # Add the interactions found between the medications if they were scanned
+            if patient_info.get('interaction_scan'):
+                user_info_text += "\n" + format_scan(patient_info['interaction_scan']) + "\n"
+        
+        # Add the patient chronic conditions if available
+        if 'chronic_conditions' in patient_info and patient_info['chronic_conditions']:
+            user_info_text += f"\n\nThe patient has the following chronic conditions:\n{patient_info['chronic_conditions']}"
+
+        # Add patient progress notes if available
+        if 'progress_notes' in patient_info and patient_info['progress_notes']:
+            progress_notes_text = "\n\nThe patient has the following progress notes:\n"
+            for note in patient_info['progress_notes']:
+                date_str = note.get('date', 'No date')
+                content = note.get('content', 'No content')
+                progress_notes_text += f"- {date_str}: {content}\n"
+            user_info_text += progress_notes_text
             
-            # Add the patient chronic conditions if available
-            if 'chronic_conditions' in patient_info and patient_info['chronic_conditions']:
-                user_info_text += f"\n\nThe patient has the following chronic conditions:\n{patient_info['chronic_conditions']}"
-
-            # Add patient progress notes if available
-            if 'progress_notes' in patient_info and patient_info['progress_notes']:
-                progress_notes_text = "\n\nThe patient has the following progress notes:\n"
-                for note in patient_info['progress_notes']:
-                    date_str = note.get('date', 'No date')
-                    content = note.get('content', 'No content')
-                    progress_notes_text += f"- {date_str}: {content}\n"
-                user_info_text += progress_notes_text
-                
-            user_info_text += f"\n\nYou should provide medical advice and information based on this patient's data. Remember to ALWAYS use patient ID {patient_info['id']} when using any patient-related tools."
-        # Add personalized information to system prompt
-        personalized_content = f"{user_info_text}\n\n{system_content}"
-
-        # Create the personalized system prompt
-        personalized_system_prompt = (system_type, personalized_content)
-        # Create the graph with the personalized system prompt
-        return create_api_graph(
-            llm_with_tools=llm_with_tools,
-            tools=tools,
-            system_prompt=personalized_system_prompt,
-            welcome_msg=WELCOME_MSG
-        )
-    else:
-        # Create the graph with the original system prompt
-        return create_api_graph(
-            llm_with_tools=llm_with_tools,
-            tools=tools,
-            system_prompt=DRUG_INTERACTION_BOT,
-            welcome_msg=WELCOME_MSG
-        )
+        user_info_text += f"\n\nYou should provide medical advice and information based on this patient's data. Remember to ALWAYS use patient ID {patient_info['id']} when using any patient-related tools."
+    # Add personalized information to system prompt
+    personalized_content = f"{user_info_text}\n\n{system_content}"
 
-# Create the initial graph with the original system prompt
-graph_with_tools = get_graph_with_tools()
+    # Create the personalized system prompt
+    return (system_type, personalized_content)
+
+# Compile the graph once; personalized prompts are passed per request through the config
+graph_with_tools = create_api_graph(
+    llm_with_tools=llm_with_tools,
+    tools=tools,
+    system_prompt=DRUG_INTERACTION_BOT,
+    welcome_msg=WELCOME_MSG,
+    # Keep the last turns verbatim and summarize older ones with the plain LLM
+    context_window=ContextWindow(summarizer=llm),
+    # FDA searches are compared like the label cache compares them: .exact values keep their case
+    tool_node=ConcurrentToolNode(tools, call_keys={"query_fda_api": fda_call_key})
+)
 
 # Helper function to initialize conversation with proper system message
-def initialize_conversation(graph, system_prompt, include_welcome=True):
+def initialize_conversation(system_prompt, include_welcome=True):
     """
     Initialize a conversation with the proper system message and optional welcome message.
     
+    The state is built locally: no model call is made until the user sends
+    their first message.
+    
     Args:
-        graph: The LangGraph instance
         system_prompt: Tuple of (type, content) or just the content
         include_welcome: Whether to include a welcome message
         
@@ -155,8 +177,8 @@ def initialize_conversation(graph, system_prompt, include_welcome=True):
     if include_welcome:
         initial_messages.append(AIMessage(content=WELCOME_MSG))
     
-    # Initialize the state with these messages
-    state = graph.invoke({"messages": initial_messages})
+    # Initialize the state with these messages and the graph defaults
+    state = {"messages": initial_messages, "order": [], "finished": False}
     
     # Debug: Print messages in the state
     print("\n==== INITIAL STATE MESSAGES ====")
@@ -166,41 +188,142 @@ def initialize_conversation(graph, system_prompt, include_welcome=True):
     
     return state
 
-# Store conversations by ID - use a more persistent approach
-import pickle
-import os
+# Store conversations in the configured store, loading each one lazily on first use
+from storage import create_conversation_store, ConversationLocks, ConversationConflictError
 
-# File to store conversations
+# Legacy pickle file, migrated into the store once at startup
 CONVERSATIONS_FILE = "conversations.pickle"
 
-# Load conversations from file if it exists
-def load_conversations():
-    if os.path.exists(CONVERSATIONS_FILE):
-        try:
-            with open(CONVERSATIONS_FILE, "rb") as f:
-                loaded_conversations = pickle.load(f)
-                return loaded_conversations
-        except Exception as e:
-            print(f"Error loading conversations: {e}")
-    return {}
+# Initialize conversations
+conversations = create_conversation_store()
+conversations.import_pickle(CONVERSATIONS_FILE)
 
-# Save conversations to file
-def save_conversations(conversations_dict):
-    try:
-        with open(CONVERSATIONS_FILE, "wb") as f:
-            pickle.dump(conversations_dict, f)
-        print(f"Saved {len(conversations_dict)} conversations to file")
-    except Exception as e:
-        print(f"Error saving conversations: {e}")
+# Serialize turns on the same conversation within this instance; the SQL store
+# additionally rejects conflicting writes from other instances
+conversation_locks = ConversationLocks()
 
-# Initialize conversations
-conversations: Dict[str, ApiState] = load_conversations()
+# Call a conversation store method, recording its latency for /metrics
+def timed_store_call(operation, *args):
+    with CONVERSATION_STORE_SECONDS.time(store=type(conversations).__name__, operation=operation):
+        return getattr(conversations, operation)(*args)
+
+# Flush pending conversation writes when the server stops
+@app.on_event("shutdown")
+def flush_conversations():
+    conversations.close()
+
+# Close the pooled connections of the tools' HTTP clients
+@app.on_event("shutdown")
+async def close_http_clients():
+    http_client.close_clients()
+    await http_client.aclose_clients()
 
 # Get welcome message
 @app.get("/welcome")
 async def get_welcome_message():
     return {"welcome_message": WELCOME_MSG.strip()}
 
+# Expose latency histograms and counters in the Prometheus text format
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+# Load a patient of the current doctor as the dictionary used in the system prompt
+def load_patient_info(patient_id, doctor_id):
+    # Import here to avoid circular imports
+    from database.crud import get_patient_by_id
+    from database.database import SessionLocal
+    db = SessionLocal()
+    try:
+        patient = get_patient_by_id(db, patient_id, doctor_id)
+        if not patient:
+            return None
+        try:
+            # Parse progress_notes if it exists and is not None
+            progress_notes = []
+            if patient.progress_notes:
+                try:
+                    if isinstance(patient.progress_notes, str):
+                        progress_notes = json.loads(patient.progress_notes)
+                    else:
+                        progress_notes = patient.progress_notes
+                except (json.JSONDecodeError, TypeError) as e:
+                    print(f"Error parsing progress_notes: {e}")
+                    progress_notes = []
+            
+            patient_info = {
+                'first_name': patient.first_name,
+                'last_name': patient.last_name,
+                'id': patient.id,
+                'medications': patient.medications,
+                'chronic_conditions': patient.chronic_conditions,
+                'progress_notes': progress_notes,
+            }
+            print(f"Successfully created patient_info for patient {patient.id}")
+            return patient_info
+        except Exception as e:
+            print(f"Error creating patient_info: {e}")
+            raise e
+    finally:
+        db.close()
+
+# Get the system prompt for a request, personalized when the user is authenticated
+async def get_request_system_prompt(request: PromptRequest, current_user):
+    if not current_user:
+        print(f"\n==== PROCESSING MESSAGE WITHOUT USER ====")
+        return DRUG_INTERACTION_BOT
+
+    # Prepare the basic user information for the personalized prompt
+    user_info = {
+        'first_name': current_user.first_name,
+        'last_name': current_user.last_name,
+    }
+    # Get patient info if patient_id is provided in the request
+    patient_info = None
+    if request.patient_id:
+        # The database lookup is blocking, so keep it off the event loop
+        patient_info = await run_in_threadpool(load_patient_info, request.patient_id, current_user.id)
+    # Check the patient's medications against each other before the model sees them
+    if patient_info and patient_info.get('medications') and INTERACTION_SCAN_IN_PROMPT:
+        medications = [med.get('name', '') for med in patient_info['medications']]
+        try:
+            patient_info['interaction_scan'] = await asyncio.wait_for(
+                ascan_medications(medications), timeout=INTERACTION_SCAN_TIMEOUT)
+        except Exception as e:
+            print(f"Skipping the medication interaction scan: {e!r}")
+    # Create a personalized system prompt with user and patient information
+    if patient_info:
+        print(f"Creating personalized prompt with patient info: {patient_info['first_name']} {patient_info['last_name']}")
+    else:
+        print("Creating personalized prompt with user info only (no patient info)")
+
+    print(f"\n==== PROCESSING MESSAGE WITH USER: {current_user.email} ====")
+    if request.patient_id:
+        print(f"Processing with patient ID: {request.patient_id}")
+    return build_system_prompt(user_info, patient_info)
+
+# Get a conversation state, initializing and persisting it if it doesn't exist
+async def load_conversation(conversation_id):
+    # Store access may hit the database, so keep it off the event loop
+    state = await run_in_threadpool(timed_store_call, "get", conversation_id)
+    if state is None:
+        print(f"\n==== INITIALIZING NEW CONVERSATION: {conversation_id} ====")
+        # Use the helper function to initialize with system message and welcome message
+        state = initialize_conversation(DRUG_INTERACTION_BOT)
+        # Persist the initial messages of the conversation
+        await run_in_threadpool(timed_store_call, "append", conversation_id, state["messages"], state)
+    else:
+        print(f"\n==== USING EXISTING CONVERSATION: {conversation_id} ====")
+        print(f"Existing state messages count: {len(state['messages'])}")
+    return state
+
+# Persist only the messages added by a turn
+async def save_turn(conversation_id, state, result_state):
+    new_messages = result_state["messages"][len(state["messages"]):]
+    await run_in_threadpool(timed_store_call, "append", conversation_id, new_messages, result_state)
+    print(f"\n==== UPDATED CONVERSATION STATE ====")
+    print(f"Updated state messages count: {len(result_state['messages'])}")
+
 @app.post("/chat", response_model=BotResponse)
 async def chat(request: PromptRequest, current_user: schemas.User = Depends(get_current_user_optional)):
     # Generate a new conversation ID if not provided
@@ -208,105 +331,24 @@ async def chat(request: PromptRequest, current_user: schemas.User = Depends(get_
     # Get or initialize conversation state
     print("\n==== CHAT REQUEST ====")
     print(f"Conversation ID: {conversation_id}")
-    print(f"Conversations dictionary ID: {id(conversations)}")
-    print(f"Conversations keys: {list(conversations.keys())}")
     print(f"Request conversation_id provided: {request.conversation_id is not None}")
     print(f"Request patient_id: {request.patient_id}")
-    # Initialize the conversation state if it doesn't exist
-    if conversation_id not in conversations:
-        print(f"\n==== INITIALIZING NEW CONVERSATION: {conversation_id} ====")
-        # Use the helper function to initialize with system message and welcome message
-        state = initialize_conversation(graph_with_tools, DRUG_INTERACTION_BOT)
-        conversations[conversation_id] = state
-        # Save conversations to file after initialization
-        save_conversations(conversations)
-        print(f"Conversations after initialization: {list(conversations.keys())}")
-    else:
-        print(f"\n==== USING EXISTING CONVERSATION: {conversation_id} ====")
-        state = conversations[conversation_id]
-        print(f"Existing state messages count: {len(state['messages'])}")
+    started = time.perf_counter()
+    status = "200"
     try:
         # Use the original user prompt without modification
         user_prompt = request.prompt
+        system_prompt = await get_request_system_prompt(request, current_user)
         
-        # If the user is authenticated, prepare user info once for all conditions
-        user_graph = graph_with_tools  # Default to original graph
-        if current_user:
-            # Prepare the basic user information for the personalized graph
-            user_info = {
-                'first_name': current_user.first_name,
-                'last_name': current_user.last_name,
-            }
-            # Get patient info if patient_id is provided in the request
-            patient_info = None
-            if request.patient_id:
-                # Import here to avoid circular imports
-                from database.crud import get_patient_by_id
-                from database.database import get_db
-                db = next(get_db())
-                patient = get_patient_by_id(db, request.patient_id, current_user.id)
-                if patient:
-                    try:
-                        # Parse progress_notes if it exists and is not None
-                        progress_notes = []
-                        if patient.progress_notes:
-                            try:
-                                if isinstance(patient.progress_notes, str):
-                                    import json
-                                    progress_notes = json.loads(patient.progress_notes)
-                                else:
-                                    progress_notes = patient.progress_notes
-                            except (json.JSONDecodeError, TypeError) as e:
-                                print(f"Error parsing progress_notes: {e}")
-                                progress_notes = []
-                        
-                        patient_info = {
-                            'first_name': patient.first_name,
-                            'last_name': patient.last_name,
-                            'id': patient.id,
-                            'medications': patient.medications,
-                            'chronic_conditions': patient.chronic_conditions,
-                            'progress_notes': progress_notes,
-                        }
-                        print(f"Successfully created patient_info for patient {patient.id}")
-                    except Exception as e:
-                        print(f"Error creating patient_info: {e}")
-                        raise e
-            # Create a personalized graph with user and patient information
-            if patient_info:
-                print(f"Creating personalized graph with patient info: {patient_info['first_name']} {patient_info['last_name']}")
-                user_graph = get_graph_with_tools(user_info, patient_info)
-            else:
-                print("Creating personalized graph with user info only (no patient info)")
-                user_graph = get_graph_with_tools(user_info, None)
+        # Parallel turns on this conversation wait here, so each one sees the previous result
+        async with conversation_locks.hold(conversation_id):
+            state = await load_conversation(conversation_id)
             
-            # Initialize the conversation state if it doesn't exist
-            if conversation_id not in conversations:
-                # Get the system prompt safely from the graph config
-                system_prompt = user_graph.config.get("system_prompt", DRUG_INTERACTION_BOT)
-                
-                # Use the helper function to initialize with system message and welcome message
-                state = initialize_conversation(user_graph, system_prompt)
-                conversations[conversation_id] = state
-        
-        # Process the message with the appropriate graph
-        if current_user:
-            print(f"\n==== PROCESSING MESSAGE WITH USER: {current_user.email} ====")
-            if request.patient_id:
-                print(f"Processing with patient ID: {request.patient_id}")
-            # Use the personalized graph to process the message
-            result_state = process_message(user_graph, state, user_prompt)
-        else:
-            print(f"\n==== PROCESSING MESSAGE WITHOUT USER ====")
-            # Use the default graph to process the message
-            result_state = process_message(graph_with_tools, state, user_prompt)
-
-        # Store the updated state
-        conversations[conversation_id] = result_state
-        # Save conversations to file after update
-        save_conversations(conversations)
-        print(f"\n==== UPDATED CONVERSATION STATE ====")
-        print(f"Updated state messages count: {len(result_state['messages'])}")
+            # Process the message with the shared graph and the appropriate system prompt
+            result_state = await aprocess_message(graph_with_tools, state, user_prompt, system_prompt=system_prompt)
+
+            # Store the updated state
+            await save_turn(conversation_id, state, result_state)
 
         # Get the bot's response (last message)
         bot_response = result_state["messages"][-1].content
@@ -316,16 +358,93 @@ async def chat(request: PromptRequest, current_user: schemas.User = Depends(get_
             response=bot_response,
             conversation_id=conversation_id
         )
+    except ConversationConflictError as e:
+        status = "409"
+        raise HTTPException(status_code=409, detail=f"Conversation was updated concurrently, please retry: {str(e)}")
     except Exception as e:
+        status = "500"
         raise HTTPException(status_code=500, detail=f"Error processing request: {str(e)}")
+    finally:
+        CHAT_SECONDS.observe(time.perf_counter() - started, endpoint="chat", status=status)
+
+# Format a server-sent event
+def format_sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+@app.post("/chat/stream")
+async def chat_stream(request: PromptRequest, current_user: schemas.User = Depends(get_current_user_optional)):
+    """
+    Stream a chat turn as server-sent events.
+
+    Events: "conversation" (the conversation ID), "token" (LLM output),
+    "node_start"/"node_end" and "tool_start"/"tool_end" (graph progress with
+    durations), "stage" (PubMed pipeline stage timings), "done" (the final
+    response) and "error". A comment is sent every SSE_HEARTBEAT_SECONDS while
+    nothing else is happening so proxies keep the connection open.
+    """
+    conversation_id = request.conversation_id or str(uuid.uuid4())
+    print("\n==== CHAT STREAM REQUEST ====")
+    print(f"Conversation ID: {conversation_id}")
+    system_prompt = await get_request_system_prompt(request, current_user)
+
+    async def produce(queue: asyncio.Queue):
+        started = time.perf_counter()
+        status = "200"
+        try:
+            # Hold the conversation for the whole turn, like /chat
+            async with conversation_locks.hold(conversation_id):
+                state = await load_conversation(conversation_id)
+                async for event, data in astream_message(graph_with_tools, state, request.prompt, system_prompt=system_prompt):
+                    if event == "final_state":
+                        await save_turn(conversation_id, state, data)
+                        await queue.put(("done", {
+                            "response": data["messages"][-1].content,
+                            "conversation_id": conversation_id,
+                        }))
+                    else:
+                        await queue.put((event, data))
+        except ConversationConflictError as e:
+            status = "409"
+            await queue.put(("error", {"detail": f"Conversation was updated concurrently, please retry: {str(e)}"}))
+        except Exception as e:
+            status = "500"
+            await queue.put(("error", {"detail": f"Error processing request: {str(e)}"}))
+        finally:
+            CHAT_SECONDS.observe(time.perf_counter() - started, endpoint="chat_stream", status=status)
+            await queue.put(None)
+
+    async def event_stream():
+        yield format_sse("conversation", {"conversation_id": conversation_id})
+        queue: asyncio.Queue = asyncio.Queue()
+        producer = asyncio.create_task(produce(queue))
+        try:
+            while True:
+                try:
+                    item = await asyncio.wait_for(queue.get(), timeout=SSE_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    # Keep idle connections alive while tools are running
+                    yield ": keep-alive\n\n"
+                    continue
+                if item is None:
+                    break
+                yield format_sse(*item)
+        finally:
+            # Stop the graph if the client disconnected
+            producer.cancel()
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 @app.get("/conversations/{conversation_id}", response_model=Dict[str, Any])
 async def get_conversation(conversation_id: str, current_user: schemas.User = Depends(get_current_active_user)):
-    if conversation_id not in conversations:
+    state = await run_in_threadpool(timed_store_call, "get", conversation_id)
+    if state is None:
         raise HTTPException(status_code=404, detail="Conversation not found")
     
     # Convert the conversation state to a serializable format
-    state = conversations[conversation_id]
     messages = []
     
     for msg in state.get("messages", []):
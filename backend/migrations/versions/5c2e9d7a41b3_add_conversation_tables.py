@@ -0,0 +1,56 @@
+"""add_conversation_tables
+
+Revision ID: 5c2e9d7a41b3
+Revises: 1a1f66421dac
+Create Date: 2026-10-16 09:12:40.318275
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5c2e9d7a41b3'
+down_revision: Union[str, None] = '1a1f66421dac'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Create the conversations table and its row-per-message table
+    op.create_table(
+        'conversations',
+        sa.Column('id', sa.String(), nullable=False),
+        sa.Column('fields', sa.JSON(), nullable=True),
+        sa.Column('message_count', sa.Integer(), nullable=False),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+        sa.Column('updated_at', sa.DateTime(timezone=True), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_conversations_id'), 'conversations', ['id'], unique=False)
+    op.create_table(
+        'conversation_messages',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('conversation_id', sa.String(), nullable=False),
+        sa.Column('position', sa.Integer(), nullable=False),
+        sa.Column('message', sa.JSON(), nullable=False),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+        sa.ForeignKeyConstraint(['conversation_id'], ['conversations.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('conversation_id', 'position', name='uq_conversation_message_position')
+    )
+    op.create_index(op.f('ix_conversation_messages_id'), 'conversation_messages', ['id'], unique=False)
+    op.create_index(op.f('ix_conversation_messages_conversation_id'), 'conversation_messages', ['conversation_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # Drop the conversation tables
+    op.drop_index(op.f('ix_conversation_messages_conversation_id'), table_name='conversation_messages')
+    op.drop_index(op.f('ix_conversation_messages_id'), table_name='conversation_messages')
+    op.drop_table('conversation_messages')
+    op.drop_index(op.f('ix_conversations_id'), table_name='conversations')
+    op.drop_table('conversations')
@@ -0,0 +1,25 @@
+# Monitoring package initialization
+from .metrics import (
+    REGISTRY,
+    Counter,
+    Gauge,
+    Histogram,
+    CHAT_SECONDS,
+    GRAPH_NODE_SECONDS,
+    TOOL_CALL_SECONDS,
+    TOOL_SINGLE_FLIGHT,
+    PUBMED_STAGE_SECONDS,
+    LLM_CALL_SECONDS,
+    LLM_TOKENS,
+    DB_QUERY_SECONDS,
+    CONVERSATION_STORE_SECONDS,
+    HTTP_REQUESTS,
+    HTTP_REQUEST_SECONDS,
+    HTTP_RETRIES,
+    CACHE_LOOKUPS,
+    ARTICLE_STORE_BYTES_SAVED,
+    NCBI_QUEUE_SECONDS,
+    NCBI_THROTTLED,
+)
+from .callbacks import MetricsCallbackHandler, METRICS_CALLBACK
+from .database import instrument_engine
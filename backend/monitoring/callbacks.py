@@ -0,0 +1,100 @@
+import threading
+import time
+from typing import Dict, Optional
+from uuid import UUID
+from langchain_core.callbacks import BaseCallbackHandler
+
+from .metrics import GRAPH_NODE_SECONDS, TOOL_CALL_SECONDS, LLM_CALL_SECONDS, LLM_TOKENS
+
+
+class MetricsCallbackHandler(BaseCallbackHandler):
+    """
+    LangChain callback handler recording graph node, tool and LLM latencies and
+    LLM token counts.
+
+    Callbacks are inherited by nested runs, so passing the handler in the graph
+    config also covers LLM calls made inside tools (such as the PubMed RAG
+    answer) and by the context window summarizer.
+    """
+
+    # Recording a metric is cheap, so don't hop to a thread for every event
+    run_inline = True
+
+    def __init__(self):
+        self._runs: Dict[UUID, tuple] = {}
+        self._lock = threading.Lock()
+
+    def _start(self, run_id: UUID, kind: str, **labels):
+        with self._lock:
+            self._runs[run_id] = (kind, labels, time.perf_counter())
+
+    def _end(self, run_id: UUID, kind: str) -> Optional[tuple]:
+        with self._lock:
+            run = self._runs.get(run_id)
+            if run is None or run[0] != kind:
+                return None
+            del self._runs[run_id]
+        _, labels, started = run
+        return labels, time.perf_counter() - started
+
+    # Graph nodes
+    def on_chain_start(self, serialized, inputs, *, run_id, metadata=None, **kwargs):
+        node = (metadata or {}).get("langgraph_node")
+        # Only the graph nodes themselves, not the runnables nested inside them
+        if node and kwargs.get("name") == node:
+            self._start(run_id, "node", node=node)
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        run = self._end(run_id, "node")
+        if run:
+            GRAPH_NODE_SECONDS.observe(run[1], **run[0])
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self.on_chain_end(None, run_id=run_id)
+
+    # Tools
+    def on_tool_start(self, serialized, input_str, *, run_id, metadata=None, **kwargs):
+        if (metadata or {}).get("coalesced"):
+            # Waiting for an identical call isn't a call of the tool; TOOL_SINGLE_FLIGHT counts it
+            return
+        name = kwargs.get("name") or (serialized or {}).get("name", "unknown")
+        self._start(run_id, "tool", tool=name)
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        run = self._end(run_id, "tool")
+        if run:
+            TOOL_CALL_SECONDS.observe(run[1], outcome="success", **run[0])
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        run = self._end(run_id, "tool")
+        if run:
+            outcome = "timeout" if isinstance(error, TimeoutError) else "error"
+            TOOL_CALL_SECONDS.observe(run[1], outcome=outcome, **run[0])
+
+    # LLM calls
+    def on_chat_model_start(self, serialized, messages, *, run_id, metadata=None, **kwargs):
+        self._start(run_id, "llm", caller=(metadata or {}).get("langgraph_node", "none"))
+
+    def on_llm_start(self, serialized, prompts, *, run_id, metadata=None, **kwargs):
+        self._start(run_id, "llm", caller=(metadata or {}).get("langgraph_node", "none"))
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        run = self._end(run_id, "llm")
+        if not run:
+            return
+        labels, duration = run
+        LLM_CALL_SECONDS.observe(duration, outcome="success", **labels)
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+                LLM_TOKENS.inc(usage.get("input_tokens", 0), kind="input", **labels)
+                LLM_TOKENS.inc(usage.get("output_tokens", 0), kind="output", **labels)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        run = self._end(run_id, "llm")
+        if run:
+            LLM_CALL_SECONDS.observe(run[1], outcome="error", **run[0])
+
+
+# Shared handler passed in the config of every graph run
+METRICS_CALLBACK = MetricsCallbackHandler()
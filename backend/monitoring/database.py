@@ -0,0 +1,29 @@
+import time
+from sqlalchemy import event
+
+from .metrics import DB_QUERY_SECONDS
+
+
+def instrument_engine(engine):
+    """
+    Record the latency of every statement run on a SQLAlchemy engine, labelled
+    by statement type (SELECT, INSERT, ...).
+
+    Args:
+        engine: The SQLAlchemy engine to instrument
+    """
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["query_started"].pop()
+        verb = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "UNKNOWN"
+        DB_QUERY_SECONDS.observe(time.perf_counter() - started, statement=verb)
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(context):
+        # Drop the start time of the failed statement
+        if context.connection is not None and context.connection.info.get("query_started"):
+            context.connection.info["query_started"].pop()
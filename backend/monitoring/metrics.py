@@ -0,0 +1,227 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Default latency buckets in seconds, from fast DB queries to full PubMed RAG runs
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Metric:
+    """Base class for metrics rendered in the Prometheus text exposition format."""
+
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        REGISTRY.register(self)
+
+    def _key(self, labels: Dict[str, object]) -> Tuple:
+        return tuple(labels.get(name, "") for name in self.labelnames)
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """A value that only goes up, such as a number of requests or tokens."""
+
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def values(self, **labels) -> dict:
+        """Values of the series matching the given labels, keyed by the remaining label value(s)."""
+        matched = [(index, labels[name]) for index, name in enumerate(self.labelnames) if name in labels]
+        remaining = [index for index, name in enumerate(self.labelnames) if name not in labels]
+        with self._lock:
+            items = list(self._values.items())
+        result = {}
+        for key, value in items:
+            if all(key[index] == wanted for index, wanted in matched):
+                rest = tuple(key[index] for index in remaining)
+                result[rest[0] if len(rest) == 1 else rest] = value
+        return result
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in items]
+
+
+class Gauge(_Metric):
+    """
+    A value that can go up and down. Either set explicitly or, when a callback
+    is given, read at scrape time from a function returning {label_values: value}.
+    """
+
+    type_name = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 callback: Optional[Callable[[], Dict[Tuple, float]]] = None):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple, float] = {}
+        self.callback = callback
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def _samples(self) -> List[str]:
+        if self.callback is not None:
+            try:
+                items = list(self.callback().items())
+            except Exception as e:
+                print(f"Error collecting gauge {self.name}: {e}")
+                items = []
+        else:
+            with self._lock:
+                items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in items]
+
+
+class Histogram(_Metric):
+    """Distribution of observed values (usually durations in seconds) in cumulative buckets."""
+
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [bucket counts..., sum, count]
+        self._values: Dict[Tuple, List[float]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of the block; works in sync and async code alike."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels) -> int:
+        with self._lock:
+            series = self._values.get(self._key(labels))
+            return series[-1] if series else 0
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = [(key, list(series)) for key, series in self._values.items()]
+        lines = []
+        for key, series in items:
+            bounds = [str(bound) for bound in self.buckets] + ["+Inf"]
+            for bound, bucket_count in zip(bounds, series[:len(self.buckets)] + [series[-1]]):
+                labels = _format_labels(self.labelnames, key, 'le="%s"' % bound)
+                lines.append(f"{self.name}_bucket{labels} {bucket_count}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {series[-2]}")
+            lines.append(f"{self.name}_count{labels} {series[-1]}")
+        return lines
+
+
+class Registry:
+    """Collection of every metric exposed on /metrics."""
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric):
+        with self._lock:
+            self._metrics.append(metric)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics)
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+# Metrics shared by the whole application
+CHAT_SECONDS = Histogram(
+    "drugsy_chat_seconds", "End-to-end latency of chat turns.", ("endpoint", "status"))
+GRAPH_NODE_SECONDS = Histogram(
+    "drugsy_graph_node_seconds", "Latency of LangGraph node executions.", ("node",))
+TOOL_CALL_SECONDS = Histogram(
+    "drugsy_tool_call_seconds", "Latency of tool calls.", ("tool", "outcome"))
+PUBMED_STAGE_SECONDS = Histogram(
+    "drugsy_pubmed_stage_seconds", "Latency of PubMed RAG pipeline stages.", ("stage",))
+LLM_CALL_SECONDS = Histogram(
+    "drugsy_llm_call_seconds", "Latency of LLM calls.", ("caller", "outcome"))
+LLM_TOKENS = Counter(
+    "drugsy_llm_tokens_total", "Tokens sent to and received from the LLM.", ("caller", "kind"))
+DB_QUERY_SECONDS = Histogram(
+    "drugsy_db_query_seconds", "Latency of database statements.", ("statement",))
+CONVERSATION_STORE_SECONDS = Histogram(
+    "drugsy_conversation_store_seconds", "Latency of conversation persistence operations.", ("store", "operation"))
+HTTP_REQUESTS = Counter(
+    "drugsy_http_requests_total", "Requests sent by the shared HTTP client, by status code or error.", ("host", "outcome"))
+HTTP_REQUEST_SECONDS = Histogram(
+    "drugsy_http_request_seconds", "Latency of requests sent by the shared HTTP client.", ("host",))
+HTTP_RETRIES = Counter(
+    "drugsy_http_retries_total", "Requests retried by the shared HTTP client.", ("host",))
+TOOL_SINGLE_FLIGHT = Counter(
+    "drugsy_tool_single_flight_total",
+    "Tool calls executed, or coalesced with an identical call in flight.", ("tool", "result"))
+NCBI_QUEUE_SECONDS = Histogram(
+    "drugsy_ncbi_queue_seconds", "Time E-utilities requests waited for a rate limit token.", ("priority",))
+NCBI_THROTTLED = Counter(
+    "drugsy_ncbi_throttled_total", "E-utilities requests answered with 429 Too Many Requests.")
+CACHE_LOOKUPS = Counter(
+    "drugsy_cache_lookups_total", "Response cache lookups by tier hit or miss.", ("cache", "result"))
+ARTICLE_STORE_BYTES_SAVED = Counter(
+    "drugsy_article_store_bytes_saved_total",
+    "E-utilities response bytes not downloaded thanks to the PubMed article store.", ("kind",))
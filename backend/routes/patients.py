@@ -1,8 +1,11 @@
+import asyncio
 from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 from typing import List
 from database.database import get_db
 from database import crud, schemas, auth
+from tools.interaction_graph import ascan_medications, INTERACTION_SCAN_TIMEOUT
 
 router = APIRouter(tags=["Patients"])
 
@@ -38,3 +41,17 @@ def delete_patient(patient_id: int, current_user: schemas.User = Depends(auth.ge
 def add_progress_note(patient_id: int, note: schemas.ProgressNoteCreate, current_user: schemas.User = Depends(auth.get_current_active_user), db: Session = Depends(get_db)):
     """Add a progress note to a patient"""
     return crud.add_progress_note(db=db, patient_id=patient_id, doctor_id=current_user.id, note=note)
+
+@router.get("/patients/{patient_id}/interaction-scan", response_model=schemas.InteractionScan)
+async def scan_patient_interactions(patient_id: int, current_user: schemas.User = Depends(auth.get_current_active_user), db: Session = Depends(get_db)):
+    """Check every pair of a patient's medications for interactions described in their FDA labels"""
+    # The database lookup is blocking, so keep it off the event loop
+    db_patient = await run_in_threadpool(crud.get_patient_by_id, db=db, patient_id=patient_id, doctor_id=current_user.id)
+    if db_patient is None:
+        raise HTTPException(status_code=404, detail="Patient not found")
+    medications = [medication.get("name", "") for medication in db_patient.medications or []]
+    try:
+        return await asyncio.wait_for(ascan_medications(medications), timeout=INTERACTION_SCAN_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+                            detail="The FDA label lookups took too long, try again later")
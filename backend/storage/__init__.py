@@ -0,0 +1,31 @@
+# Conversation storage package initialization
+import os
+import dotenv
+
+from .lru_cache import LRUCache
+from .conversation_journal import ConversationJournal
+from .conversation_locks import ConversationLocks
+from .exceptions import ConversationConflictError
+from .response_cache import ResponseCache
+from .article_store import ArticleStore
+from .embedding_cache import EmbeddingCache
+
+dotenv.load_dotenv()
+
+
+def create_conversation_store():
+    """
+    Create the conversation store selected by the CONVERSATION_STORE variable.
+
+    "sql" (the default) stores conversations in the application database so
+    several instances can share them; "journal" keeps them in local append-only
+    segment files.
+    """
+    backend = os.getenv("CONVERSATION_STORE", "sql").lower()
+    if backend == "journal":
+        return ConversationJournal()
+    if backend == "sql":
+        # Imported lazily so the journal can be used without a database
+        from .sql_conversation_store import SQLConversationStore
+        return SQLConversationStore()
+    raise ValueError(f"Unknown CONVERSATION_STORE: {backend}")
@@ -0,0 +1,190 @@
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Dict, Iterable, List, Optional
+
+from monitoring import CACHE_LOOKUPS, ARTICLE_STORE_BYTES_SAVED
+
+# SQLite limits the number of parameters of a statement
+_BATCH = 500
+
+
+class ArticleStore:
+    """
+    Local store of parsed PubMed articles, PMC full texts and PMID to PMCID links.
+
+    Articles are keyed by PMID and full texts by PMCID; abstracts and full texts
+    are stored zlib-compressed. Each entry remembers the size of the response it
+    was parsed from, so hits can report the bytes they saved downloading.
+    Negative answers (a PMID without a PMC version, a PMC article without body
+    text) are kept for negative_ttl_seconds, since PMC versions appear later.
+    """
+
+    def __init__(self, path: Optional[str], ttl_seconds: float = 30 * 86400,
+                 negative_ttl_seconds: float = 7 * 86400):
+        """
+        Args:
+            path: SQLite file of the store; None or "" keeps it in memory only
+            ttl_seconds: Seconds articles, full texts and links stay valid
+            negative_ttl_seconds: Seconds negative answers stay valid
+        """
+        self.ttl_seconds = ttl_seconds
+        self.negative_ttl_seconds = negative_ttl_seconds
+        if path:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path or ":memory:", check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(
+            "CREATE TABLE IF NOT EXISTS articles ("
+            "pmid TEXT PRIMARY KEY, title TEXT, year TEXT, journal TEXT, abstract BLOB NOT NULL, "
+            "source_bytes INTEGER NOT NULL, fetched_at REAL NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS pmc_links ("
+            "pmid TEXT PRIMARY KEY, pmcid TEXT, checked_at REAL NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS full_texts ("
+            "pmcid TEXT PRIMARY KEY, text BLOB, source_bytes INTEGER NOT NULL, fetched_at REAL NOT NULL);"
+        )
+        self.purge_expired()
+        self.hits = {"article": 0, "link": 0, "full_text": 0}
+        self.misses = {"article": 0, "link": 0, "full_text": 0}
+        self.bytes_saved = 0
+
+    def _select(self, query: str, keys: List[str]) -> list:
+        rows = []
+        with self._lock:
+            for start in range(0, len(keys), _BATCH):
+                batch = keys[start:start + _BATCH]
+                rows += self._db.execute(query % ",".join("?" * len(batch)), batch).fetchall()
+        return rows
+
+    def _count(self, kind: str, hits: int, misses: int, bytes_saved: int = 0):
+        with self._lock:
+            self.hits[kind] += hits
+            self.misses[kind] += misses
+            self.bytes_saved += bytes_saved
+        CACHE_LOOKUPS.inc(hits, cache=f"pubmed_{kind}", result="hit")
+        CACHE_LOOKUPS.inc(misses, cache=f"pubmed_{kind}", result="miss")
+        ARTICLE_STORE_BYTES_SAVED.inc(bytes_saved, kind=kind)
+
+    def get_articles(self, pmids: Iterable[str]) -> Dict[str, dict]:
+        """Return the stored articles among pmids, keyed by PMID."""
+        pmids = list(dict.fromkeys(pmids))
+        oldest = time.time() - self.ttl_seconds
+        articles, saved = {}, 0
+        for pmid, title, year, journal, abstract, source_bytes, fetched_at in self._select(
+                "SELECT pmid, title, year, journal, abstract, source_bytes, fetched_at "
+                "FROM articles WHERE pmid IN (%s)", pmids):
+            if fetched_at > oldest:
+                articles[pmid] = {
+                    "pmid": pmid,
+                    "title": title,
+                    "abstract": zlib.decompress(abstract).decode(),
+                    "year": year,
+                    "journal": journal,
+                }
+                saved += source_bytes
+        self._count("article", len(articles), len(pmids) - len(articles), saved)
+        return articles
+
+    def put_articles(self, articles: List[dict], source_bytes: int = 0):
+        """
+        Store parsed articles.
+
+        Args:
+            articles: Dictionaries with pmid, title, abstract, year and journal
+            source_bytes: Size of the response they were parsed from, shared among them
+        """
+        if not articles:
+            return
+        share = source_bytes // len(articles)
+        now = time.time()
+        rows = [
+            (article["pmid"], article["title"], article["year"], article["journal"],
+             zlib.compress(article["abstract"].encode()), share, now)
+            for article in articles
+        ]
+        with self._lock:
+            self._db.executemany("INSERT OR REPLACE INTO articles VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def get_links(self, pmids: Iterable[str]) -> Dict[str, Optional[str]]:
+        """Return the known PMCIDs of pmids, None for PMIDs known to have no PMC version."""
+        pmids = list(dict.fromkeys(pmids))
+        now = time.time()
+        links = {}
+        for pmid, pmcid, checked_at in self._select(
+                "SELECT pmid, pmcid, checked_at FROM pmc_links WHERE pmid IN (%s)", pmids):
+            if checked_at > now - (self.ttl_seconds if pmcid else self.negative_ttl_seconds):
+                links[pmid] = pmcid
+        self._count("link", len(links), len(pmids) - len(links))
+        return links
+
+    def put_links(self, links: Dict[str, Optional[str]]):
+        """Store PMID to PMCID links; None records that a PMID has no PMC version."""
+        now = time.time()
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO pmc_links VALUES (?, ?, ?)",
+                [(pmid, pmcid, now) for pmid, pmcid in links.items()],
+            )
+
+    def get_full_texts(self, pmcids: Iterable[str]) -> Dict[str, str]:
+        """Return the stored full texts among pmcids, "" for articles known to have none."""
+        pmcids = list(dict.fromkeys(pmcids))
+        now = time.time()
+        texts, saved = {}, 0
+        for pmcid, text, source_bytes, fetched_at in self._select(
+                "SELECT pmcid, text, source_bytes, fetched_at FROM full_texts WHERE pmcid IN (%s)", pmcids):
+            if fetched_at > now - (self.ttl_seconds if text is not None else self.negative_ttl_seconds):
+                texts[pmcid] = zlib.decompress(text).decode() if text is not None else ""
+                saved += source_bytes
+        self._count("full_text", len(texts), len(pmcids) - len(texts), saved)
+        return texts
+
+    def put_full_text(self, pmcid: str, text: str, source_bytes: int = 0):
+        """Store the full text of a PMC article ("" when it has no body text)."""
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO full_texts VALUES (?, ?, ?, ?)",
+                (pmcid, zlib.compress(text.encode()) if text else None, source_bytes, time.time()),
+            )
+
+    def purge_expired(self):
+        """Delete expired entries."""
+        now = time.time()
+        with self._lock:
+            self._db.execute("DELETE FROM articles WHERE fetched_at <= ?", (now - self.ttl_seconds,))
+            for table, column, negative in (("pmc_links", "checked_at", "pmcid IS NULL"),
+                                            ("full_texts", "fetched_at", "text IS NULL")):
+                self._db.execute(
+                    f"DELETE FROM {table} WHERE {column} <= CASE WHEN {negative} THEN ? ELSE ? END",
+                    (now - self.negative_ttl_seconds, now - self.ttl_seconds),
+                )
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def stats(self) -> dict:
+        """Return the number of entries, hit rates and bytes saved."""
+        with self._lock:
+            sizes = {
+                table: self._db.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                for table in ("articles", "pmc_links", "full_texts")
+            }
+            hit_rates = {
+                kind: round(self.hits[kind] / (self.hits[kind] + self.misses[kind]), 3)
+                if self.hits[kind] + self.misses[kind] else None
+                for kind in self.hits
+            }
+            return {
+                **sizes,
+                "hits": dict(self.hits),
+                "misses": dict(self.misses),
+                "hit_rates": hit_rates,
+                "bytes_saved": self.bytes_saved,
+            }
@@ -0,0 +1,253 @@
+import json
+import os
+import pickle
+import re
+import hashlib
+import threading
+from typing import Dict, List, Optional, Any
+from langchain_core.messages import messages_to_dict, messages_from_dict
+import dotenv
+
+from .lru_cache import LRUCache
+
+dotenv.load_dotenv()
+
+# Directory holding one append-only segment file per conversation
+CONVERSATIONS_DIR = os.getenv("CONVERSATIONS_DIR", "conversations")
+# Seconds between background flushes of pending journal records
+FLUSH_INTERVAL_SECONDS = float(os.getenv("CONVERSATIONS_FLUSH_INTERVAL", "1.0"))
+# Number of records after which a segment is compacted into a single snapshot
+COMPACT_THRESHOLD = int(os.getenv("CONVERSATIONS_COMPACT_THRESHOLD", "50"))
+# Maximum number of conversations kept in memory and seconds they stay cached
+CACHE_MAX_CONVERSATIONS = int(os.getenv("CONVERSATION_CACHE_SIZE", "256"))
+CACHE_TTL_SECONDS = float(os.getenv("CONVERSATION_CACHE_TTL", "900"))
+
+SEGMENT_SUFFIX = ".jsonl"
+SAFE_ID_PATTERN = re.compile(r"[A-Za-z0-9_-]{1,128}")
+
+
+class ConversationJournal:
+    """
+    Append-only conversation persistence.
+
+    Every conversation has its own segment file made of JSON lines. Each line
+    holds only the messages added by one turn plus the non-message state fields,
+    so saving a turn costs O(new messages) instead of O(all conversations).
+    Records are queued in memory and written by a background thread, segments
+    with many records are compacted into a single snapshot line, and
+    conversations are only read from disk when they are first requested.
+    """
+
+    def __init__(self, directory: str = CONVERSATIONS_DIR,
+                 flush_interval: float = FLUSH_INTERVAL_SECONDS,
+                 compact_threshold: int = COMPACT_THRESHOLD):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.compact_threshold = compact_threshold
+        os.makedirs(self.directory, exist_ok=True)
+
+        # Recently used conversations; evicted ones are replayed from disk when needed
+        self._states = LRUCache(max_size=CACHE_MAX_CONVERSATIONS, ttl_seconds=CACHE_TTL_SECONDS)
+        # Serialized records waiting to be appended to their segment
+        self._pending: Dict[str, List[str]] = {}
+        # Number of records in each segment we know about, used for compaction
+        self._record_counts: Dict[str, int] = {}
+
+        # Protects the in-memory dictionaries
+        self._lock = threading.Lock()
+        # Serializes file I/O between flushes, compaction and shutdown
+        self._io_lock = threading.Lock()
+
+        self._stop = threading.Event()
+        self._writer = threading.Thread(target=self._run, name="conversation-journal", daemon=True)
+        self._writer.start()
+
+    def _segment_path(self, conversation_id: str) -> str:
+        """Map a conversation ID to its segment file, hashing IDs that are not filename-safe."""
+        if SAFE_ID_PATTERN.fullmatch(conversation_id):
+            name = conversation_id
+        else:
+            name = hashlib.sha256(conversation_id.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, name + SEGMENT_SUFFIX)
+
+    @staticmethod
+    def _encode_record(messages: list, state: Dict[str, Any]) -> str:
+        fields = {key: value for key, value in state.items() if key != "messages"}
+        record = {"messages": messages_to_dict(messages), "fields": fields}
+        return json.dumps(record, default=str)
+
+    @staticmethod
+    def _apply_record(state: Dict[str, Any], line: str):
+        record = json.loads(line)
+        state["messages"].extend(messages_from_dict(record.get("messages", [])))
+        state.update(record.get("fields", {}))
+
+    def _read_segment(self, conversation_id: str) -> Optional[Dict[str, Any]]:
+        """Rebuild a conversation state by replaying its segment and pending records."""
+        path = self._segment_path(conversation_id)
+        lines = []
+        # Read the segment and the pending records under the I/O lock so a
+        # concurrent flush cannot move records between the two
+        with self._io_lock:
+            if os.path.exists(path):
+                with open(path, "r", encoding="utf-8") as f:
+                    lines = [line for line in f if line.strip()]
+            with self._lock:
+                pending = list(self._pending.get(conversation_id, []))
+
+        if not lines and not pending:
+            return None
+
+        state: Dict[str, Any] = {"messages": []}
+        for line in lines + pending:
+            try:
+                self._apply_record(state, line)
+            except (json.JSONDecodeError, KeyError, ValueError) as e:
+                # A torn final line (e.g. crash mid-write) only loses that turn
+                print(f"Skipping corrupt journal record for conversation {conversation_id}: {e}")
+        with self._lock:
+            self._record_counts[conversation_id] = len(lines)
+        return state
+
+    def __contains__(self, conversation_id: str) -> bool:
+        if conversation_id in self._states:
+            return True
+        with self._lock:
+            if conversation_id in self._pending:
+                return True
+        return os.path.exists(self._segment_path(conversation_id))
+
+    def get(self, conversation_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Get a conversation state, loading it from its segment on first access.
+
+        Args:
+            conversation_id: The conversation ID
+
+        Returns:
+            The conversation state, or None if the conversation does not exist
+        """
+        state = self._states.get(conversation_id)
+        if state is not None:
+            return state
+
+        state = self._read_segment(conversation_id)
+        if state is not None:
+            self._states.put(conversation_id, state)
+        return state
+
+    def append(self, conversation_id: str, messages: list, state: Dict[str, Any]):
+        """
+        Record the messages added to a conversation and its latest state.
+
+        The record is queued in memory and written by the background writer,
+        so this call never touches the disk.
+
+        Args:
+            conversation_id: The conversation ID
+            messages: The messages added since the last append
+            state: The full, updated conversation state
+        """
+        record = self._encode_record(messages, state)
+        self._states.put(conversation_id, state)
+        with self._lock:
+            self._pending.setdefault(conversation_id, []).append(record)
+
+    def flush(self):
+        """Append all pending records to their segment files."""
+        with self._io_lock:
+            with self._lock:
+                pending = self._pending
+                self._pending = {}
+            for conversation_id, records in pending.items():
+                try:
+                    with open(self._segment_path(conversation_id), "a", encoding="utf-8") as f:
+                        f.write("\n".join(records) + "\n")
+                        f.flush()
+                        os.fsync(f.fileno())
+                except OSError as e:
+                    print(f"Error writing journal for conversation {conversation_id}: {e}")
+                    # Put the records back so the next flush retries them
+                    with self._lock:
+                        self._pending[conversation_id] = records + self._pending.get(conversation_id, [])
+                    continue
+                with self._lock:
+                    self._record_counts[conversation_id] = self._record_counts.get(conversation_id, 0) + len(records)
+
+    def compact(self):
+        """Rewrite segments that grew past the threshold as a single snapshot record."""
+        with self._lock:
+            candidates = [cid for cid, count in self._record_counts.items() if count > self.compact_threshold]
+
+        for conversation_id in candidates:
+            path = self._segment_path(conversation_id)
+            with self._io_lock:
+                try:
+                    state: Dict[str, Any] = {"messages": []}
+                    with open(path, "r", encoding="utf-8") as f:
+                        for line in f:
+                            if line.strip():
+                                self._apply_record(state, line)
+                    snapshot = self._encode_record(state["messages"], state)
+                    tmp_path = path + ".tmp"
+                    with open(tmp_path, "w", encoding="utf-8") as f:
+                        f.write(snapshot + "\n")
+                        f.flush()
+                        os.fsync(f.fileno())
+                    os.replace(tmp_path, path)
+                except (OSError, json.JSONDecodeError, ValueError) as e:
+                    print(f"Error compacting journal for conversation {conversation_id}: {e}")
+                    continue
+            with self._lock:
+                self._record_counts[conversation_id] = 1
+
+    def _run(self):
+        """Background writer: periodically flush pending records and compact segments."""
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+                self.compact()
+            except Exception as e:
+                print(f"Error in conversation journal writer: {e}")
+
+    def close(self):
+        """Stop the background writer and flush everything still pending."""
+        self._stop.set()
+        self._writer.join(timeout=self.flush_interval * 5)
+        self.flush()
+        with self._lock:
+            pending_count = sum(len(records) for records in self._pending.values())
+        print(f"Conversation journal closed ({pending_count} records left unflushed)")
+
+    def stats(self) -> dict:
+        """Return cache statistics."""
+        return self._states.stats()
+
+    def import_pickle(self, pickle_path: str):
+        """
+        One-time migration of a legacy conversations.pickle file into the journal.
+
+        The pickle is renamed afterwards so it is never loaded again.
+
+        Args:
+            pickle_path: Path to the legacy pickle file
+        """
+        if not os.path.exists(pickle_path):
+            return
+        try:
+            with open(pickle_path, "rb") as f:
+                legacy_conversations = pickle.load(f)
+        except Exception as e:
+            print(f"Error loading legacy conversations from {pickle_path}: {e}")
+            return
+
+        for conversation_id, state in legacy_conversations.items():
+            if conversation_id in self:
+                continue
+            # Queue the record directly so migrated conversations stay on disk until requested
+            record = self._encode_record(list(state.get("messages", [])), state)
+            with self._lock:
+                self._pending.setdefault(conversation_id, []).append(record)
+        self.flush()
+        os.replace(pickle_path, pickle_path + ".migrated")
+        print(f"Migrated {len(legacy_conversations)} conversations from {pickle_path} to the journal")
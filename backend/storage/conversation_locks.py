@@ -0,0 +1,40 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Dict
+
+
+class ConversationLocks:
+    """
+    Per-conversation asyncio locks.
+
+    Turns on the same conversation wait for each other in arrival order
+    (asyncio.Lock wakes waiters first-in, first-out), while turns on different
+    conversations run fully in parallel. A lock only exists while some request
+    holds or waits for it, so memory does not grow with the number of
+    conversations.
+    """
+
+    def __init__(self):
+        self._locks: Dict[str, asyncio.Lock] = {}
+        # Number of requests holding or waiting for each lock
+        self._users: Dict[str, int] = {}
+
+    @asynccontextmanager
+    async def hold(self, conversation_id: str):
+        """Hold the lock of a conversation for the duration of the block."""
+        lock = self._locks.get(conversation_id)
+        if lock is None:
+            lock = self._locks[conversation_id] = asyncio.Lock()
+        self._users[conversation_id] = self._users.get(conversation_id, 0) + 1
+        try:
+            async with lock:
+                yield
+        finally:
+            self._users[conversation_id] -= 1
+            if self._users[conversation_id] == 0:
+                del self._users[conversation_id]
+                del self._locks[conversation_id]
+
+    def waiting(self, conversation_id: str) -> int:
+        """Number of requests holding or queued for a conversation."""
+        return self._users.get(conversation_id, 0)
@@ -0,0 +1,161 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+from typing import Callable, Dict, List
+
+import numpy as np
+
+from monitoring import CACHE_LOOKUPS
+
+# SQLite limits the number of parameters of a statement
+_BATCH = 500
+
+
+class EmbeddingCache:
+    """
+    Embeddings of texts, keyed by a hash of the model name and the text.
+
+    Vectors are float32 rows of an append-only file that readers memory-map,
+    so the workers of an instance share one copy through the page cache. A
+    SQLite file maps each 16-byte key to its row; allocating rows in a write
+    transaction keeps workers that add vectors at the same time from writing
+    over each other. A vector is written before its key is committed, so a key
+    that can be seen always has its vector.
+    """
+
+    def __init__(self, directory: str, model_name: str):
+        """
+        Args:
+            directory: Directory of the cache files; one pair of files per model
+            model_name: Name of the embedding model, part of every key
+        """
+        self.model_name = model_name
+        os.makedirs(directory, exist_ok=True)
+        name = re.sub(r"[^A-Za-z0-9._-]+", "_", model_name)
+        self.vectors_path = os.path.join(directory, f"{name}.f32")
+        self._db = sqlite3.connect(os.path.join(directory, f"{name}.sqlite3"), check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(
+            "CREATE TABLE IF NOT EXISTS rows (key BLOB PRIMARY KEY, row INTEGER NOT NULL) WITHOUT ROWID;"
+            "CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL);"
+        )
+        # Opened without truncating; created on first use
+        self._fd = os.open(self.vectors_path, os.O_RDWR | os.O_CREAT, 0o644)
+        self._lock = threading.Lock()
+        self._rows: Dict[bytes, int] = {}
+        self._matrix = None
+        self.dimensions = self._meta("dimensions")
+        self.hits = 0
+        self.misses = 0
+
+    def _meta(self, name: str):
+        row = self._db.execute("SELECT value FROM meta WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else None
+
+    def key(self, text: str) -> bytes:
+        return hashlib.blake2b(f"{self.model_name}\0{text}".encode(), digest_size=16).digest()
+
+    def _lookup(self, keys: List[bytes]) -> Dict[bytes, int]:
+        # Called with the lock held; rows never move, so known ones are kept in memory
+        rows = {key: self._rows[key] for key in keys if key in self._rows}
+        unknown = [key for key in keys if key not in rows]
+        for start in range(0, len(unknown), _BATCH):
+            batch = unknown[start:start + _BATCH]
+            rows.update(self._db.execute(
+                f"SELECT key, row FROM rows WHERE key IN ({','.join('?' * len(batch))})", batch).fetchall())
+        self._rows.update(rows)
+        return rows
+
+    def _vectors(self, rows: List[int]) -> np.ndarray:
+        # Called with the lock held; the file is mapped again once it has grown past the mapping
+        needed = max(rows) + 1 if rows else 0
+        if self.dimensions is None:
+            # Set by another worker's first vectors
+            self.dimensions = self._meta("dimensions")
+        if self._matrix is None or len(self._matrix) < needed:
+            self._matrix = np.memmap(self.vectors_path, dtype=np.float32, mode="r",
+                                     shape=(os.path.getsize(self.vectors_path) // (4 * self.dimensions), self.dimensions))
+        return np.array(self._matrix[rows])
+
+    def _append(self, keys: List[bytes], vectors: np.ndarray):
+        """Write the vectors of keys no worker has added yet, and commit their rows."""
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            if self.dimensions is None:
+                self.dimensions = self._meta("dimensions") or vectors.shape[1]
+                self._db.execute("INSERT OR IGNORE INTO meta VALUES ('dimensions', ?)", (self.dimensions,))
+            if vectors.shape[1] != self.dimensions:
+                raise ValueError(f"Embeddings have {vectors.shape[1]} dimensions, the cache {self.dimensions}")
+            # Another worker may have added some of them since the lookup
+            added = self._lookup(keys)
+            pending = [(key, vector) for key, vector in zip(keys, vectors) if key not in added]
+            if pending:
+                next_row = self._db.execute("SELECT COALESCE(MAX(row) + 1, 0) FROM rows").fetchone()[0]
+                data = np.stack([vector for _, vector in pending]).tobytes()
+                os.pwrite(self._fd, data, next_row * 4 * self.dimensions)
+                new_rows = [(key, next_row + offset) for offset, (key, _) in enumerate(pending)]
+                self._db.executemany("INSERT INTO rows VALUES (?, ?)", new_rows)
+            self._db.execute("COMMIT")
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        if pending:
+            self._rows.update(new_rows)
+
+    def encode(self, texts: List[str], encode: Callable[[List[str]], np.ndarray]) -> np.ndarray:
+        """
+        Return the embeddings of texts, computing only the ones not cached yet.
+
+        Args:
+            texts: Texts to embed
+            encode: Embeds a list of texts, e.g. SentenceTransformer.encode
+
+        Returns:
+            A float32 array with one row per text
+        """
+        keys = [self.key(text) for text in texts]
+        with self._lock:
+            rows = self._lookup(list(dict.fromkeys(keys)))
+        missing = {key: text for key, text in zip(keys, texts) if key not in rows}
+        hits = len(texts) - sum(1 for key in keys if key in missing)
+        with self._lock:
+            self.hits += hits
+            self.misses += len(texts) - hits
+        CACHE_LOOKUPS.inc(hits, cache="embeddings", result="hit")
+        CACHE_LOOKUPS.inc(len(texts) - hits, cache="embeddings", result="miss")
+
+        computed = {}
+        if missing:
+            vectors = np.asarray(encode(list(missing.values())), dtype=np.float32)
+            computed = dict(zip(missing, vectors))
+            with self._lock:
+                self._append(list(missing), vectors)
+        if not rows:
+            return np.stack([computed[key] for key in keys]) if keys else np.zeros((0, self.dimensions or 0), np.float32)
+
+        with self._lock:
+            cached = self._vectors([rows[key] for key in keys if key in rows])
+        cached_rows = iter(cached)
+        return np.stack([computed[key] if key in computed else next(cached_rows) for key in keys])
+
+    def close(self):
+        with self._lock:
+            self._matrix = None
+            os.close(self._fd)
+            self._db.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "model": self.model_name,
+                "vectors": self._db.execute("SELECT COUNT(*) FROM rows").fetchone()[0],
+                "dimensions": self.dimensions,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+            }
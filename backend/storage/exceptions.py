@@ -0,0 +1,2 @@
+class ConversationConflictError(Exception):
+    """Raised when another writer appended to a conversation first."""
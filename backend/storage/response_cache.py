@@ -0,0 +1,143 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Hashable, Optional
+
+from monitoring import CACHE_LOOKUPS
+from .lru_cache import LRUCache
+
+
+class ResponseCache:
+    """
+    Two-tier TTL cache for external API responses.
+
+    Lookups go to an in-process LRU first and then to a SQLite file shared by
+    the workers of the instance; entries found on disk are promoted to memory.
+    Negative answers (such as "no match") are cached with their own, usually
+    shorter, TTL. Values must be JSON-serializable.
+    """
+
+    def __init__(self, name: str, path: Optional[str] = None, max_size: int = 1024,
+                 ttl_seconds: float = 86400, negative_ttl_seconds: float = 3600):
+        """
+        Args:
+            name: Cache name used in statistics and metrics
+            path: SQLite file of the disk tier; None or "" keeps the cache in memory only
+            max_size: Maximum number of entries kept in memory
+            ttl_seconds: Seconds a response stays valid
+            negative_ttl_seconds: Seconds a negative response stays valid
+        """
+        self.name = name
+        self.ttl_seconds = ttl_seconds
+        self.negative_ttl_seconds = negative_ttl_seconds
+        # key -> (expires_at, value); expiry is checked here because TTLs differ per entry
+        self._memory = LRUCache(max_size=max_size)
+        self._db = None
+        self._db_lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.negative_hits = 0
+        if path:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, negative INTEGER NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self.purge_expired()
+
+    def _count(self, result: str, negative: bool = False):
+        with self._db_lock:
+            if result == "memory_hit":
+                self.memory_hits += 1
+            elif result == "disk_hit":
+                self.disk_hits += 1
+            else:
+                self.misses += 1
+            if negative:
+                self.negative_hits += 1
+        CACHE_LOOKUPS.inc(cache=self.name, result=result)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Return the cached value for key, or None if it is missing or expired."""
+        now = time.time()
+        entry = self._memory.get(key)
+        if entry is not None:
+            expires_at, negative, value = entry
+            if expires_at > now:
+                self._count("memory_hit", negative)
+                return value
+            self._memory.pop(key)
+
+        if self._db is not None:
+            with self._db_lock:
+                row = self._db.execute(
+                    "SELECT value, negative, expires_at FROM responses WHERE key = ?", (str(key),)
+                ).fetchone()
+            if row is not None and row[2] > now:
+                value = json.loads(row[0])
+                self._memory.put(key, (row[2], bool(row[1]), value))
+                self._count("disk_hit", bool(row[1]))
+                return value
+
+        self._count("miss")
+        return None
+
+    def put(self, key: Hashable, value: Any, negative: bool = False):
+        """
+        Store a response.
+
+        Args:
+            key: The normalized request key
+            value: The JSON-serializable response
+            negative: Whether the response is a negative answer, cached for negative_ttl_seconds
+        """
+        expires_at = time.time() + (self.negative_ttl_seconds if negative else self.ttl_seconds)
+        self._memory.put(key, (expires_at, negative, value))
+        if self._db is not None:
+            with self._db_lock:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO responses (key, value, negative, expires_at) VALUES (?, ?, ?, ?)",
+                    (str(key), json.dumps(value), int(negative), expires_at),
+                )
+
+    def purge_expired(self):
+        """Delete expired entries from the disk tier."""
+        if self._db is not None:
+            with self._db_lock:
+                self._db.execute("DELETE FROM responses WHERE expires_at <= ?", (time.time(),))
+
+    def clear(self):
+        self._memory.clear()
+        if self._db is not None:
+            with self._db_lock:
+                self._db.execute("DELETE FROM responses")
+
+    def close(self):
+        if self._db is not None:
+            with self._db_lock:
+                self._db.close()
+                self._db = None
+
+    def stats(self) -> dict:
+        """Return hit and miss counters of both tiers."""
+        disk_size = None
+        with self._db_lock:
+            if self._db is not None:
+                disk_size = self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            return {
+                "name": self.name,
+                "memory_size": len(self._memory),
+                "disk_size": disk_size,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "negative_hits": self.negative_hits,
+            }
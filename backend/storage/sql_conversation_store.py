@@ -0,0 +1,163 @@
+import json
+import os
+import pickle
+from typing import Dict, Optional, Any
+from sqlalchemy.exc import IntegrityError
+from langchain_core.messages import message_to_dict, messages_from_dict
+import dotenv
+
+from database.database import SessionLocal
+from database.models import Conversation, ConversationMessage
+from .lru_cache import LRUCache
+from .exceptions import ConversationConflictError
+
+dotenv.load_dotenv()
+
+# Maximum number of conversations kept in memory per instance
+CACHE_MAX_CONVERSATIONS = int(os.getenv("CONVERSATION_CACHE_SIZE", "256"))
+# Seconds a conversation stays cached after its last write
+CACHE_TTL_SECONDS = float(os.getenv("CONVERSATION_CACHE_TTL", "900"))
+
+
+class SQLConversationStore:
+    """
+    Conversation repository on the application's SQLAlchemy engine.
+
+    Messages are stored one row per message, conversations are only read when
+    their ID is requested, and recently used conversations are kept in a
+    bounded LRU cache. Every read checks the conversation's message count in
+    the database and fetches only the rows the cache is missing, so several
+    instances can serve the same conversation.
+    """
+
+    def __init__(self, max_size: int = CACHE_MAX_CONVERSATIONS, ttl_seconds: float = CACHE_TTL_SECONDS):
+        self._cache = LRUCache(max_size=max_size, ttl_seconds=ttl_seconds)
+
+    @staticmethod
+    def _encode_fields(state: Dict[str, Any]) -> Dict[str, Any]:
+        fields = {key: value for key, value in state.items() if key != "messages"}
+        # Round-trip through JSON so non-serializable values are stored as strings
+        return json.loads(json.dumps(fields, default=str))
+
+    def __contains__(self, conversation_id: str) -> bool:
+        if conversation_id in self._cache:
+            return True
+        with SessionLocal() as db:
+            return db.get(Conversation, conversation_id) is not None
+
+    def get(self, conversation_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Get a conversation state, loading only the messages missing from the cache.
+
+        Args:
+            conversation_id: The conversation ID
+
+        Returns:
+            The conversation state, or None if the conversation does not exist
+        """
+        cached = self._cache.get(conversation_id)
+        with SessionLocal() as db:
+            conversation = db.get(Conversation, conversation_id)
+            if conversation is None:
+                self._cache.pop(conversation_id)
+                return None
+
+            cached_messages = cached["messages"] if cached else []
+            if len(cached_messages) == conversation.message_count:
+                return cached
+
+            # Only fetch the rows written after the cached copy (or all of them)
+            start = len(cached_messages) if len(cached_messages) < conversation.message_count else 0
+            rows = (
+                db.query(ConversationMessage.message)
+                .filter(
+                    ConversationMessage.conversation_id == conversation_id,
+                    ConversationMessage.position >= start,
+                )
+                .order_by(ConversationMessage.position)
+                .all()
+            )
+            messages = (cached_messages[:start] if start else []) + messages_from_dict([row.message for row in rows])
+            state = {**(conversation.fields or {}), "messages": messages}
+
+        self._cache.put(conversation_id, state)
+        return state
+
+    def append(self, conversation_id: str, messages: list, state: Dict[str, Any]):
+        """
+        Insert the messages added to a conversation and store its latest state.
+
+        Args:
+            conversation_id: The conversation ID
+            messages: The messages added since the last append
+            state: The full, updated conversation state
+
+        Raises:
+            ConversationConflictError: If the conversation changed since the state was read
+        """
+        start = len(state["messages"]) - len(messages)
+        with SessionLocal() as db:
+            conversation = db.get(Conversation, conversation_id)
+            if conversation is None:
+                conversation = Conversation(id=conversation_id, message_count=0)
+                db.add(conversation)
+            if conversation.message_count != start:
+                self._cache.pop(conversation_id)
+                raise ConversationConflictError(
+                    f"Conversation {conversation_id} has {conversation.message_count} messages, expected {start}"
+                )
+
+            db.add_all([
+                ConversationMessage(
+                    conversation_id=conversation_id,
+                    position=start + offset,
+                    message=message_to_dict(message),
+                )
+                for offset, message in enumerate(messages)
+            ])
+            conversation.message_count = start + len(messages)
+            conversation.fields = self._encode_fields(state)
+            try:
+                db.commit()
+            except IntegrityError as e:
+                # Another instance wrote the same positions first
+                db.rollback()
+                self._cache.pop(conversation_id)
+                raise ConversationConflictError(f"Concurrent write to conversation {conversation_id}") from e
+
+        self._cache.put(conversation_id, state)
+
+    def close(self):
+        """Drop cached conversations; every write is already committed."""
+        self._cache.clear()
+
+    def import_pickle(self, pickle_path: str):
+        """
+        One-time migration of a legacy conversations.pickle file into the database.
+
+        The pickle is renamed afterwards so it is never loaded again.
+
+        Args:
+            pickle_path: Path to the legacy pickle file
+        """
+        if not os.path.exists(pickle_path):
+            return
+        try:
+            with open(pickle_path, "rb") as f:
+                legacy_conversations = pickle.load(f)
+        except Exception as e:
+            print(f"Error loading legacy conversations from {pickle_path}: {e}")
+            return
+
+        for conversation_id, state in legacy_conversations.items():
+            if conversation_id in self:
+                continue
+            self.append(conversation_id, list(state.get("messages", [])), dict(state))
+        # Migrated conversations are loaded again only when requested
+        self._cache.clear()
+        os.replace(pickle_path, pickle_path + ".migrated")
+        print(f"Migrated {len(legacy_conversations)} conversations from {pickle_path} to the database")
+
+    def stats(self) -> dict:
+        """Return cache statistics."""
+        return self._cache.stats()
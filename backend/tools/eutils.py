@@ -0,0 +1,301 @@
+"""
+Rate-limited access to the NCBI E-utilities.
+
+NCBI allows 3 requests per second per client without an API key and 10 with
+one, and throttles (HTTP 429) or blocks clients that go over. Every
+esearch/elink/efetch/esummary request of the process goes through one
+token-bucket scheduler, whatever thread or event loop sends it:
+
+- requests wait in a priority queue; interactive chat requests are served
+  before background work (see ``background()``), in arrival order otherwise
+- a dispatcher thread grants one token per request at the configured rate
+- a 429 answer pauses every request for its Retry-After or an exponential
+  backoff, and the request is queued again
+
+Queue depth, queue wait and throttled answers are exposed on /metrics.
+"""
+import asyncio
+import contextvars
+import heapq
+import itertools
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+import dotenv
+import httpx
+
+from . import http_client
+from monitoring import NCBI_QUEUE_SECONDS, NCBI_THROTTLED, Gauge
+
+dotenv.load_dotenv()
+
+# Base URL of the NCBI E-utilities, overridable to point at a local stand-in
+EUTILS_BASE_URL = os.getenv("EUTILS_BASE_URL", "https://eutils.ncbi.nlm.nih.gov/entrez/eutils").rstrip("/")
+# Sent with every request; the API key raises the allowed rate
+NCBI_API_KEY = os.getenv("NCBI_API_KEY") or None
+NCBI_TOOL = os.getenv("NCBI_TOOL", "Drugsy")
+NCBI_EMAIL = os.getenv("NCBI_EMAIL", "drugsy@gmail.com")
+# Requests per second for the whole process, and how many may go out back to back
+NCBI_RATE_LIMIT = float(os.getenv("NCBI_RATE_LIMIT", "10" if NCBI_API_KEY else "3"))
+NCBI_BURST = int(os.getenv("NCBI_BURST", "1"))
+# Fraction of the rate kept in reserve, so requests that reach NCBI a little
+# closer together than they were sent still fit in its one-second window
+NCBI_RATE_MARGIN = float(os.getenv("NCBI_RATE_MARGIN", "0.05"))
+# Attempts after a throttled, failed or 5xx request, and the backoff after a 429
+NCBI_MAX_RETRIES = int(os.getenv("NCBI_MAX_RETRIES", "3"))
+NCBI_BACKOFF_BASE = float(os.getenv("NCBI_BACKOFF_BASE", "1"))
+NCBI_MAX_BACKOFF = float(os.getenv("NCBI_MAX_BACKOFF", "30"))
+# Seconds to wait for each E-utilities request
+REQUEST_TIMEOUT = 60
+
+# Request priorities, lower first
+INTERACTIVE = 0
+BACKGROUND = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BACKGROUND: "background"}
+
+_priority = contextvars.ContextVar("eutils_priority", default=INTERACTIVE)
+
+
+@contextmanager
+def background():
+    """Send the E-utilities requests made inside the block after interactive ones."""
+    token = _priority.set(BACKGROUND)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class _Waiter:
+    """A request waiting for a token, woken by an event or on its event loop."""
+
+    def __init__(self, priority: int, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.priority = priority
+        self.enqueued = time.monotonic()
+        self.loop = loop
+        self.future = loop.create_future() if loop is not None else None
+        self.event = threading.Event() if loop is None else None
+        self.cancelled = False
+
+    def grant(self):
+        if self.event is not None:
+            self.event.set()
+            return
+        try:
+            self.loop.call_soon_threadsafe(self._resolve)
+        except RuntimeError:
+            # The event loop was closed while the request waited
+            self.cancelled = True
+
+    def _resolve(self):
+        if not self.future.done():
+            self.future.set_result(None)
+
+
+class TokenBucketScheduler:
+    """
+    Token bucket shared by threads and event loops, granting tokens to the
+    queued requests in priority order.
+
+    Args:
+        rate: Requests allowed per second
+        burst: Most tokens the bucket holds
+        margin: Fraction of the rate kept in reserve
+    """
+
+    def __init__(self, rate: float = NCBI_RATE_LIMIT, burst: int = NCBI_BURST, margin: float = NCBI_RATE_MARGIN):
+        # Tokens added per second
+        self.rate = rate / (1 + margin)
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._throttled_in_a_row = 0
+        self._waiters = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def _start(self):
+        # Called with the condition held
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._dispatch, name="eutils-scheduler", daemon=True)
+            self._thread.start()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _dispatch(self):
+        """Grant tokens to the first waiter in the queue as they become available."""
+        with self._condition:
+            while True:
+                while self._waiters and self._waiters[0][2].cancelled:
+                    heapq.heappop(self._waiters)
+                if not self._waiters:
+                    self._condition.wait()
+                    continue
+                now = time.monotonic()
+                self._refill(now)
+                wait = max(self._paused_until - now, (1 - self._tokens) / self.rate if self._tokens < 1 else 0)
+                if wait > 0:
+                    # A new request or a 429 wakes the dispatcher up early
+                    self._condition.wait(wait)
+                    continue
+                waiter = heapq.heappop(self._waiters)[2]
+                self._tokens -= 1
+                NCBI_QUEUE_SECONDS.observe(now - waiter.enqueued, priority=PRIORITY_NAMES[waiter.priority])
+                waiter.grant()
+
+    def _enqueue(self, waiter: _Waiter):
+        with self._condition:
+            self._start()
+            heapq.heappush(self._waiters, (waiter.priority, next(self._sequence), waiter))
+            self._condition.notify()
+
+    def acquire(self, priority: Optional[int] = None):
+        """Block until the request may be sent."""
+        waiter = _Waiter(_priority.get() if priority is None else priority)
+        self._enqueue(waiter)
+        waiter.event.wait()
+
+    async def aacquire(self, priority: Optional[int] = None):
+        """Async version of acquire; cancelling it gives the place in the queue up."""
+        waiter = _Waiter(_priority.get() if priority is None else priority, asyncio.get_running_loop())
+        self._enqueue(waiter)
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            waiter.cancelled = True
+            raise
+
+    def throttled(self, retry_after: Optional[float] = None) -> float:
+        """
+        Pause all requests after a 429 answer.
+
+        Args:
+            retry_after: Seconds asked for by the server, if any
+
+        Returns:
+            The pause in seconds
+        """
+        with self._condition:
+            self._throttled_in_a_row += 1
+            delay = retry_after if retry_after is not None else NCBI_BACKOFF_BASE * 2 ** (self._throttled_in_a_row - 1)
+            delay = min(delay, NCBI_MAX_BACKOFF)
+            self._paused_until = max(self._paused_until, time.monotonic() + delay)
+            self._tokens = 0
+            self._condition.notify()
+        return delay
+
+    def succeeded(self):
+        """Reset the backoff once a request gets through."""
+        self._throttled_in_a_row = 0
+
+    def queue_depth(self) -> dict:
+        with self._condition:
+            waiting = [waiter.priority for _, _, waiter in self._waiters if not waiter.cancelled]
+        return {(name,): waiting.count(priority) for priority, name in PRIORITY_NAMES.items()}
+
+    def stats(self) -> dict:
+        return {
+            "rate": self.rate,
+            "burst": self.burst,
+            "queued": {name[0]: count for name, count in self.queue_depth().items()},
+            "paused_for": round(max(0.0, self._paused_until - time.monotonic()), 3),
+        }
+
+
+# Shared by every E-utilities request of the process
+scheduler = TokenBucketScheduler()
+
+NCBI_QUEUE_DEPTH = Gauge(
+    "drugsy_ncbi_queue_depth", "E-utilities requests waiting for a rate limit token.", ("priority",),
+    callback=lambda: scheduler.queue_depth())
+
+
+def _params(params: dict) -> dict:
+    params = {"tool": NCBI_TOOL, "email": NCBI_EMAIL, **params}
+    if NCBI_API_KEY:
+        params.setdefault("api_key", NCBI_API_KEY)
+    return params
+
+
+def _retry_after(response: httpx.Response) -> Optional[float]:
+    retry_after = response.headers.get("Retry-After", "").strip()
+    return float(retry_after) if retry_after.isdigit() else None
+
+
+def _should_retry(response: Optional[httpx.Response], attempt: int) -> bool:
+    """Handle a throttled or failed attempt; True if the request should be queued again."""
+    if response is not None and response.status_code == 429:
+        NCBI_THROTTLED.inc()
+        delay = scheduler.throttled(_retry_after(response))
+        print(f"NCBI E-utilities throttled the request, pausing for {delay:.1f}s")
+    return attempt < NCBI_MAX_RETRIES
+
+
+def get(utility: str, params: dict, priority: Optional[int] = None, timeout: float = REQUEST_TIMEOUT,
+        stream: bool = False, retry_timeouts: bool = True) -> httpx.Response:
+    """
+    Send an E-utilities request once the scheduler allows it.
+
+    Args:
+        utility: The E-utility, e.g. "esearch.fcgi"
+        params: Query parameters; tool, email and the API key are added
+        priority: INTERACTIVE or BACKGROUND; defaults to the priority of the context
+        timeout: Read timeout in seconds
+        stream: Leave the body of the response unread (see http_client.request);
+                the caller closes the response
+        retry_timeouts: Queue the request again after a read timeout; callers
+                        with a fallback of their own raise at once instead
+
+    Returns:
+        The last response; the caller checks its status code
+
+    Raises:
+        httpx.HTTPError: If the last attempt failed without a response
+    """
+    url = f"{EUTILS_BASE_URL}/{utility}"
+    attempt = 0
+    while True:
+        scheduler.acquire(priority)
+        try:
+            # Retries go back through the scheduler instead of the client's own backoff
+            response = http_client.get(url, params=_params(params), timeout=timeout, retry=False, stream=stream)
+        except httpx.TransportError as e:
+            if isinstance(e, httpx.ReadTimeout) and not retry_timeouts or not _should_retry(None, attempt):
+                raise
+        else:
+            if response.status_code not in http_client.RETRY_STATUSES:
+                scheduler.succeeded()
+                return response
+            if not _should_retry(response, attempt):
+                return response
+            response.close()
+        attempt += 1
+
+
+async def aget(utility: str, params: dict, priority: Optional[int] = None, timeout: float = REQUEST_TIMEOUT,
+               stream: bool = False, retry_timeouts: bool = True) -> httpx.Response:
+    """Async version of get."""
+    url = f"{EUTILS_BASE_URL}/{utility}"
+    attempt = 0
+    while True:
+        await scheduler.aacquire(priority)
+        try:
+            response = await http_client.aget(url, params=_params(params), timeout=timeout, retry=False, stream=stream)
+        except httpx.TransportError as e:
+            if isinstance(e, httpx.ReadTimeout) and not retry_timeouts or not _should_retry(None, attempt):
+                raise
+        else:
+            if response.status_code not in http_client.RETRY_STATUSES:
+                scheduler.succeeded()
+                return response
+            if not _should_retry(response, attempt):
+                return response
+            await response.aclose()
+        attempt += 1
@@ -1,8 +1,186 @@
-from langchain.tools import tool
-import requests
+from langchain_core.tools import StructuredTool
+import asyncio
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple
+from urllib.parse import parse_qsl
+import dotenv
+import httpx
+from storage import ResponseCache
+from . import http_client
+from .fda_label_index import get_label_index
 
-@tool
-def query_fda_api(search_query: str) -> str:
+dotenv.load_dotenv()
+
+# Base URL of the openFDA API, overridable to point at a local stand-in
+FDA_API_BASE_URL = os.getenv("FDA_API_BASE_URL", "https://api.fda.gov").rstrip("/")
+FDA_LABEL_URL = f"{FDA_API_BASE_URL}/drug/label.json"
+# Seconds to wait for the FDA API
+REQUEST_TIMEOUT = 30
+
+# Label lookups are cached in memory and in a SQLite file ("" keeps them in memory only)
+FDA_CACHE_PATH = os.getenv("FDA_CACHE_PATH", "cache/fda_labels.sqlite3")
+FDA_CACHE_SIZE = int(os.getenv("FDA_CACHE_SIZE", "1024"))
+# Seconds a label stays cached, and seconds a "no data found" answer stays cached
+FDA_CACHE_TTL = float(os.getenv("FDA_CACHE_TTL", "86400"))
+FDA_CACHE_NEGATIVE_TTL = float(os.getenv("FDA_CACHE_NEGATIVE_TTL", "3600"))
+
+# Drugs accepted per query_fda_api_batch call, and label lookups run at the same time
+FDA_BATCH_MAX_DRUGS = int(os.getenv("FDA_BATCH_MAX_DRUGS", "20"))
+FDA_BATCH_CONCURRENCY = int(os.getenv("FDA_BATCH_CONCURRENCY", "5"))
+
+fda_cache = ResponseCache(
+    "fda_label",
+    path=FDA_CACHE_PATH,
+    max_size=FDA_CACHE_SIZE,
+    ttl_seconds=FDA_CACHE_TTL,
+    negative_ttl_seconds=FDA_CACHE_NEGATIVE_TTL,
+)
+
+# A search term: unquoted characters and quoted phrases, up to the next space outside quotes
+_SEARCH_TERM = re.compile(r'(?:[^\s"]+|"[^"]*")+')
+_SEARCH_OPERATORS = {"and", "or", "not"}
+
+def _normalize_search_term(term: str) -> str:
+    """Normalize a field:value term; values of .exact fields keep their case, as openFDA matches them exactly."""
+    if term.lower() in _SEARCH_OPERATORS:
+        return term.lower()
+    # The field ends at the first colon outside a quoted phrase
+    field, colon, value = term.partition(":") if ":" in term.split('"', 1)[0] else ("", "", term)
+    field = field.lower()
+    if not field.endswith(".exact"):
+        value = value.lower()
+    value = re.sub(r'"(\w+)"', r"\1", value)
+    return f"{field}{colon}{value}"
+
+def normalize_search_query(search_query: str) -> str:
+    """
+    Normalize an openFDA query string so equivalent queries share a cache entry.
+
+    Parameters are sorted, "+" and percent-encoding are decoded, and whitespace
+    and quotes around single words are dropped. Values are lowercased except
+    those of .exact fields, and the terms of a pure AND search are sorted;
+    quoted phrases are kept whole.
+    """
+    params = []
+    for name, value in parse_qsl(search_query.strip().lstrip("?"), keep_blank_values=True):
+        name = name.strip().lower()
+        if name == "api_key":
+            continue
+        value = re.sub(r"\s+", " ", value.strip())
+        if name == "search":
+            # Spaces around colons outside quoted phrases don't matter
+            value = re.sub(r'"[^"]*"|\s*:\s*', lambda match: ":" if match.group().strip() == ":" else match.group(), value)
+            tokens = [_normalize_search_term(token) for token in _SEARCH_TERM.findall(value)]
+            # Only "term and term and ..." can be reordered; terms without an operator are ORed
+            grouped = re.search(r"[()]", re.sub(r'"[^"]*"', "", value))
+            if (len(tokens) % 2 and not grouped and all(token == "and" for token in tokens[1::2])
+                    and not any(token in _SEARCH_OPERATORS for token in tokens[::2])):
+                value = " and ".join(sorted(tokens[::2]))
+            else:
+                value = " ".join(tokens)
+        else:
+            value = value.lower()
+        params.append((name, value))
+    return "&".join(f"{name}={value}" for name, value in sorted(params))
+
+def fda_call_key(args: dict) -> str:
+    """What makes two query_fda_api calls identical: their normalized search query."""
+    return normalize_search_query(str(args.get("search_query", "")))
+
+def _format_label(data: dict, search_query: str) -> dict:
+    """Extract the fields returned to the LLM from an openFDA label result."""
+    return {
+        "product": data.get("spl_product_data_elements", [None])[0],
+        "ingredient_searched": search_query,
+        "active_ingredients": data.get("active_ingredient", [None])[0],
+        "interactions": data.get("drug_interactions", [None])[0],
+        "indications_and_usage": data.get("indications_and_usage", [None])[0],
+        "dosage_and_administration": data.get("dosage_and_administration", [None])[0],
+        "warnings": data.get("warnings", [None])[0],
+        "do_not_use": data.get("do_not_use", [None])[0]
+    }
+
+def _first_label(status_code: int, payload) -> dict:
+    """Return the first label of an openFDA response, or an empty dict if there is none."""
+    if status_code == 200 and payload and payload.get("results"):
+        return payload["results"][0]
+    return {}
+
+def _result(label: dict, search_query: str):
+    if label:
+        return _format_label(label, search_query)
+    return f"No data found for {search_query}"
+
+def _store(cache_key: str, status_code: int, label: dict):
+    # Only definite answers are cached: a label, or openFDA's 404 for no match
+    if label or status_code == 404:
+        fda_cache.put(cache_key, label, negative=not label)
+
+def _local_label(search_query: str):
+    """
+    Look a query up in the local label index.
+
+    Returns:
+        The first matching label, or None if there is no index, the query uses
+        syntax it cannot answer, or nothing matched (the live API is asked then)
+    """
+    index = get_label_index()
+    if index is None:
+        return None
+    payload = index.search(search_query)
+    return _first_label(200, payload) or None
+
+def get_label(search_query: str) -> dict:
+    """
+    Return the first openFDA label matching a query string, looking in the
+    cache, then in the local label index, then in the live API.
+
+    Returns:
+        The raw label, or an empty dict if there is none
+    """
+    cache_key = normalize_search_query(search_query)
+    label = fda_cache.get(cache_key)
+    if label is not None:
+        return label
+
+    label = _local_label(search_query)
+    if label is not None:
+        fda_cache.put(cache_key, label)
+        return label
+
+    url = f'{FDA_LABEL_URL}?{search_query}'
+    response = http_client.get(url, timeout=REQUEST_TIMEOUT)
+    print(response)
+    print(url)
+    payload = response.json() if response.status_code == 200 else None
+    label = _first_label(response.status_code, payload)
+    _store(cache_key, response.status_code, label)
+    return label
+
+async def aget_label(search_query: str) -> dict:
+    """Async version of get_label."""
+    cache_key = normalize_search_query(search_query)
+    label = fda_cache.get(cache_key)
+    if label is not None:
+        return label
+
+    label = await asyncio.to_thread(_local_label, search_query)
+    if label is not None:
+        fda_cache.put(cache_key, label)
+        return label
+
+    url = f'{FDA_LABEL_URL}?{search_query}'
+    response = await http_client.aget(url, timeout=REQUEST_TIMEOUT)
+    print(response)
+    print(url)
+    payload = response.json() if response.status_code == 200 else None
+    label = _first_label(response.status_code, payload)
+    _store(cache_key, response.status_code, label)
+    return label
+
+def _query_fda_api(search_query: str) -> str:
     """Makes a query to the FDA API to get information about a drug.
     
     ARGS:
@@ -34,22 +212,98 @@ def query_fda_api(search_query: str) -> str:
         - warnings
         - do_not_use
     """
-    url = f'https://api.fda.gov/drug/label.json?{search_query}'
-    response = requests.get(url)
-    print(response)
-    print(url)
-    if response.status_code == 200 and "results" in response.json():
-        data = response.json()["results"][0]
-        print(data)
-        return {
-            "product": data.get("spl_product_data_elements", [None])[0],
-            "ingredient_searched": search_query,
-            "active_ingredients": data.get("active_ingredient", [None])[0],
-            "interactions": data.get("drug_interactions", [None])[0],
-            "indications_and_usage": data.get("indications_and_usage", [None])[0],
-            "dosage_and_administration": data.get("dosage_and_administration", [None])[0],
-            "warnings": data.get("warnings", [None])[0],
-            "do_not_use": data.get("do_not_use", [None])[0]
-        }
-    else:
-        return f"No data found for {search_query}"
+    return _result(get_label(search_query), search_query)
+
+async def _aquery_fda_api(search_query: str) -> str:
+    """Async version of query_fda_api, used when the graph runs with ainvoke."""
+    return _result(await aget_label(search_query), search_query)
+
+query_fda_api = StructuredTool.from_function(
+    func=_query_fda_api,
+    coroutine=_aquery_fda_api,
+    name="query_fda_api",
+    description=_query_fda_api.__doc__.strip(),
+)
+
+def drug_query(drug_name: str) -> str:
+    """openFDA query string matching a drug by active ingredient, generic or brand name."""
+    term = re.sub(r"\s+", "+", drug_name.replace('"', "").strip())
+    return (f'search=active_ingredient:"{term}"+OR+openfda.generic_name:"{term}"'
+            f'+OR+openfda.brand_name:"{term}"&limit=1')
+
+def _unique_drugs(drug_names: List[str]) -> Tuple[List[str], List[str]]:
+    """
+    Drug names without blanks and case-insensitive duplicates.
+
+    Returns:
+        (drugs, skipped): the first FDA_BATCH_MAX_DRUGS names, and the ones beyond them
+    """
+    drugs, seen = [], set()
+    for name in drug_names:
+        name = name.strip()
+        if name and name.lower() not in seen:
+            seen.add(name.lower())
+            drugs.append(name)
+    return drugs[:FDA_BATCH_MAX_DRUGS], drugs[FDA_BATCH_MAX_DRUGS:]
+
+def _skipped_entry(drug_name: str) -> dict:
+    # Tells the model the drug wasn't checked, rather than leaving it out silently
+    return {"drug": drug_name, "message": f"Not looked up: at most {FDA_BATCH_MAX_DRUGS} drugs are looked up "
+                                          f"per call. Call the tool again for this drug."}
+
+def _batch_entry(drug_name: str, result) -> dict:
+    if isinstance(result, dict):
+        return {"drug": drug_name, **result}
+    return {"drug": drug_name, "message": result}
+
+def _lookup_drug(drug_name: str) -> dict:
+    try:
+        return _batch_entry(drug_name, _query_fda_api(drug_query(drug_name)))
+    except httpx.HTTPError as e:
+        return {"drug": drug_name, "message": f"Error while consulting the FDA API: {e}"}
+
+async def _alookup_drug(drug_name: str, semaphore: asyncio.Semaphore) -> dict:
+    async with semaphore:
+        try:
+            return _batch_entry(drug_name, await _aquery_fda_api(drug_query(drug_name)))
+        except httpx.HTTPError as e:
+            return {"drug": drug_name, "message": f"Error while consulting the FDA API: {e}"}
+
+def _query_fda_api_batch(drug_names: List[str]) -> dict:
+    """Gets the FDA drug labels of several drugs at once.
+
+    Use this instead of calling query_fda_api once per drug whenever a question involves
+    two or more drugs (for example, checking interactions in a patient's medication list).
+
+    ARGS:
+        drug_names: Active ingredient or brand names in English, one per drug,
+                    e.g. ["warfarin", "ibuprofen", "Prilosec"]. Fix typos and translate
+                    non-English names before querying. At most {max_drugs} drugs are looked
+                    up per call; split longer lists over several calls.
+
+    RETURNS:
+        A dictionary with a "labels" list holding, for each drug in order, the drug name and the same
+        fields as query_fda_api (product, active_ingredients, interactions, indications_and_usage,
+        dosage_and_administration, warnings, do_not_use), or a message if no label was found or the
+        drug was beyond the limit and not looked up.
+    """
+    drugs, skipped = _unique_drugs(drug_names)
+    if not drugs:
+        return {"labels": []}
+    with ThreadPoolExecutor(max_workers=min(len(drugs), FDA_BATCH_CONCURRENCY)) as executor:
+        labels = list(executor.map(_lookup_drug, drugs))
+    return {"labels": labels + [_skipped_entry(drug) for drug in skipped]}
+
+async def _aquery_fda_api_batch(drug_names: List[str]) -> dict:
+    """Async version of query_fda_api_batch, used when the graph runs with ainvoke."""
+    drugs, skipped = _unique_drugs(drug_names)
+    semaphore = asyncio.Semaphore(FDA_BATCH_CONCURRENCY)
+    labels = await asyncio.gather(*(_alookup_drug(drug, semaphore) for drug in drugs))
+    return {"labels": list(labels) + [_skipped_entry(drug) for drug in skipped]}
+
+query_fda_api_batch = StructuredTool.from_function(
+    func=_query_fda_api_batch,
+    coroutine=_aquery_fda_api_batch,
+    name="query_fda_api_batch",
+    description=_query_fda_api_batch.__doc__.strip().format(max_drugs=FDA_BATCH_MAX_DRUGS),
+)
@@ -0,0 +1,477 @@
+"""
+Local openFDA drug label index.
+
+Labels from the openFDA ``drug/label`` bulk download are streamed into a
+SQLite database with an FTS5 full-text index over the fields query_fda_api
+returns, so label lookups are answered locally in milliseconds. Queries use
+the openFDA ``search=field:value`` syntax; anything the index cannot answer
+falls back to the live API.
+
+Usage (from the backend directory):
+    # Load downloaded partitions (.json or .json.zip), one or more at a time
+    python -m tools.fda_label_index ingest drug-label-0001-of-0013.json.zip ...
+    # Download and load the partitions of a newer export (run periodically, e.g. from cron)
+    python -m tools.fda_label_index refresh
+    python -m tools.fda_label_index search 'search=active_ingredient:omeprazole'
+    python -m tools.fda_label_index stats
+"""
+import argparse
+import io
+import json
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+import zipfile
+from contextlib import closing
+from typing import Iterator, List, Optional
+from urllib.parse import parse_qsl
+
+import dotenv
+
+from . import http_client
+
+dotenv.load_dotenv()
+
+# SQLite file holding the label index
+FDA_LABEL_INDEX_PATH = os.getenv("FDA_LABEL_INDEX_PATH", "data/fda_label_index.sqlite3")
+# openFDA manifest listing the partitions of the latest bulk export
+FDA_DOWNLOAD_MANIFEST_URL = os.getenv("FDA_DOWNLOAD_MANIFEST_URL", "https://api.fda.gov/download.json")
+# Labels written per transaction while ingesting
+INGEST_BATCH_SIZE = 1000
+# Seconds between checks for an index file created after startup
+INDEX_RECHECK_SECONDS = 60
+
+# Label sections stored and indexed, as lists of text in openFDA labels
+LABEL_FIELDS = [
+    "active_ingredient",
+    "drug_interactions",
+    "warnings",
+    "indications_and_usage",
+    "dosage_and_administration",
+    "do_not_use",
+    "spl_product_data_elements",
+]
+# Names from the openfda section, indexed as separate columns
+OPENFDA_FIELDS = ["brand_name", "generic_name", "substance_name"]
+INDEXED_COLUMNS = LABEL_FIELDS + OPENFDA_FIELDS
+
+RESULTS_ARRAY = re.compile(r'"results"\s*:\s*\[')
+# field:value clauses, values being a quoted phrase or a single word
+CLAUSE = re.compile(r'\s*(?:([\w.]+):)?("[^"]*"|[^\s"()]+)\s*')
+UNSUPPORTED_SYNTAX = re.compile(r'[()\[\]{}*?~]|_exists_|_missing_| TO ')
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS labels (
+    rowid INTEGER PRIMARY KEY,
+    id TEXT,
+    set_id TEXT NOT NULL UNIQUE,
+    version INTEGER,
+    effective_time TEXT,
+    openfda TEXT,
+    {", ".join(f"{column} TEXT" for column in INDEXED_COLUMNS)}
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS labels_fts USING fts5(
+    {", ".join(INDEXED_COLUMNS)},
+    content='labels', content_rowid='rowid', tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS labels_ai AFTER INSERT ON labels BEGIN
+    INSERT INTO labels_fts (rowid, {", ".join(INDEXED_COLUMNS)})
+    VALUES (new.rowid, {", ".join(f"new.{column}" for column in INDEXED_COLUMNS)});
+END;
+CREATE TRIGGER IF NOT EXISTS labels_ad AFTER DELETE ON labels BEGIN
+    INSERT INTO labels_fts (labels_fts, rowid, {", ".join(INDEXED_COLUMNS)})
+    VALUES ('delete', old.rowid, {", ".join(f"old.{column}" for column in INDEXED_COLUMNS)});
+END;
+CREATE TRIGGER IF NOT EXISTS labels_au AFTER UPDATE ON labels BEGIN
+    INSERT INTO labels_fts (labels_fts, rowid, {", ".join(INDEXED_COLUMNS)})
+    VALUES ('delete', old.rowid, {", ".join(f"old.{column}" for column in INDEXED_COLUMNS)});
+    INSERT INTO labels_fts (rowid, {", ".join(INDEXED_COLUMNS)})
+    VALUES (new.rowid, {", ".join(f"new.{column}" for column in INDEXED_COLUMNS)});
+END;
+CREATE TABLE IF NOT EXISTS index_meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+# Newer labels (by effective time, then version) replace older versions of the same set
+UPSERT = f"""
+INSERT INTO labels (id, set_id, version, effective_time, openfda, {", ".join(INDEXED_COLUMNS)})
+VALUES ({", ".join("?" for _ in range(5 + len(INDEXED_COLUMNS)))})
+ON CONFLICT(set_id) DO UPDATE SET
+    id = excluded.id, version = excluded.version, effective_time = excluded.effective_time,
+    openfda = excluded.openfda, {", ".join(f"{column} = excluded.{column}" for column in INDEXED_COLUMNS)}
+WHERE excluded.effective_time > labels.effective_time
+   OR (excluded.effective_time = labels.effective_time AND excluded.version > labels.version)
+"""
+
+
+def iter_labels(stream: io.TextIOBase, chunk_size: int = 1 << 20) -> Iterator[dict]:
+    """
+    Yield the labels of an openFDA bulk file one at a time.
+
+    Only the label being decoded is held in memory, so partitions of several
+    hundred megabytes can be loaded without reading them whole.
+
+    Args:
+        stream: Text stream of the JSON file
+        chunk_size: Characters read at a time
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    # Skip the meta section up to the start of the results array
+    while True:
+        match = RESULTS_ARRAY.search(buffer)
+        if match:
+            buffer = buffer[match.end():]
+            break
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            return
+        # Keep a tail in case the key is split between two chunks
+        buffer = buffer[-32:] + chunk
+
+    position = 0
+    while True:
+        while position < len(buffer) and buffer[position] in " \t\r\n,":
+            position += 1
+        if position == len(buffer):
+            chunk = stream.read(chunk_size)
+            if not chunk:
+                return
+            buffer, position = chunk, 0
+            continue
+        if buffer[position] == "]":
+            return
+        try:
+            label, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            # The label continues in the next chunk
+            chunk = stream.read(chunk_size)
+            if not chunk:
+                raise
+            buffer, position = buffer[position:] + chunk, 0
+            continue
+        yield label
+        position = end
+        if position > chunk_size:
+            buffer, position = buffer[position:], 0
+
+
+def _open_text_streams(path: str) -> Iterator[io.TextIOBase]:
+    """Yield text streams for a .json file or for every .json member of a .zip file."""
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            for name in archive.namelist():
+                if name.endswith(".json"):
+                    with archive.open(name) as member:
+                        yield io.TextIOWrapper(member, encoding="utf-8")
+    else:
+        with open(path, encoding="utf-8") as f:
+            yield f
+
+
+def _label_row(label: dict) -> tuple:
+    openfda = label.get("openfda") or {}
+    set_id = label.get("set_id") or label.get("id")
+    try:
+        version = int(label.get("version") or 0)
+    except ValueError:
+        version = 0
+    return (
+        label.get("id"),
+        set_id,
+        version,
+        label.get("effective_time") or "",
+        json.dumps(openfda),
+        *("\n".join(label.get(field) or []) or None for field in LABEL_FIELDS),
+        *(" | ".join(openfda.get(field) or []) or None for field in OPENFDA_FIELDS),
+    )
+
+
+def _fts_phrase(value: str) -> str:
+    return '"' + value.strip('"').replace('"', '""') + '"'
+
+
+def translate_search(search: str) -> Optional[str]:
+    """
+    Translate an openFDA search expression into an FTS5 query.
+
+    Supports field:value and field:"phrase" clauses joined by AND/OR (openFDA
+    treats whitespace as OR), openfda.* field names, and bare terms searched
+    in every column. .exact fields match a whole value, which the tokenized
+    columns can't tell apart from a phrase within it ("ibuprofen" would match
+    "ibuprofen and famotidine"), so they are left to the live API.
+
+    Returns:
+        The FTS5 MATCH expression, or None if the search uses syntax or fields
+        the index cannot answer
+    """
+    if not search.strip() or UNSUPPORTED_SYNTAX.search(search):
+        return None
+    parts: List[str] = []
+    operator = None
+    position = 0
+    while position < len(search):
+        match = CLAUSE.match(search, position)
+        if not match or match.end() == position:
+            return None
+        position = match.end()
+        field, value = match.groups()
+        if field is None and value.upper() in ("AND", "OR", "NOT"):
+            if value.upper() == "NOT":
+                return None
+            operator = value.upper()
+            continue
+
+        if field is None:
+            expression = _fts_phrase(value)
+        else:
+            column = field.lower()
+            if column.startswith("openfda."):
+                column = column[len("openfda."):]
+            if column not in INDEXED_COLUMNS:
+                return None
+            expression = f"{column} : {_fts_phrase(value)}"
+        if parts:
+            parts.append(operator or "OR")
+        parts.append(expression)
+        operator = None
+    return " ".join(parts) if parts else None
+
+
+class FDALabelIndex:
+    """SQLite FTS5 index of openFDA drug labels."""
+
+    def __init__(self, path: str = FDA_LABEL_INDEX_PATH):
+        """
+        Args:
+            path: SQLite file of the index, created if missing
+        """
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Readers get one connection per thread; ingestion uses its own
+        self._local = threading.local()
+        with closing(self._connect()) as db, db:
+            db.executescript(SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        db = sqlite3.connect(self.path)
+        db.execute("PRAGMA journal_mode=WAL")
+        return db
+
+    def _reader(self) -> sqlite3.Connection:
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = self._local.db = self._connect()
+        return db
+
+    def search(self, search_query: str) -> Optional[dict]:
+        """
+        Answer an openFDA label query string from the index.
+
+        Args:
+            search_query: The query string passed to query_fda_api, e.g. 'search=active_ingredient:omeprazole'
+
+        Returns:
+            A payload shaped like the openFDA response ({"results": [...]}), or
+            None if the query cannot be answered locally
+        """
+        params = dict(parse_qsl(search_query.strip().lstrip("?"), keep_blank_values=True))
+        fts_query = translate_search(params.get("search", ""))
+        if fts_query is None:
+            return None
+        try:
+            limit = max(1, min(int(params.get("limit", 1)), 100))
+            skip = max(0, int(params.get("skip", 0)))
+        except ValueError:
+            return None
+
+        try:
+            rows = self._reader().execute(
+                f"SELECT labels.id, labels.set_id, labels.version, labels.effective_time, labels.openfda, "
+                f"{', '.join(f'labels.{column}' for column in LABEL_FIELDS)} "
+                f"FROM labels_fts JOIN labels ON labels.rowid = labels_fts.rowid "
+                f"WHERE labels_fts MATCH ? ORDER BY bm25(labels_fts) LIMIT ? OFFSET ?",
+                (fts_query, limit, skip),
+            ).fetchall()
+        except sqlite3.OperationalError as e:
+            print(f"FDA label index could not run {fts_query!r}: {e}")
+            return None
+
+        results = []
+        for row in rows:
+            label = {
+                "id": row[0],
+                "set_id": row[1],
+                "version": str(row[2]),
+                "effective_time": row[3],
+                "openfda": json.loads(row[4] or "{}"),
+            }
+            for field, text in zip(LABEL_FIELDS, row[5:]):
+                if text is not None:
+                    label[field] = [text]
+            results.append(label)
+        return {"meta": {"results": {"skip": skip, "limit": limit, "total": len(results)}}, "results": results}
+
+    def ingest(self, path: str) -> dict:
+        """
+        Load a bulk label file (.json or .json.zip) into the index.
+
+        Labels are upserted by set ID and only replace an older version, so
+        loading a newer export only rewrites the labels that changed.
+
+        Returns:
+            Counts of labels read and written
+        """
+        started = time.perf_counter()
+        read = written = 0
+        with closing(self._connect()) as db, db:
+            db.execute("PRAGMA synchronous=NORMAL")
+            for stream in _open_text_streams(path):
+                batch = []
+                for label in iter_labels(stream):
+                    if not (label.get("set_id") or label.get("id")):
+                        continue
+                    batch.append(_label_row(label))
+                    read += 1
+                    if len(batch) >= INGEST_BATCH_SIZE:
+                        written += self._write_batch(db, batch)
+                        batch = []
+                if batch:
+                    written += self._write_batch(db, batch)
+        elapsed = time.perf_counter() - started
+        print(f"Ingested {path}: {read} labels read, {written} inserted or updated in {elapsed:.1f}s")
+        return {"read": read, "written": written}
+
+    @staticmethod
+    def _write_batch(db: sqlite3.Connection, batch: list) -> int:
+        # rowcount leaves out the FTS rows changed by the triggers and the
+        # labels skipped because the stored version is as new
+        written = db.executemany(UPSERT, batch).rowcount
+        db.commit()
+        return written
+
+    def iter_interaction_sections(self) -> Iterator[tuple]:
+        """Yield (set_id, openfda, drug_interactions) of every label, the text being None if it has none."""
+        db = self._connect()
+        try:
+            for set_id, openfda, interactions in db.execute("SELECT set_id, openfda, drug_interactions FROM labels"):
+                yield set_id, json.loads(openfda or "{}"), interactions
+        finally:
+            db.close()
+
+    def get_meta(self, key: str) -> Optional[str]:
+        row = self._reader().execute("SELECT value FROM index_meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key: str, value: str):
+        with closing(self._connect()) as db, db:
+            db.execute("INSERT OR REPLACE INTO index_meta (key, value) VALUES (?, ?)", (key, value))
+
+    def refresh(self, manifest_url: str = FDA_DOWNLOAD_MANIFEST_URL) -> dict:
+        """
+        Download and ingest the partitions of the latest bulk export if it is
+        newer than the last one loaded.
+
+        Returns:
+            The export date and counts of labels read and written
+        """
+        manifest = http_client.get(manifest_url).json()
+        label_export = manifest["results"]["drug"]["label"]
+        export_date = label_export.get("export_date")
+        if export_date and export_date == self.get_meta("export_date"):
+            print(f"FDA label index is up to date (export {export_date})")
+            return {"export_date": export_date, "read": 0, "written": 0}
+
+        totals = {"export_date": export_date, "read": 0, "written": 0}
+        for partition in label_export["partitions"]:
+            url = partition["file"]
+            with tempfile.NamedTemporaryFile(suffix=".json.zip", delete=False) as f:
+                temp_path = f.name
+                with http_client.get_client(url).stream("GET", url, timeout=None) as response:
+                    response.raise_for_status()
+                    for chunk in response.iter_bytes():
+                        f.write(chunk)
+            try:
+                counts = self.ingest(temp_path)
+            finally:
+                os.remove(temp_path)
+            totals["read"] += counts["read"]
+            totals["written"] += counts["written"]
+        if export_date:
+            self.set_meta("export_date", export_date)
+        return totals
+
+    def stats(self) -> dict:
+        db = self._reader()
+        return {
+            "path": self.path,
+            "labels": db.execute("SELECT COUNT(*) FROM labels").fetchone()[0],
+            "export_date": self.get_meta("export_date"),
+            "size_mb": round(os.path.getsize(self.path) / (1024 * 1024), 1),
+        }
+
+
+_index: Optional[FDALabelIndex] = None
+_index_checked_at = float("-inf")
+_index_lock = threading.Lock()
+
+
+def get_label_index() -> Optional[FDALabelIndex]:
+    """
+    Return the label index if FDA_LABEL_INDEX_PATH exists, or None.
+
+    An index file created after startup (by the ingest command) is picked up
+    within INDEX_RECHECK_SECONDS.
+    """
+    global _index, _index_checked_at
+    if _index is not None:
+        return _index
+    # Checked under the lock so callers arriving while the index opens wait for it
+    with _index_lock:
+        now = time.monotonic()
+        if _index is None and now - _index_checked_at >= INDEX_RECHECK_SECONDS:
+            if FDA_LABEL_INDEX_PATH and os.path.exists(FDA_LABEL_INDEX_PATH):
+                _index = FDALabelIndex(FDA_LABEL_INDEX_PATH)
+                print(f"Using local FDA label index at {FDA_LABEL_INDEX_PATH}")
+            _index_checked_at = now
+        return _index
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--index", default=FDA_LABEL_INDEX_PATH, help="SQLite file of the index")
+    commands = parser.add_subparsers(dest="command", required=True)
+    ingest = commands.add_parser("ingest", help="Load bulk label files")
+    ingest.add_argument("files", nargs="+")
+    refresh = commands.add_parser("refresh", help="Download and load a newer bulk export")
+    refresh.add_argument("--manifest", default=FDA_DOWNLOAD_MANIFEST_URL)
+    search = commands.add_parser("search", help="Run an openFDA query string against the index")
+    search.add_argument("query")
+    commands.add_parser("stats", help="Show index statistics")
+    args = parser.parse_args()
+
+    index = FDALabelIndex(args.index)
+    if args.command == "ingest":
+        for path in args.files:
+            index.ingest(path)
+    elif args.command == "refresh":
+        print(index.refresh(args.manifest))
+    elif args.command == "search":
+        started = time.perf_counter()
+        payload = index.search(args.query)
+        elapsed = (time.perf_counter() - started) * 1000
+        if payload is None:
+            print("The index cannot answer this query; query_fda_api would use the live API")
+        else:
+            for label in payload["results"]:
+                print(json.dumps({"set_id": label["set_id"], "openfda": label["openfda"]}, indent=1))
+            print(f"{len(payload['results'])} labels in {elapsed:.2f} ms")
+    print(index.stats())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+"""
+Shared HTTP client layer for the external tools.
+
+Every host gets its own keep-alive connection pool (one sync and one async
+client per host), so connection limits apply per host and TCP/TLS handshakes
+are reused across tool calls. HTTP/2 is used when the h2 package is installed.
+Requests get connect and read timeouts, and idempotent requests are retried
+with exponential backoff on connection errors, timeouts, 429 and 5xx answers.
+"""
+import asyncio
+import importlib.util
+import os
+import random
+import threading
+import time
+import weakref
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+import dotenv
+import httpx
+
+from monitoring import HTTP_REQUESTS, HTTP_REQUEST_SECONDS, HTTP_RETRIES, Gauge
+
+dotenv.load_dotenv()
+
+# Seconds to establish a connection, and default seconds to wait for a response
+CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "30"))
+# Connection limits of each host's pool
+MAX_CONNECTIONS_PER_HOST = int(os.getenv("HTTP_MAX_CONNECTIONS_PER_HOST", "10"))
+MAX_KEEPALIVE_PER_HOST = int(os.getenv("HTTP_MAX_KEEPALIVE_PER_HOST", "10"))
+KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+# Retries after the first attempt, and the base delay of the exponential backoff
+MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "3"))
+BACKOFF_BASE = float(os.getenv("HTTP_BACKOFF_BASE", "0.5"))
+# Longest wait honoured from a Retry-After header
+MAX_RETRY_AFTER = float(os.getenv("HTTP_MAX_RETRY_AFTER", "30"))
+
+# HTTP/2 needs the optional h2 package
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "true").lower() == "true" and importlib.util.find_spec("h2") is not None
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+
+_sync_clients: Dict[Tuple[str, str, int], httpx.Client] = {}
+# Async clients are bound to the event loop that created their connections
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[Tuple[str, str, int], httpx.AsyncClient]]" = weakref.WeakKeyDictionary()
+_clients_lock = threading.Lock()
+
+
+def _host_key(url: str) -> Tuple[str, str, int]:
+    parts = urlsplit(url)
+    port = parts.port or (443 if parts.scheme == "https" else 80)
+    return parts.scheme, parts.hostname or "", port
+
+
+def _client_options() -> dict:
+    return {
+        "timeout": httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT),
+        "limits": httpx.Limits(
+            max_connections=MAX_CONNECTIONS_PER_HOST,
+            max_keepalive_connections=MAX_KEEPALIVE_PER_HOST,
+            keepalive_expiry=KEEPALIVE_EXPIRY,
+        ),
+        "http2": HTTP2_ENABLED,
+        "follow_redirects": True,
+    }
+
+
+def get_client(url: str) -> httpx.Client:
+    """Return the shared sync client for the host of a URL."""
+    key = _host_key(url)
+    with _clients_lock:
+        client = _sync_clients.get(key)
+        if client is None or client.is_closed:
+            client = _sync_clients[key] = httpx.Client(**_client_options())
+        return client
+
+
+def get_async_client(url: str) -> httpx.AsyncClient:
+    """Return the shared async client for the host of a URL on the running event loop."""
+    loop = asyncio.get_running_loop()
+    key = _host_key(url)
+    with _clients_lock:
+        clients = _async_clients.setdefault(loop, {})
+        client = clients.get(key)
+        if client is None or client.is_closed:
+            client = clients[key] = httpx.AsyncClient(**_client_options())
+        return client
+
+
+def _timeout(timeout) -> Optional[httpx.Timeout]:
+    """A number sets the read timeout only; the connect timeout stays short."""
+    if timeout is None or isinstance(timeout, httpx.Timeout):
+        return timeout
+    return httpx.Timeout(timeout, connect=min(CONNECT_TIMEOUT, timeout))
+
+
+def _should_retry(method: str, attempt: int, retry: Optional[bool]) -> bool:
+    allowed = retry if retry is not None else method.upper() in IDEMPOTENT_METHODS
+    return allowed and attempt < MAX_RETRIES
+
+
+def _backoff(attempt: int, response: Optional[httpx.Response] = None) -> float:
+    """Seconds to wait before the next attempt, honouring Retry-After."""
+    if response is not None:
+        retry_after = response.headers.get("Retry-After")
+        if retry_after and retry_after.strip().isdigit():
+            return min(float(retry_after), MAX_RETRY_AFTER)
+    return BACKOFF_BASE * (2 ** attempt) + random.uniform(0, BACKOFF_BASE)
+
+
+def _record(host: str, started: float, outcome: str):
+    HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, host=host)
+    HTTP_REQUESTS.inc(host=host, outcome=outcome)
+
+
+def request(method: str, url: str, timeout=None, retry: Optional[bool] = None, stream: bool = False,
+            **kwargs) -> httpx.Response:
+    """
+    Send a request with the host's shared client, retrying transient failures.
+
+    Args:
+        method: HTTP method
+        url: Absolute URL
+        timeout: Read timeout in seconds (or an httpx.Timeout); defaults to HTTP_READ_TIMEOUT
+        retry: Force retries on or off; by default only idempotent methods are retried
+        stream: Return once the headers are in, leaving the body to be read with
+                iter_bytes() and the response to be closed by the caller
+        **kwargs: Passed to httpx (params, json, headers, ...)
+
+    Returns:
+        The last response; the caller checks its status code
+
+    Raises:
+        httpx.HTTPError: If the last attempt failed without a response
+    """
+    client = get_client(url)
+    host = _host_key(url)[1]
+    if timeout is not None:
+        kwargs["timeout"] = _timeout(timeout)
+    attempt = 0
+    while True:
+        started = time.perf_counter()
+        try:
+            response = client.send(client.build_request(method, url, **kwargs), stream=stream)
+        except httpx.TransportError:
+            _record(host, started, "error")
+            if not _should_retry(method, attempt, retry):
+                raise
+            delay = _backoff(attempt)
+        else:
+            _record(host, started, str(response.status_code))
+            if response.status_code not in RETRY_STATUSES or not _should_retry(method, attempt, retry):
+                return response
+            delay = _backoff(attempt, response)
+            response.close()
+        HTTP_RETRIES.inc(host=host)
+        attempt += 1
+        time.sleep(delay)
+
+
+async def arequest(method: str, url: str, timeout=None, retry: Optional[bool] = None, stream: bool = False,
+                   **kwargs) -> httpx.Response:
+    """Async version of request, sharing connections on the running event loop."""
+    client = get_async_client(url)
+    host = _host_key(url)[1]
+    if timeout is not None:
+        kwargs["timeout"] = _timeout(timeout)
+    attempt = 0
+    while True:
+        started = time.perf_counter()
+        try:
+            response = await client.send(client.build_request(method, url, **kwargs), stream=stream)
+        except httpx.TransportError:
+            _record(host, started, "error")
+            if not _should_retry(method, attempt, retry):
+                raise
+            delay = _backoff(attempt)
+        else:
+            _record(host, started, str(response.status_code))
+            if response.status_code not in RETRY_STATUSES or not _should_retry(method, attempt, retry):
+                return response
+            delay = _backoff(attempt, response)
+            await response.aclose()
+        HTTP_RETRIES.inc(host=host)
+        attempt += 1
+        await asyncio.sleep(delay)
+
+
+def get(url: str, **kwargs) -> httpx.Response:
+    return request("GET", url, **kwargs)
+
+
+async def aget(url: str, **kwargs) -> httpx.Response:
+    return await arequest("GET", url, **kwargs)
+
+
+def put(url: str, **kwargs) -> httpx.Response:
+    return request("PUT", url, **kwargs)
+
+
+def post(url: str, **kwargs) -> httpx.Response:
+    return request("POST", url, **kwargs)
+
+
+def _pool_connections(client) -> Tuple[int, int]:
+    """(active, idle) connections of a client's pool."""
+    pool = getattr(getattr(client, "_transport", None), "_pool", None)
+    connections = list(getattr(pool, "connections", []) or [])
+    idle = sum(1 for connection in connections if connection.is_idle())
+    return len(connections) - idle, idle
+
+
+def pool_stats() -> dict:
+    """
+    Return statistics of every host's connection pools.
+
+    Returns:
+        {host: {"active": ..., "idle": ..., "requests": {outcome: count}, "retries": ...}}
+    """
+    with _clients_lock:
+        clients = [(key, client) for key, client in _sync_clients.items()]
+        for loop_clients in list(_async_clients.values()):
+            clients.extend(loop_clients.items())
+
+    stats = {}
+    for (scheme, host, port), client in clients:
+        if client.is_closed:
+            continue
+        entry = stats.setdefault(host, {"active": 0, "idle": 0, "clients": 0})
+        active, idle = _pool_connections(client)
+        entry["active"] += active
+        entry["idle"] += idle
+        entry["clients"] += 1
+    for host, entry in stats.items():
+        entry["requests"] = HTTP_REQUESTS.values(host=host)
+        entry["retries"] = HTTP_RETRIES.value(host=host)
+    return stats
+
+
+def _pool_gauge() -> dict:
+    values = {}
+    for host, entry in pool_stats().items():
+        values[(host, "active")] = entry["active"]
+        values[(host, "idle")] = entry["idle"]
+    return values
+
+
+HTTP_POOL_CONNECTIONS = Gauge(
+    "drugsy_http_pool_connections", "Connections in the shared HTTP pools.", ("host", "state"), callback=_pool_gauge)
+
+
+def close_clients():
+    """Close the shared sync clients."""
+    with _clients_lock:
+        clients = list(_sync_clients.values())
+        _sync_clients.clear()
+    for client in clients:
+        client.close()
+
+
+async def aclose_clients():
+    """Close the shared async clients of the running event loop."""
+    with _clients_lock:
+        clients = list(_async_clients.pop(asyncio.get_running_loop(), {}).values())
+    for client in clients:
+        await client.aclose()
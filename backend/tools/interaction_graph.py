@@ -0,0 +1,504 @@
+"""
+Drug-drug interaction graph built from FDA label "drug interactions" sections.
+
+Nodes are active ingredients; an edge between two ingredients records the
+most severe interaction one of their labels describes, with the sentence it
+was found in and the label it came from. Brand and generic names resolve to
+their ingredients, so a patient's medication list is checked pair by pair
+with dictionary lookups.
+
+The full graph is precomputed from the local openFDA label index
+(tools/fda_label_index.py). Medications it does not know are looked up with
+the FDA tools and scanned against each other at request time.
+
+Usage (from the backend directory):
+    python -m tools.interaction_graph build
+    python -m tools.interaction_graph scan warfarin Advil "metformin 500 mg"
+    python -m tools.interaction_graph stats
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import combinations
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import dotenv
+import httpx
+
+from . import fda_api
+from .fda_label_index import FDA_LABEL_INDEX_PATH, FDALabelIndex
+
+dotenv.load_dotenv()
+
+# JSON file holding the precomputed graph
+INTERACTION_GRAPH_PATH = os.getenv("INTERACTION_GRAPH_PATH", "data/interaction_graph.json")
+# Characters of label text kept per edge
+SNIPPET_LENGTH = 300
+# Seconds between checks for a new or rebuilt graph file
+GRAPH_RECHECK_SECONDS = 60
+# Seconds a scan may take before its callers give up on it
+INTERACTION_SCAN_TIMEOUT = float(os.getenv("INTERACTION_SCAN_TIMEOUT", "5"))
+# Seconds a medication whose label lookup failed or timed out isn't looked up again,
+# so scans don't all wait for the FDA API while it is unavailable
+LABEL_RETRY_SECONDS = float(os.getenv("INTERACTION_LABEL_RETRY_SECONDS", "300"))
+
+SEVERITIES = ["minor", "moderate", "major", "contraindicated"]
+# Checked in order; the first pattern found in the sentence sets the severity
+SEVERITY_PATTERNS = [
+    ("contraindicated", re.compile(
+        r"contraindicat|do not (?:use|take|coadminister|co-administer|combine)"
+        r"|(?:should|must) not be (?:used|given|taken|coadministered|co-administered)", re.I)),
+    ("major", re.compile(
+        r"fatal|death|life[- ]threatening|serious|severe|avoid|hemorrhag|bleeding|serotonin syndrome"
+        r"|qt (?:interval )?prolongation|torsade|rhabdomyolysis|toxicity", re.I)),
+    ("moderate", re.compile(r"monitor|caution|adjust|reduc|increas|decreas|dose|dosage", re.I)),
+]
+
+# Drug classes label texts commonly refer to, mapped to their common members
+DRUG_CLASSES = {
+    "nsaids": ["ibuprofen", "naproxen", "diclofenac", "celecoxib", "meloxicam", "indomethacin", "ketorolac", "aspirin"],
+    "anticoagulants": ["warfarin", "heparin", "apixaban", "rivaroxaban", "dabigatran", "edoxaban", "enoxaparin"],
+    "antiplatelet agents": ["clopidogrel", "prasugrel", "ticagrelor", "aspirin"],
+    "ssris": ["fluoxetine", "sertraline", "paroxetine", "citalopram", "escitalopram", "fluvoxamine"],
+    "maois": ["phenelzine", "tranylcypromine", "isocarboxazid", "selegiline"],
+    "statins": ["atorvastatin", "simvastatin", "rosuvastatin", "pravastatin", "lovastatin"],
+    "ace inhibitors": ["lisinopril", "enalapril", "ramipril", "captopril", "benazepril"],
+    "loop diuretics": ["furosemide", "bumetanide", "torsemide"],
+    "corticosteroids": ["prednisone", "prednisolone", "methylprednisolone", "dexamethasone", "hydrocortisone"],
+}
+CLASS_ALIASES = {
+    "nsaid": "nsaids",
+    "nonsteroidal anti-inflammatory drugs": "nsaids",
+    "non-steroidal anti-inflammatory drugs": "nsaids",
+    "anticoagulant": "anticoagulants",
+    "oral anticoagulants": "anticoagulants",
+    "antiplatelet": "antiplatelet agents",
+    "selective serotonin reuptake inhibitors": "ssris",
+    "ssri": "ssris",
+    "monoamine oxidase inhibitors": "maois",
+    "mao inhibitors": "maois",
+    "maoi": "maois",
+    "hmg-coa reductase inhibitors": "statins",
+    "angiotensin-converting enzyme inhibitors": "ace inhibitors",
+    "ace-inhibitors": "ace inhibitors",
+}
+
+TOKEN = re.compile(r"[a-z0-9]+(?:-[a-z0-9]+)*")
+SENTENCE_END = re.compile(r"(?<=[.;])\s+")
+DOSE = re.compile(r"\b\d+(?:[.,]\d+)?\s*(?:mg|mcg|g|ml|iu|units?|%)\b|\b\d+(?:[.,]\d+)?\b")
+# Salt and dosage form words dropped after the first word of a name
+NAME_SUFFIXES = {
+    "hydrochloride", "hcl", "sodium", "potassium", "calcium", "magnesium", "maleate", "besylate", "succinate",
+    "tartrate", "sulfate", "citrate", "mesylate", "fumarate", "acetate", "phosphate", "bromide", "chloride",
+    "tablet", "tablets", "capsule", "capsules", "oral", "solution", "suspension", "injection", "extended", "release",
+    "delayed", "er", "xr", "sr", "xl", "dr", "chewable", "film", "coated",
+}
+
+
+def normalize_drug_name(name: str) -> str:
+    """Lowercase name without strengths, parentheses, salts or dosage forms ("Warfarin Sodium 5 mg" -> "warfarin")."""
+    name = re.sub(r"\([^)]*\)", " ", name.lower())
+    tokens = TOKEN.findall(DOSE.sub(" ", name))
+    if not tokens:
+        return ""
+    return " ".join(tokens[:1] + [token for token in tokens[1:] if token not in NAME_SUFFIXES])
+
+
+def label_ingredients(openfda: dict) -> List[str]:
+    """Normalized ingredients of a label, from its substance names or else its generic names."""
+    names = list(openfda.get("substance_name") or [])
+    if not names:
+        for generic in openfda.get("generic_name") or []:
+            names.extend(re.split(r"\s+and\s+|,\s*", generic, flags=re.I))
+    ingredients = []
+    for name in names:
+        ingredient = normalize_drug_name(name)
+        if ingredient and ingredient not in ingredients:
+            ingredients.append(ingredient)
+    return ingredients
+
+
+def classify_severity(sentence: str) -> str:
+    for severity, pattern in SEVERITY_PATTERNS:
+        if pattern.search(sentence):
+            return severity
+    return "minor"
+
+
+class InteractionGraph:
+    """Ingredient nodes with interaction edges, plus drug name aliases."""
+
+    def __init__(self):
+        # ingredient -> {ingredient -> edge}; both directions share the edge dict
+        self.edges: Dict[str, Dict[str, dict]] = {}
+        # normalized brand or generic name -> ingredients
+        self.aliases: Dict[str, List[str]] = {}
+
+    def add_alias(self, name: str, ingredients: List[str]):
+        name = normalize_drug_name(name)
+        if name and ingredients:
+            known = self.aliases.setdefault(name, [])
+            known.extend(ingredient for ingredient in ingredients if ingredient not in known)
+
+    def add_label(self, openfda: dict, interactions: Optional[str], source: str,
+                  vocabulary: Optional["_Vocabulary"] = None) -> List[str]:
+        """
+        Add a label's names as aliases and the interactions its text mentions as edges.
+
+        Args:
+            openfda: The openfda section of the label
+            interactions: Text of its drug interactions section
+            source: Label reference stored on the edges
+            vocabulary: Ingredient and class names looked for in the text
+
+        Returns:
+            The label's ingredients
+        """
+        ingredients = label_ingredients(openfda)
+        for ingredient in ingredients:
+            self.add_alias(ingredient, [ingredient])
+        for name in (openfda.get("brand_name") or []) + (openfda.get("generic_name") or []):
+            self.add_alias(name, ingredients)
+        if ingredients and interactions and vocabulary is not None:
+            for sentence in SENTENCE_END.split(interactions):
+                mentioned = vocabulary.mentions(sentence)
+                if not mentioned:
+                    continue
+                severity = classify_severity(sentence)
+                snippet = " ".join(sentence.split())[:SNIPPET_LENGTH]
+                for members in mentioned:
+                    # A label naming its own class ("NSAIDs may ...") says nothing about the other members
+                    if len(members) > 1 and any(ingredient in members for ingredient in ingredients):
+                        continue
+                    for other in members:
+                        for ingredient in ingredients:
+                            if other != ingredient:
+                                self.add_edge(ingredient, other, severity, snippet, source)
+        return ingredients
+
+    def add_edge(self, a: str, b: str, severity: str, snippet: str, source: str):
+        """Record an interaction, keeping the most severe one found for the pair."""
+        edge = self.edges.get(a, {}).get(b)
+        if edge is not None and SEVERITIES.index(edge["severity"]) >= SEVERITIES.index(severity):
+            return
+        edge = {"severity": severity, "snippet": snippet, "source": source}
+        self.edges.setdefault(a, {})[b] = edge
+        self.edges.setdefault(b, {})[a] = edge
+
+    def edge(self, a: str, b: str) -> Optional[dict]:
+        return self.edges.get(a, {}).get(b)
+
+    def resolve(self, name: str) -> List[str]:
+        """Ingredients of a brand, generic or ingredient name, or [] if unknown."""
+        return list(self.aliases.get(normalize_drug_name(name), []))
+
+    def to_json(self) -> dict:
+        edges = []
+        for a, neighbours in self.edges.items():
+            for b, edge in neighbours.items():
+                if a < b:
+                    edges.append([a, b, edge["severity"], edge["snippet"], edge["source"]])
+        return {"aliases": self.aliases, "edges": edges}
+
+    @classmethod
+    def from_json(cls, data: dict) -> "InteractionGraph":
+        graph = cls()
+        graph.aliases = data["aliases"]
+        for a, b, severity, snippet, source in data["edges"]:
+            graph.add_edge(a, b, severity, snippet, source)
+        return graph
+
+    def stats(self) -> dict:
+        return {
+            "ingredients": len(self.edges),
+            "edges": sum(len(neighbours) for neighbours in self.edges.values()) // 2,
+            "aliases": len(self.aliases),
+        }
+
+
+class _Vocabulary:
+    """Finds ingredient and drug class names in text by matching word sequences."""
+
+    def __init__(self, ingredients: Iterable[str], classes: bool = True):
+        # first word -> [(words, ingredients)]
+        self._names: Dict[str, List[tuple]] = {}
+        for ingredient in ingredients:
+            self._add(ingredient, (ingredient,))
+        if classes:
+            for name, members in DRUG_CLASSES.items():
+                self._add(name, tuple(members))
+            for alias, name in CLASS_ALIASES.items():
+                self._add(alias, tuple(DRUG_CLASSES[name]))
+
+    def _add(self, name: str, ingredients: tuple):
+        words = tuple(TOKEN.findall(name))
+        if words:
+            self._names.setdefault(words[0], []).append((words, ingredients))
+
+    def mentions(self, text: str) -> List[tuple]:
+        """Ingredients of each name found in the text, as tuples (one per ingredient or class name)."""
+        words = TOKEN.findall(text.lower())
+        found = []
+        for position, word in enumerate(words):
+            for name, ingredients in self._names.get(word, ()):
+                if tuple(words[position:position + len(name)]) == name and ingredients not in found:
+                    found.append(ingredients)
+        return found
+
+
+def build_graph(index: FDALabelIndex) -> InteractionGraph:
+    """Build the graph from every label of the local openFDA label index."""
+    graph = InteractionGraph()
+    ingredients = set()
+    for _, openfda, _ in index.iter_interaction_sections():
+        ingredients.update(label_ingredients(openfda))
+    vocabulary = _Vocabulary(ingredients)
+    for set_id, openfda, interactions in index.iter_interaction_sections():
+        names = openfda.get("brand_name") or openfda.get("generic_name") or ["label"]
+        graph.add_label(openfda, interactions, f"{names[0]} label (set_id {set_id})", vocabulary)
+    return graph
+
+
+_graph: Optional[InteractionGraph] = None
+_graph_mtime = None
+_graph_checked_at = float("-inf")
+_graph_lock = threading.Lock()
+
+
+def get_interaction_graph() -> Optional[InteractionGraph]:
+    """
+    Return the precomputed graph in INTERACTION_GRAPH_PATH, or None if it has
+    not been built. A graph built or rebuilt while the server runs is picked
+    up within GRAPH_RECHECK_SECONDS.
+    """
+    global _graph, _graph_mtime, _graph_checked_at
+    if _graph is not None and time.monotonic() - _graph_checked_at < GRAPH_RECHECK_SECONDS:
+        return _graph
+    # Checked under the lock so callers arriving while the graph loads wait for it
+    with _graph_lock:
+        now = time.monotonic()
+        if now - _graph_checked_at >= GRAPH_RECHECK_SECONDS:
+            try:
+                mtime = os.path.getmtime(INTERACTION_GRAPH_PATH)
+            except OSError:
+                mtime = None
+            if mtime is not None and mtime != _graph_mtime:
+                with open(INTERACTION_GRAPH_PATH) as f:
+                    _graph = InteractionGraph.from_json(json.load(f))
+                _graph_mtime = mtime
+                print(f"Loaded drug interaction graph from {INTERACTION_GRAPH_PATH}: {_graph.stats()}")
+            _graph_checked_at = now
+        return _graph
+
+
+def _unique_names(medications: List[str]) -> List[str]:
+    names, seen = [], set()
+    for name in medications:
+        if name and name.strip() and normalize_drug_name(name) not in seen:
+            seen.add(normalize_drug_name(name))
+            names.append(name.strip())
+    return names
+
+
+_label_failures: Dict[str, float] = {}
+_label_failures_lock = threading.Lock()
+
+
+def _recently_failed(name: str) -> bool:
+    with _label_failures_lock:
+        failed_at = _label_failures.get(normalize_drug_name(name))
+        return failed_at is not None and time.monotonic() - failed_at < LABEL_RETRY_SECONDS
+
+
+def _record_failure(name: str):
+    with _label_failures_lock:
+        _label_failures[normalize_drug_name(name)] = time.monotonic()
+
+
+def _fetch_label(name: str) -> dict:
+    if _recently_failed(name):
+        return {}
+    try:
+        return fda_api.get_label(fda_api.drug_query(normalize_drug_name(name)))
+    except httpx.HTTPError as e:
+        print(f"Error fetching the FDA label of {name}: {e}")
+        _record_failure(name)
+        return {}
+
+
+async def _afetch_label(name: str, semaphore: asyncio.Semaphore) -> dict:
+    if _recently_failed(name):
+        return {}
+    async with semaphore:
+        try:
+            return await fda_api.aget_label(fda_api.drug_query(normalize_drug_name(name)))
+        except httpx.HTTPError as e:
+            print(f"Error fetching the FDA label of {name}: {e}")
+            _record_failure(name)
+            return {}
+        except asyncio.CancelledError:
+            # The caller gave up waiting, usually after INTERACTION_SCAN_TIMEOUT
+            _record_failure(name)
+            raise
+
+
+def _labels_graph(names: List[str], labels: List[dict], known_ingredients: Set[str]) -> InteractionGraph:
+    """
+    Graph of the labels fetched for the medications the precomputed graph does
+    not know, scanned for each other's ingredients and known_ingredients, those
+    of the medications it does know.
+    """
+    graph = InteractionGraph()
+    ingredients = {name: label_ingredients(label.get("openfda") or {}) for name, label in zip(names, labels)}
+    vocabulary = _Vocabulary({ingredient for found in ingredients.values() for ingredient in found} | known_ingredients)
+    for name, label in zip(names, labels):
+        if label:
+            interactions = "\n".join(label.get("drug_interactions") or [])
+            product = (label.get("openfda") or {}).get("brand_name") or [name]
+            graph.add_label(label.get("openfda") or {}, interactions, f"{product[0]} label", vocabulary)
+            graph.add_alias(name, ingredients[name])
+    return graph
+
+
+def _unresolved(names: List[str], graph: Optional[InteractionGraph]) -> Tuple[List[str], Set[str]]:
+    """The names the precomputed graph does not resolve, and the ingredients of the ones it does."""
+    missing, known = [], set()
+    for name in names:
+        ingredients = graph.resolve(name) if graph is not None else []
+        if ingredients:
+            known.update(ingredients)
+        else:
+            missing.append(name)
+    return missing, known
+
+
+def _scan(names: List[str], graphs: List[InteractionGraph], started: float) -> dict:
+    medications, interactions = [], []
+    resolved = {}
+    for name in names:
+        ingredients = []
+        for graph in graphs:
+            ingredients = graph.resolve(name)
+            if ingredients:
+                break
+        resolved[name] = ingredients
+        medications.append({"name": name, "ingredients": ingredients, "resolved": bool(ingredients)})
+
+    pairs = list(combinations(names, 2))
+    for a, b in pairs:
+        worst = None
+        for ingredient_a in resolved[a]:
+            for ingredient_b in resolved[b]:
+                for graph in graphs:
+                    edge = graph.edge(ingredient_a, ingredient_b)
+                    if edge and (worst is None or SEVERITIES.index(edge["severity"]) > SEVERITIES.index(worst[2]["severity"])):
+                        worst = (ingredient_a, ingredient_b, edge)
+        if worst:
+            interactions.append({
+                "drugs": [a, b],
+                "ingredients": [worst[0], worst[1]],
+                **worst[2],
+            })
+    interactions.sort(key=lambda interaction: -SEVERITIES.index(interaction["severity"]))
+    return {
+        "medications": medications,
+        "interactions": interactions,
+        "pairs_checked": len(pairs),
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 2),
+    }
+
+
+def scan_medications(medications: List[str], fetch_missing: bool = True) -> dict:
+    """
+    Check every pair of medications for interactions described in their FDA labels.
+
+    Args:
+        medications: Brand or generic names, with or without strengths
+        fetch_missing: Look up the labels of medications the precomputed graph
+                       does not know (through the FDA label cache, index and API),
+                       except those whose lookup failed in the last LABEL_RETRY_SECONDS
+
+    Returns:
+        The medications with their resolved ingredients, and the interactions
+        found, most severe first, with severity, label snippet and source
+    """
+    started = time.perf_counter()
+    names = _unique_names(medications)
+    graph = get_interaction_graph()
+    graphs = [graph] if graph is not None else []
+    missing, known = _unresolved(names, graph)
+    if fetch_missing and missing:
+        with ThreadPoolExecutor(max_workers=max(1, min(len(missing), fda_api.FDA_BATCH_CONCURRENCY))) as executor:
+            labels = list(executor.map(_fetch_label, missing))
+        graphs.append(_labels_graph(missing, labels, known))
+    return _scan(names, graphs, started)
+
+
+async def ascan_medications(medications: List[str], fetch_missing: bool = True) -> dict:
+    """Async version of scan_medications."""
+    started = time.perf_counter()
+    names = _unique_names(medications)
+    # Loading or reloading the graph file reads it from disk
+    graph = await asyncio.to_thread(get_interaction_graph)
+    graphs = [graph] if graph is not None else []
+    missing, known = _unresolved(names, graph)
+    if fetch_missing and missing:
+        semaphore = asyncio.Semaphore(fda_api.FDA_BATCH_CONCURRENCY)
+        labels = await asyncio.gather(*(_afetch_label(name, semaphore) for name in missing))
+        graphs.append(_labels_graph(missing, labels, known))
+    return _scan(names, graphs, started)
+
+
+def format_scan(scan: dict) -> str:
+    """Describe a scan for the system prompt."""
+    lines = []
+    if scan["interactions"]:
+        lines.append("Interactions between these medications described in their FDA labels:")
+        for interaction in scan["interactions"]:
+            a, b = interaction["drugs"]
+            lines.append(f"- {a} + {b} ({interaction['severity']}): \"{interaction['snippet']}\" [{interaction['source']}]")
+    else:
+        lines.append("No interactions between these medications were found in their FDA labels.")
+    unresolved = [medication["name"] for medication in scan["medications"] if not medication["resolved"]]
+    if unresolved:
+        lines.append(f"No FDA label was found for: {', '.join(unresolved)}; check them with the tools.")
+    return "\n".join(lines)
+
+
+def main():
+    global INTERACTION_GRAPH_PATH
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--graph", default=INTERACTION_GRAPH_PATH, help="JSON file of the graph")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="Build the graph from the local openFDA label index")
+    build.add_argument("--index", default=FDA_LABEL_INDEX_PATH)
+    scan = commands.add_parser("scan", help="Check a medication list")
+    scan.add_argument("medications", nargs="+")
+    commands.add_parser("stats", help="Show graph statistics")
+    args = parser.parse_args()
+
+    INTERACTION_GRAPH_PATH = args.graph
+    if args.command == "build":
+        started = time.perf_counter()
+        graph = build_graph(FDALabelIndex(args.index))
+        directory = os.path.dirname(args.graph)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(f"{args.graph}.tmp", "w") as f:
+            json.dump(graph.to_json(), f)
+        os.replace(f"{args.graph}.tmp", args.graph)
+        print(f"Built {args.graph} in {time.perf_counter() - started:.1f}s: {graph.stats()}")
+    elif args.command == "scan":
+        print(json.dumps(scan_medications(args.medications), indent=1))
+    else:
+        graph = get_interaction_graph()
+        print(graph.stats() if graph else f"No graph at {args.graph}")
+
+
+if __name__ == "__main__":
+    main()
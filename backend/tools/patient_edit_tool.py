@@ -1,9 +1,10 @@
 from langchain.tools import tool
-import requests
+import httpx
 import os
 import json
 from typing import Dict, Any, Optional, List, Union
 from fastapi import HTTPException
+from . import http_client
 
 # Get backend URL from environment or use default
 BACKEND_URL = os.getenv("BACKEND_URL", "http://localhost:8080")
@@ -54,7 +55,7 @@ def edit_patient_data(patient_id: int, update_data: str) -> str:
         url = f"{BACKEND_URL}/patients/{patient_id}"
         headers = get_auth_headers()
         
-        response = requests.put(url, json=update_dict, headers=headers)
+        response = http_client.put(url, json=update_dict, headers=headers)
         
         if response.status_code == 200:
             return response.json()
@@ -82,7 +83,7 @@ def get_patient_data(patient_id: int) -> str:
         url = f"{BACKEND_URL}/patients/{patient_id}"
         headers = get_auth_headers()
         
-        response = requests.get(url, headers=headers)
+        response = http_client.get(url, headers=headers)
         
         if response.status_code == 200:
             return response.json()
@@ -118,7 +119,7 @@ def add_medication(patient_id: int, medication_data: str) -> str:
         url = f"{BACKEND_URL}/patients/{patient_id}"
         headers = get_auth_headers()
         
-        get_response = requests.get(url, headers=headers)
+        get_response = http_client.get(url, headers=headers)
         
         if get_response.status_code != 200:
             return f"Error retrieving patient: {get_response.status_code} - {get_response.text}"
@@ -131,7 +132,7 @@ def add_medication(patient_id: int, medication_data: str) -> str:
         
         # Update patient with new medications list
         update_data = {"medications": medications}
-        update_response = requests.put(url, json=update_data, headers=headers)
+        update_response = http_client.put(url, json=update_data, headers=headers)
         
         if update_response.status_code == 200:
             return update_response.json()
@@ -169,7 +170,7 @@ def add_progress_note(patient_id: int, note_content: str) -> str:
         print(f"Data: {note_data}")
         
         try:
-            response = requests.post(url, json=note_data, headers=headers)
+            response = http_client.post(url, json=note_data, headers=headers)
             print(f"Response status: {response.status_code}")
             print(f"Response content: {response.text}")
 
@@ -179,7 +180,7 @@ def add_progress_note(patient_id: int, note_content: str) -> str:
                 error_msg = f"Error adding progress note: {response.status_code} - {response.text}"
                 print(f"ERROR: {error_msg}")
                 return error_msg
-        except requests.exceptions.RequestException as e:
+        except httpx.HTTPError as e:
             error_msg = f"Request error: {str(e)}"
             print(f"ERROR: {error_msg}")
             return error_msg
@@ -1,117 +1,141 @@
 from langchain.tools import tool
-import requests
-import json
+from . import eutils, pubmed_xml
+import os
+import xml.etree.ElementTree as ET
+from typing import Iterable
+import dotenv
 
-@tool
-def query_pubmed_api(search_query: str) -> str:
-    """Makes a query to the PubMed API to get scientific articles about drugs and their interactions.
-    
-    ARGS:
-        search_query: A search term or phrase to find relevant medical articles.
-                     For example: 'omeprazole food interactions'
-    
-    EXAMPLES:
-        - 'omeprazole food interactions'
-        - 'ibuprofen mechanism of action'
-        - 'metformin diabetes treatment'
-        - 'drug interactions grapefruit'
-    
-    RETURNS:
-        A list of the top 3 most relevant articles with their titles, authors, 
-        publication dates, journals, and abstracts.
+dotenv.load_dotenv()
+
+# Articles returned when the model doesn't ask for a number, and the most it may ask for
+PUBMED_RETMAX = int(os.getenv("PUBMED_RETMAX", "3"))
+PUBMED_MAX_RETMAX = int(os.getenv("PUBMED_MAX_RETMAX", "20"))
+
+def parse_abstracts(chunks: Iterable[bytes]) -> dict:
     """
-    # Base URL for the PubMed API (E-utilities)
-    base_url = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils"
-    
-    # Step 1: Search for articles matching the query
-    search_url = f"{base_url}/esearch.fcgi"
+    Parse an efetch PubmedArticleSet as it arrives.
+
+    Args:
+        chunks: The efetch response body, in chunks
+
+    Returns:
+        A dictionary mapping each PMID to its abstract (articles without one are left out)
+    """
+    stream = pubmed_xml.ArticleStream("PubmedArticle", pubmed_xml.pubmed_article)
+    return {
+        article["pmid"]: article["abstract"]
+        for article in pubmed_xml.iter_records(stream, chunks)
+        if article["pmid"] != "Unknown" and article["abstract"] != "No abstract found"
+    }
+
+def _search(search_query: str, retmax: int) -> list:
     search_params = {
         "db": "pubmed",
         "term": search_query,
         "retmode": "json",
-        "retmax": 3  # Limit to top 3 results
+        "retmax": retmax
     }
-    
-    search_response = requests.get(search_url, params=search_params)
+    search_response = eutils.get("esearch.fcgi", search_params)
     if search_response.status_code != 200:
-        return f"Error searching PubMed: {search_response.status_code}"
-    
-    search_data = search_response.json()
-    id_list = search_data.get('esearchresult', {}).get('idlist', [])
-    
-    if not id_list:
-        return "No articles found for this query."
-    
-    # Step 2: Fetch details for the found article IDs
-    fetch_url = f"{base_url}/efetch.fcgi"
+        raise RuntimeError(f"Error searching PubMed: {search_response.status_code}")
+    return search_response.json().get('esearchresult', {}).get('idlist', [])[:retmax]
+
+def _summaries(id_list: list) -> dict:
+    """Fetch the summaries of all the articles with one esummary request."""
+    summary_params = {
+        "db": "pubmed",
+        "id": ",".join(id_list),
+        "retmode": "json"
+    }
+    summary_response = eutils.get("esummary.fcgi", summary_params)
+    if summary_response.status_code != 200:
+        raise RuntimeError(f"Error fetching article details: {summary_response.status_code}")
+    return summary_response.json().get('result', {})
+
+def _abstracts(id_list: list) -> dict:
+    """Fetch the abstracts of all the articles with one efetch request."""
     fetch_params = {
         "db": "pubmed",
         "id": ",".join(id_list),
         "retmode": "xml"
     }
-    
-    fetch_response = requests.get(fetch_url, params=fetch_params)
-    if fetch_response.status_code != 200:
-        return f"Error fetching article details: {fetch_response.status_code}"
-    
-    # Parse the XML response to extract article details
-    # This is a simplified version - in a real implementation, you would use
-    # a proper XML parser to extract structured data
-    
-    # For this example, we'll return a simplified response
+    fetch_response = eutils.get("efetch.fcgi", fetch_params, stream=True)
+    try:
+        if fetch_response.status_code != 200:
+            print(f"Error fetching abstracts: {fetch_response.status_code}")
+            return {}
+        return parse_abstracts(fetch_response.iter_bytes())
+    except ET.ParseError as e:
+        print(f"XML parsing error in PubMed response: {e}")
+        return {}
+    finally:
+        fetch_response.close()
+
+def search_articles(search_query: str, retmax: int = PUBMED_RETMAX) -> list:
+    """
+    Search PubMed and return the matching articles in relevance order.
+
+    Three requests whatever the number of articles: esearch for the IDs, then
+    one esummary and one efetch for all of them.
+
+    Args:
+        search_query: PubMed search term
+        retmax: Number of articles to return
+
+    Returns:
+        A list of article dictionaries (pmid, title, authors, publication_date, journal, abstract)
+    """
+    id_list = _search(search_query, retmax)
+    if not id_list:
+        return []
+
+    summaries = _summaries(id_list)
+    abstracts = _abstracts(id_list)
+
     articles = []
-    
     for article_id in id_list:
-        summary_url = f"{base_url}/esummary.fcgi"
-        summary_params = {
-            "db": "pubmed",
-            "id": article_id,
-            "retmode": "json"
-        }
-        
-        summary_response = requests.get(summary_url, params=summary_params)
-        if summary_response.status_code == 200:
-            summary_data = summary_response.json()
-            article_data = summary_data.get('result', {}).get(article_id, {})
-            
-            title = article_data.get('title', 'No title available')
-            authors = ', '.join([author.get('name', '') for author in article_data.get('authors', [])])
-            pub_date = article_data.get('pubdate', 'No date available')
-            journal = article_data.get('fulljournalname', 'No journal available')
-            
-            # Get abstract
-            abstract_url = f"{base_url}/efetch.fcgi"
-            abstract_params = {
-                "db": "pubmed",
-                "id": article_id,
-                "retmode": "xml"
-            }
-            
-            abstract_response = requests.get(abstract_url, params=abstract_params)
-            abstract = "Abstract not available"
-            
-            if abstract_response.status_code == 200:
-                # Simple string search for abstract in XML
-                # In a real implementation, use proper XML parsing
-                abstract_text = abstract_response.text
-                if "<AbstractText>" in abstract_text and "</AbstractText>" in abstract_text:
-                    start = abstract_text.find("<AbstractText>") + len("<AbstractText>")
-                    end = abstract_text.find("</AbstractText>")
-                    abstract = abstract_text[start:end].strip()
-            
-            articles.append({
-                "pmid": article_id,
-                "title": title,
-                "authors": authors,
-                "publication_date": pub_date,
-                "journal": journal,
-                "abstract": abstract
-            })
-    
+        article_data = summaries.get(article_id)
+        if not article_data or "error" in article_data:
+            continue
+        articles.append({
+            "pmid": article_id,
+            "title": article_data.get('title', 'No title available'),
+            "authors": ', '.join([author.get('name', '') for author in article_data.get('authors', [])]),
+            "publication_date": article_data.get('pubdate', 'No date available'),
+            "journal": article_data.get('fulljournalname', 'No journal available'),
+            "abstract": abstracts.get(article_id, "Abstract not available")
+        })
+    return articles
+
+@tool
+def query_pubmed_api(search_query: str, max_results: int = PUBMED_RETMAX) -> str:
+    """Makes a query to the PubMed API to get scientific articles about drugs and their interactions.
+
+    ARGS:
+        search_query: A search term or phrase to find relevant medical articles.
+                     For example: 'omeprazole food interactions'
+        max_results: Optional number of articles to return. Leave the default
+                     unless more articles are needed.
+
+    EXAMPLES:
+        - 'omeprazole food interactions'
+        - 'ibuprofen mechanism of action'
+        - 'metformin diabetes treatment'
+        - 'drug interactions grapefruit'
+
+    RETURNS:
+        A list of the most relevant articles with their titles, authors,
+        publication dates, journals, and abstracts.
+    """
+    retmax = max(1, min(max_results, PUBMED_MAX_RETMAX))
+    try:
+        articles = search_articles(search_query, retmax)
+    except RuntimeError as e:
+        return str(e)
+
     # Format the results
     if not articles:
-        return "Could not retrieve article details."
-    print(articles)
+        return "No articles found for this query."
     result = "PubMed Search Results:\n\n"
     for i, article in enumerate(articles, 1):
         result += f"Article {i}:\n"
@@ -121,5 +145,5 @@ def query_pubmed_api(search_query: str) -> str:
         result += f"Publication Date: {article['publication_date']}\n"
         result += f"PMID: {article['pmid']}\n"
         result += f"Abstract: {article['abstract']}\n\n"
-    
+
     return result
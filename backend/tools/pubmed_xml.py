@@ -0,0 +1,157 @@
+"""
+Incremental parsing of E-utilities efetch XML.
+
+PubMed and PMC efetch responses hold one element per article under a set
+element. ArticleStream is fed the response chunk by chunk, hands each article
+over as soon as its end tag has been read, and then empties it, so only one
+article's tree is in memory at a time however large the response is. Text is
+gathered into lists and joined once per article.
+"""
+import xml.etree.ElementTree as ET
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
+
+# Bytes fed to the parser at a time when the whole payload is at hand
+CHUNK_SIZE = 64 * 1024
+
+# Inline elements left out of paragraph text: citation markers like "[12]"
+SKIPPED_INLINE = {"xref"}
+
+
+class ArticleStream:
+    """
+    Push parser turning an efetch response into article records.
+
+    Args:
+        tag: Tag of the article elements, e.g. "PubmedArticle" or "article"
+        parse: Turns an article element into a record
+    """
+
+    def __init__(self, tag: str, parse: Callable[[ET.Element], object]):
+        self.tag = tag
+        self.parse = parse
+        self._parser = ET.XMLPullParser(events=("end",))
+
+    def feed(self, data: bytes) -> list:
+        """
+        Parse the next chunk of the response.
+
+        Returns:
+            The records of the articles completed by this chunk
+
+        Raises:
+            ET.ParseError: If the response isn't valid XML
+        """
+        self._parser.feed(data)
+        return self._records()
+
+    def close(self) -> list:
+        """Finish parsing; returns the records of the last articles."""
+        self._parser.close()
+        return self._records()
+
+    def _records(self) -> list:
+        records = []
+        for _, element in self._parser.read_events():
+            if element.tag != self.tag:
+                continue
+            try:
+                records.append(self.parse(element))
+            except Exception as article_error:
+                print(f"Error processing article: {article_error}")
+            # Only an empty element is left in the set element's tree
+            element.clear()
+        return records
+
+
+def chunks(content: bytes, size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    """Split a payload into chunks for ArticleStream.feed."""
+    for start in range(0, len(content), size):
+        yield content[start:start + size]
+
+
+def iter_records(stream: ArticleStream, data: Iterable[bytes]) -> Iterator:
+    """Feed chunks to a stream and yield its records as they are completed."""
+    for chunk in data:
+        yield from stream.feed(chunk)
+    yield from stream.close()
+
+
+def inline_text(element: Optional[ET.Element]) -> str:
+    """Text of an element including its inline markup (<i>, <sup>, ...), on one line."""
+    if element is None:
+        return ""
+    text = "".join(element.itertext())
+    # Collapsing the whitespace of every paragraph is costly; only pretty-printed ones need it
+    return " ".join(text.split()) if "\n" in text else text.strip()
+
+
+def _drop_skipped_inline(element: ET.Element):
+    """Empty the inline elements left out of the text, keeping the text that follows them."""
+    for tag in SKIPPED_INLINE:
+        for skipped in element.iter(tag):
+            skipped.text = None
+            del skipped[:]
+
+
+def pubmed_article(article: ET.Element) -> dict:
+    """
+    Record of a PubmedArticle element.
+
+    Returns:
+        A dictionary with pmid, title, abstract, year and journal
+    """
+    pmid = article.findtext("MedlineCitation/PMID") or article.findtext(".//PMID") or "Unknown"
+
+    # Labeled abstract sections keep their label
+    sections = []
+    for section in article.iterfind(".//Abstract/AbstractText"):
+        text = inline_text(section)
+        if text:
+            label = section.get("Label")
+            sections.append(f"{label}: {text}" if label else text)
+
+    return {
+        "pmid": pmid,
+        "title": inline_text(article.find(".//ArticleTitle")) or "No title found",
+        "abstract": "\n".join(sections) or "No abstract found",
+        "year": article.findtext(".//PubDate/Year") or "Unknown year",
+        "journal": article.findtext(".//Journal/Title") or "Unknown journal",
+    }
+
+
+def _pmc_article_id(article: ET.Element) -> Optional[str]:
+    """Numeric PMC ID of a PMC article element, if it carries one."""
+    for article_id in article.iterfind("./front/article-meta/article-id"):
+        if article_id.get("pub-id-type") in ("pmc", "pmcid") and article_id.text:
+            return article_id.text.strip().upper().removeprefix("PMC")
+    return None
+
+
+def _collect_body(element: ET.Element, lines: List[str]):
+    """Gather section titles, paragraphs and table and figure captions in document order."""
+    for child in element:
+        if child.tag == "p":
+            lines.append(inline_text(child))
+        elif child.tag == "title":
+            lines.append(inline_text(child))
+        elif child.tag in ("table-wrap", "fig"):
+            # Captions only: table cells and images are left out
+            caption = inline_text(child.find("caption"))
+            if caption:
+                lines.append(("Table Caption: " if child.tag == "table-wrap" else "Figure Caption: ") + caption)
+        else:
+            _collect_body(child, lines)
+
+
+def pmc_article(article: ET.Element) -> Tuple[Optional[str], str]:
+    """
+    Record of a PMC article element.
+
+    Returns:
+        (PMC ID without the "PMC" prefix or None, full text or "" if the article has no body)
+    """
+    lines = []
+    for body in article.iterfind(".//body"):
+        _drop_skipped_inline(body)
+        _collect_body(body, lines)
+    return _pmc_article_id(article), "\n".join(line for line in lines if line)
@@ -1,11 +1,15 @@
-from langchain.tools import tool
-import requests
+from langchain_core.tools import StructuredTool
+from langchain_core.callbacks import adispatch_custom_event
+import asyncio
+import httpx
+import time
 import xml.etree.ElementTree as ET
 import logging
 import os
-import tempfile
-import uuid
-from typing import List, Dict, Any
+import hashlib
+import threading
+from typing import List, Dict, Any, Optional
+import dotenv
 
 # For text chunking
 from langchain_text_splitters import RecursiveCharacterTextSplitter
@@ -13,21 +17,154 @@ from langchain_text_splitters import RecursiveCharacterTextSplitter
 # For embeddings
 from sentence_transformers import SentenceTransformer
 
-# For vector database
-import chromadb
-
 # For LLM integration - use existing Drugsy LLM
 from langchain.prompts import ChatPromptTemplate
 from models.llm import llm
+from storage import ArticleStore, EmbeddingCache
+from . import http_client, eutils, pubmed_xml
+from .vector_index import VectorIndex
+from monitoring import PUBMED_STAGE_SECONDS
+
+dotenv.load_dotenv()
 
 # Constants
 MAX_ARTICLES = 25  # Fetch 25 articles
 CHUNK_SIZE = 500    # ~500 tokens per chunk
 CHUNK_OVERLAP = 50  # 50 token overlap
 TOP_K_RESULTS = 5   # Retrieve top 5 chunks
+REQUEST_TIMEOUT = 60  # Seconds to wait for each E-utilities request
+
+# File where PubMed tool results are logged
+PUBMED_RESULTS_LOG = os.getenv("PUBMED_RESULTS_LOG", "pubmed_tool_results.log")
+
+# Parsed articles, PMC links and full texts are kept in a SQLite file ("" keeps them in memory only)
+PUBMED_STORE_PATH = os.getenv("PUBMED_STORE_PATH", "cache/pubmed_articles.sqlite3")
+# Seconds stored articles stay valid, and seconds "no PMC version" or "no full text" answers stay valid
+PUBMED_STORE_TTL = float(os.getenv("PUBMED_STORE_TTL", str(30 * 86400)))
+PUBMED_STORE_NEGATIVE_TTL = float(os.getenv("PUBMED_STORE_NEGATIVE_TTL", str(7 * 86400)))
+
+article_store = ArticleStore(
+    PUBMED_STORE_PATH,
+    ttl_seconds=PUBMED_STORE_TTL,
+    negative_ttl_seconds=PUBMED_STORE_NEGATIVE_TTL,
+)
+
+# PMC full texts: PMC IDs per efetch request, requests in flight at once (the
+# E-utilities scheduler still enforces the NCBI rate), and seconds per request
+# once it has been sent (waiting for the rate limit doesn't count)
+PMC_FETCH_BATCH_SIZE = int(os.getenv("PMC_FETCH_BATCH_SIZE", "5"))
+PMC_FETCH_CONCURRENCY = int(os.getenv("PMC_FETCH_CONCURRENCY", "3"))
+PMC_FETCH_TIMEOUT = float(os.getenv("PMC_FETCH_TIMEOUT", "20"))
 
 # Biomedical embedding model
 EMBEDDING_MODEL = "pritamdeka/S-PubMedBert-MS-MARCO"  # Biomedical domain-specific model
+# Embeddings are cached by text in this directory, shared by the workers ("" turns the cache off)
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", "cache/embeddings")
+
+async def report_stage(stage: str, started: float, **details):
+    """
+    Record a pipeline stage timing and dispatch it as a custom LangChain event.
+
+    /chat/stream forwards these events to the client; outside a graph run
+    there is no callback manager and the event is dropped.
+    """
+    duration = time.perf_counter() - started
+    PUBMED_STAGE_SECONDS.observe(duration, stage=stage)
+    duration_ms = round(duration * 1000, 1)
+    try:
+        await adispatch_custom_event("pubmed_stage", {"stage": stage, "duration_ms": duration_ms, **details})
+    except RuntimeError:
+        pass
+
+async def _stream_pmc(pmcids: List[str], full_texts: Dict[str, str]):
+    """
+    Fetch the full texts of pmcids with one efetch request into full_texts,
+    parsing articles as they arrive. The articles received before a failure
+    or a timeout are kept and stored.
+    """
+    fetch_params = {
+        "db": "pmc",
+        "id": ",".join(pmcids),
+        "retmode": "xml"
+    }
+    requested = {pmcid.upper().removeprefix("PMC"): pmcid for pmcid in pmcids}
+    
+    def collect(records):
+        for article_id, full_text in records:
+            if article_id is None and len(pmcids) == 1:
+                # A single article answering a single ID needs no matching
+                article_id = next(iter(requested))
+            if article_id in requested:
+                full_texts[requested[article_id]] = full_text
+    
+    async def read_articles():
+        stream = pubmed_xml.ArticleStream("article", pubmed_xml.pmc_article)
+        async for chunk in fetch_response.aiter_bytes():
+            collect(stream.feed(chunk))
+        collect(stream.close())
+    
+    # The read timeout bounds the wait for the answer once the scheduler has
+    # sent the request; time spent queued for the rate limit isn't counted.
+    # A timed-out request isn't queued again: _fetch_pmc_batch falls back to
+    # one request per missing article instead.
+    fetch_response = await eutils.aget("efetch.fcgi", fetch_params, timeout=PMC_FETCH_TIMEOUT, stream=True,
+                                       retry_timeouts=False)
+    try:
+        fetch_response.raise_for_status()
+        await asyncio.wait_for(read_articles(), PMC_FETCH_TIMEOUT)
+    finally:
+        await fetch_response.aclose()
+        # Articles missing from the answer aren't stored, so they are asked for again next time
+        share = fetch_response.num_bytes_downloaded // len(pmcids)
+        await asyncio.to_thread(_store_full_texts, dict(full_texts), share)
+
+def _store_full_texts(full_texts: Dict[str, str], source_bytes: int):
+    for pmcid, full_text in full_texts.items():
+        article_store.put_full_text(pmcid, full_text, source_bytes=source_bytes)
+
+async def _fetch_pmc_batch(pmcids: List[str], semaphore: asyncio.Semaphore) -> Dict[str, str]:
+    """
+    Fetch a batch of full texts; if the request fails or times out, fetch the
+    articles it didn't deliver one per request, so a slow or broken article
+    only loses its own text.
+    """
+    full_texts = {}
+    try:
+        async with semaphore:
+            await _stream_pmc(pmcids, full_texts)
+        return full_texts
+    except Exception as e:
+        missing = [pmcid for pmcid in pmcids if pmcid not in full_texts]
+        if len(pmcids) == 1:
+            print(f"Failed to fetch PMC full text for {pmcids[0]}: {e!r}")
+            return full_texts
+        print(f"PMC request for {len(pmcids)} articles failed ({e!r}) after {len(full_texts)}, "
+              f"fetching the other {len(missing)} one by one")
+    
+    results = await asyncio.gather(*(_fetch_pmc_batch([pmcid], semaphore) for pmcid in missing))
+    return {pmcid: full_text for result in [full_texts, *results] for pmcid, full_text in result.items()}
+
+async def fetch_pmc_full_texts(pmcids: List[str]) -> Dict[str, str]:
+    """
+    Fetch full texts from PubMed Central.
+    
+    The PMC IDs are requested PMC_FETCH_BATCH_SIZE per efetch request, with up
+    to PMC_FETCH_CONCURRENCY requests in flight; the E-utilities scheduler
+    keeps them within the NCBI rate limit. Once sent, a request gets
+    PMC_FETCH_TIMEOUT seconds to answer and as long again to deliver its
+    articles. A batch that fails or runs out of time keeps the articles it
+    delivered, and the other ones are fetched one per request with the same
+    timeouts.
+    
+    Returns:
+        PMC ID -> full text ("" if the article has no body) for the articles
+        that could be fetched
+    """
+    pmcids = list(dict.fromkeys(pmcids))
+    semaphore = asyncio.Semaphore(PMC_FETCH_CONCURRENCY)
+    batches = [pmcids[start:start + PMC_FETCH_BATCH_SIZE] for start in range(0, len(pmcids), PMC_FETCH_BATCH_SIZE)]
+    results = await asyncio.gather(*(_fetch_pmc_batch(batch, semaphore) for batch in batches))
+    return {pmcid: full_text for result in results for pmcid, full_text in result.items()}
 
 class PubMedRAGPipeline:
     """RAG Pipeline for PubMed data retrieval and processing."""
@@ -42,6 +179,9 @@ class PubMedRAGPipeline:
             print(f"Failed to load embedding model: {e}")
             raise
         
+        # Embeddings of texts seen before are read from the cache instead of computed
+        self.embedding_cache = EmbeddingCache(EMBEDDING_CACHE_DIR, EMBEDDING_MODEL) if EMBEDDING_CACHE_DIR else None
+        
         # Initialize text splitter for chunking
         self.text_splitter = RecursiveCharacterTextSplitter(
             chunk_size=CHUNK_SIZE,
@@ -49,53 +189,31 @@ class PubMedRAGPipeline:
             length_function=len
         )
         
-        # Initialize temporary vector database
-        self.vector_db = None
-        self._setup_vector_db()
-    
-    def _setup_vector_db(self):
-        """Set up a new temporary vector database instance."""
-        try:
-            # Create a temporary directory for ChromaDB
-            # This will be automatically cleaned up when the Python process exits
-            temp_dir = tempfile.gettempdir()
-            persist_dir = os.path.join(temp_dir, f"drugsy_chromadb_{uuid.uuid4().hex}")
-            
-            # Create a client with the new API format
-            self.vector_db = chromadb.PersistentClient(path=persist_dir)
-            
-            # Create a new collection for this query
-            self.collection = self.vector_db.create_collection(
-                name="pubmed_abstracts",
-                metadata={"hnsw:space": "cosine"}
-            )
-            print(f"Initialized temporary vector database in {persist_dir}")
-        except Exception as e:
-            print(f"Failed to initialize vector database: {e}")
-            raise
+        # Open the persistent vector index shared by all queries
+        self.vector_index = VectorIndex(embedding_model=EMBEDDING_MODEL)
     
-    def search_pubmed(self, query: str, max_results: int = MAX_ARTICLES) -> List[Dict[str, Any]]:
+    async def search_pubmed(self, query: str, max_results: int = MAX_ARTICLES) -> List[Dict[str, Any]]:
         """
-        Search PubMed for articles related to the query, map PMIDs to PMC IDs,
-        and retrieve full text when available.
+        Search PubMed for articles related to the query and map PMIDs to PMC IDs;
+        add_full_texts retrieves the full texts.
+
+        Articles, PMC links and full texts already in the article store are not
+        fetched again; only the PMIDs it doesn't have go to elink and efetch.
         """
         print(f"Searching PubMed for: {query} (max results: {max_results})")
         
         # Step 1: Search for relevant articles and get their PMIDs
-        search_url = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esearch.fcgi"
         search_params = {
             "db": "pubmed",
             "term": query,
             "retmode": "json",
-            "retmax": max_results,
-            "tool": "Drugsy",
-            "email": "drugsy@gmail.com"
+            "retmax": max_results
         }
         
         try:
-            search_response = requests.get(search_url, params=search_params)
+            search_response = await eutils.aget("esearch.fcgi", search_params, timeout=REQUEST_TIMEOUT)
             search_response.raise_for_status()
-        except requests.exceptions.RequestException as e:
+        except httpx.HTTPError as e:
             print(f"PubMed search failed: {e}")
             return []
         
@@ -105,21 +223,61 @@ class PubMedRAGPipeline:
             return []
         
         print(f"Found {len(id_list)} PubMed articles")
+        bytes_saved_before = article_store.bytes_saved
+        
+        # Step 2: Map PMIDs to PMC IDs, asking elink only about PMIDs not in the store
+        # Store queries and (de)compression run on threads, off the event loop
+        pmid_to_pmcid = await asyncio.to_thread(article_store.get_links, id_list)
+        unlinked = [pmid for pmid in id_list if pmid not in pmid_to_pmcid]
+        if unlinked:
+            pmid_to_pmcid.update(await self._link_pmc_ids(unlinked))
+        pmid_to_pmcid = {pmid: pmcid for pmid, pmcid in pmid_to_pmcid.items() if pmcid}
+        
+        # Step 3: Fetch details for the articles not in the store using EFetch
+        stored = await asyncio.to_thread(article_store.get_articles, id_list)
+        missing = [pmid for pmid in id_list if pmid not in stored]
+        if missing:
+            fetched = await self._fetch_articles(missing)
+            if fetched is None and not stored:
+                return []
+            stored.update(fetched or {})
         
-        # Step 2: Map PMIDs to PMC IDs using elink.fcgi
+        articles = []
+        for pmid in id_list:
+            if pmid not in stored:
+                continue
+            article_data = {
+                **stored[pmid],
+                "full_text": "",
+                "text_source": "AbstractOnly"  # Default to abstract only; see add_full_texts
+            }
+            if pmid in pmid_to_pmcid:
+                article_data["pmcid"] = pmid_to_pmcid[pmid]
+            articles.append(article_data)
+        
+        print(f"Article store: {len(id_list) - len(missing)}/{len(id_list)} articles cached, "
+              f"{(article_store.bytes_saved - bytes_saved_before) / 1024:.1f} KB not downloaded")
+        return articles
+    
+    async def _link_pmc_ids(self, pmids: List[str]) -> Dict[str, str]:
+        """
+        Map PMIDs to PMC IDs using elink.fcgi and store the answers, including
+        the PMIDs without a PMC version.
+        
+        Returns:
+            PMID -> PMC ID for the PMIDs that have one; empty if the request failed
+        """
         pmid_to_pmcid = {}
-        elink_url = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/elink.fcgi"
         elink_params = {
             "dbfrom": "pubmed",
             "db": "pmc",
-            "id": ",".join(id_list),
-            "retmode": "xml",
-            "tool": "Drugsy",
-            "email": "drugsy@gmail.com"
+            # One id parameter per PMID gets one LinkSet per PMID back
+            "id": pmids,
+            "retmode": "xml"
         }
         
         try:
-            elink_response = requests.get(elink_url, params=elink_params)
+            elink_response = await eutils.aget("elink.fcgi", elink_params, timeout=REQUEST_TIMEOUT)
             elink_response.raise_for_status()
             
             try:
@@ -145,210 +303,91 @@ class PubMedRAGPipeline:
                         continue
                 
                 print(f"Mapped {len(pmid_to_pmcid)} PMIDs to PMC IDs")
+                await asyncio.to_thread(article_store.put_links, {pmid: pmid_to_pmcid.get(pmid) for pmid in pmids})
             except ET.ParseError as xml_error:
                 print(f"XML parsing error in elink response: {xml_error}")
                 # Continue with the process even if mapping fails
-        except requests.exceptions.RequestException as req_error:
+        except httpx.HTTPError as req_error:
             print(f"Request error in elink API call: {req_error}")
             # Continue with the process even if mapping fails
         except Exception as e:
             print(f"Unexpected error mapping PMIDs to PMC IDs: {e}")
             # Continue with the process even if mapping fails
+        return pmid_to_pmcid
+    
+    async def _fetch_articles(self, pmids: List[str]) -> Optional[Dict[str, Dict[str, Any]]]:
+        """
+        Fetch and parse PubMed articles using EFetch, and store them.
         
-        # Step 3: Fetch details for the articles using EFetch
-        fetch_url = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/efetch.fcgi"
+        Returns:
+            PMID -> article with pmid, title, abstract, year and journal;
+            None if the request or the parsing failed
+        """
         fetch_params = {
             "db": "pubmed",
-            "id": ",".join(id_list),
-            "retmode": "xml",
-            "tool": "Drugsy",
-            "email": "drugsy@gmail.com"
+            "id": ",".join(pmids),
+            "retmode": "xml"
         }
         
+        articles = []
         try:
-            fetch_response = requests.get(fetch_url, params=fetch_params)
-            fetch_response.raise_for_status()
-        except requests.exceptions.RequestException as e:
-            print(f"Failed to fetch PubMed details: {e}")
-            return []
-        
-        # Step 4: Parse the XML response
-        try:
+            fetch_response = await eutils.aget("efetch.fcgi", fetch_params, timeout=REQUEST_TIMEOUT, stream=True)
             try:
-                root = ET.fromstring(fetch_response.content)
-                articles = []
-                
-                for article in root.findall(".//PubmedArticle"):
-                    try:
-                        # Extract article metadata
-                        pmid_elem = article.find(".//PMID")
-                        pmid = pmid_elem.text if pmid_elem is not None else "Unknown"
-                        
-                        title_elem = article.find(".//ArticleTitle")
-                        title = title_elem.text if title_elem is not None else "No title found"
-                        
-                        # Handle multiple AbstractText elements or nested structure
-                        abstract = ""
-                        abstract_elems = article.findall(".//AbstractText")
-                        if abstract_elems:
-                            for elem in abstract_elems:
-                                try:
-                                    # Check for labeled abstract sections
-                                    label = elem.get("Label")
-                                    if label:
-                                        abstract += f"{label}: {elem.text}\n" if elem.text else ""
-                                    else:
-                                        abstract += f"{elem.text}\n" if elem.text else ""
-                                except Exception as abstract_error:
-                                    print(f"Error processing abstract element for PMID {pmid}: {abstract_error}")
-                                    continue
-                        else:
-                            abstract = "No abstract found"
-                        
-                        # Extract publication year
-                        year_elem = article.find(".//PubDate/Year")
-                        year = year_elem.text if year_elem is not None else "Unknown year"
-                        
-                        # Extract journal name
-                        journal_elem = article.find(".//Journal/Title")
-                        journal = journal_elem.text if journal_elem is not None else "Unknown journal"
-                        
-                        # Create article data with abstract
-                        article_data = {
-                            "pmid": pmid,
-                            "title": title,
-                            "abstract": abstract.strip(),
-                            "year": year,
-                            "journal": journal,
-                            "full_text": "",
-                            "text_source": "AbstractOnly"  # Default to abstract only
-                        }
-                        
-                        # Check if we have a PMC ID for this PMID
-                        if pmid in pmid_to_pmcid:
-                            try:
-                                pmcid = pmid_to_pmcid[pmid]
-                                article_data["pmcid"] = pmcid
-                                
-                                # Try to fetch full text from PMC
-                                full_text = self._fetch_pmc_full_text(pmcid)
-                                if full_text:
-                                    article_data["full_text"] = full_text
-                                    article_data["text_source"] = "FullTextFetched"
-                                    print(f"Added full text for PMID {pmid} (PMC ID: {pmcid})")
-                                else:
-                                    article_data["text_source"] = "FullTextFailed"
-                                    print(f"Failed to fetch full text for PMID {pmid} (PMC ID: {pmcid})")
-                            except Exception as pmc_error:
-                                print(f"Error processing PMC full text for PMID {pmid}: {pmc_error}")
-                                article_data["text_source"] = "FullTextFailed"
-                        
-                        articles.append(article_data)
-                    except Exception as article_error:
-                        print(f"Error processing article: {article_error}")
-                        continue
-                
-                print(f"Successfully parsed {len(articles)} articles")
-                return articles
-            except ET.ParseError as xml_error:
-                print(f"XML parsing error in PubMed response: {xml_error}")
-                return []
+                fetch_response.raise_for_status()
+                # Articles are parsed as the response arrives
+                stream = pubmed_xml.ArticleStream("PubmedArticle", pubmed_xml.pubmed_article)
+                async for chunk in fetch_response.aiter_bytes():
+                    articles += stream.feed(chunk)
+                articles += stream.close()
+            finally:
+                await fetch_response.aclose()
+        except httpx.HTTPError as e:
+            print(f"Failed to fetch PubMed details: {e}")
+            return None
+        except ET.ParseError as xml_error:
+            print(f"XML parsing error in PubMed response: {xml_error}")
+            return None
         except Exception as e:
             print(f"Unexpected error parsing PubMed response: {e}")
-            return []
+            return None
+        
+        print(f"Successfully parsed {len(articles)} articles")
+        await asyncio.to_thread(article_store.put_articles, articles, source_bytes=fetch_response.num_bytes_downloaded)
+        return {article["pmid"]: article for article in articles}
     
-    def _fetch_pmc_full_text(self, pmcid: str) -> str:
+    async def add_full_texts(self, articles: List[Dict[str, Any]]):
         """
-        Fetch full text from PMC using the PMC ID.
-        
-        This method retrieves the full article text from PubMed Central,
-        extracting paragraph content, headings, and table captions.
-        Figure captions are preserved as text, but images are ignored.
+        Add the PMC full text to the articles that have a PMC ID, in place.
         
-        Args:
-            pmcid: The PubMed Central ID of the article
-            
-        Returns:
-            A string containing the full article text, or an empty string if retrieval fails
+        Full texts already in the article store are used as they are; the
+        others are fetched from PMC in batches (see fetch_pmc_full_texts).
         """
-        print(f"Fetching full text for PMC ID: {pmcid}")
+        pmcids = list(dict.fromkeys(article["pmcid"] for article in articles if article.get("pmcid")))
+        if not pmcids:
+            return
         
-        # Use efetch to get the full text XML
-        fetch_url = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/efetch.fcgi"
-        fetch_params = {
-            "db": "pmc",
-            "id": pmcid,
-            "retmode": "xml",
-            "tool": "Drugsy",
-            "email": "drugsy@gmail.com"
-        }
+        bytes_saved_before = article_store.bytes_saved
+        full_texts = await asyncio.to_thread(article_store.get_full_texts, pmcids)
+        cached = len(full_texts)
+        missing = [pmcid for pmcid in pmcids if pmcid not in full_texts]
+        if missing:
+            print(f"Fetching full text for {len(missing)} PMC articles")
+            full_texts.update(await fetch_pmc_full_texts(missing))
         
-        try:
-            fetch_response = requests.get(fetch_url, params=fetch_params)
-            fetch_response.raise_for_status()
-            
-            # Parse the XML response
-            try:
-                root = ET.fromstring(fetch_response.content)
-                
-                # Extract all body sections
-                full_text = ""
-                
-                # Process all body elements (there might be multiple in some cases)
-                body_elements = root.findall(".//body")
-                if not body_elements:
-                    print(f"No body elements found in PMC ID {pmcid} XML response")
-                    return ""
-                    
-                for body in body_elements:
-                    try:
-                        # Extract paragraphs
-                        for p in body.findall(".//p"):
-                            if p.text:
-                                full_text += p.text.strip() + "\n\n"
-                            # Get any additional text within the paragraph
-                            for child in p:
-                                if child.tail:
-                                    full_text += child.tail.strip() + " "
-                            full_text += "\n"
-                        
-                        # Extract section titles/headings
-                        for title in body.findall(".//title"):
-                            if title.text:
-                                full_text += title.text.strip() + "\n\n"
-                        
-                        # Extract table captions
-                        for caption in body.findall(".//table-wrap/caption"):
-                            if caption.text:
-                                full_text += "Table Caption: " + caption.text.strip() + "\n\n"
-                        
-                        # Extract figure captions (but not the figures themselves)
-                        for fig_caption in body.findall(".//fig/caption"):
-                            if fig_caption.text:
-                                full_text += "Figure Caption: " + fig_caption.text.strip() + "\n\n"
-                    except Exception as inner_e:
-                        print(f"Error processing body element in PMC ID {pmcid}: {inner_e}")
-                        # Continue with other body elements if available
-                
-                # Clean up extra whitespace and newlines
-                full_text = "\n".join([line.strip() for line in full_text.split("\n") if line.strip()])
-                
-                if full_text:
-                    print(f"Successfully retrieved full text for PMC ID {pmcid} ({len(full_text)} characters)")
-                    return full_text
-                else:
-                    print(f"No full text content found for PMC ID {pmcid}")
-                    return ""
-            except ET.ParseError as xml_error:
-                print(f"XML parsing error for PMC ID {pmcid}: {xml_error}")
-                return ""
-                
-        except requests.exceptions.RequestException as req_error:
-            print(f"Request error fetching PMC full text for {pmcid}: {req_error}")
-            return ""
-        except Exception as e:
-            print(f"Unexpected error fetching PMC full text for {pmcid}: {e}")
-            return ""
+        for article in articles:
+            pmcid = article.get("pmcid")
+            if not pmcid:
+                continue
+            if full_texts.get(pmcid):
+                article["full_text"] = full_texts[pmcid]
+                article["text_source"] = "FullTextFetched"
+                print(f"Added full text for PMID {article['pmid']} (PMC ID: {pmcid})")
+            else:
+                article["text_source"] = "FullTextFailed"
+                print(f"Failed to fetch full text for PMID {article['pmid']} (PMC ID: {pmcid})")
+        
+        print(f"Article store: {cached}/{len(pmcids)} full texts cached, "
+              f"{(article_store.bytes_saved - bytes_saved_before) / 1024:.1f} KB not downloaded")
     
     def chunk_abstracts(self, articles: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         """Split article content (abstract and full text when available) into smaller chunks for better processing."""
@@ -370,8 +409,9 @@ class PubMedRAGPipeline:
                 source_type = "PubMed"
                 print(f"Processing article {article['pmid']} with abstract only")
             
-            # Split the text into chunks
+            # Split the text into chunks; their IDs change with the article text
             chunks = self.text_splitter.split_text(text)
+            text_hash = hashlib.sha1(text.encode()).hexdigest()[:16]
             
             # Create metadata for each chunk
             for i, chunk in enumerate(chunks):
@@ -380,7 +420,8 @@ class PubMedRAGPipeline:
                     "metadata": {
                         "pmid": article["pmid"],
                         "title": article["title"],
-                        "chunk_id": f"{article['pmid']}-{i}",
+                        "chunk_id": f"{article['pmid']}-{text_hash}-{i}",
+                        "text_hash": text_hash,
                         "source": source_type,
                         "text_source": article.get("text_source", "AbstractOnly")
                     }
@@ -389,56 +430,45 @@ class PubMedRAGPipeline:
         print(f"Created {len(chunked_data)} chunks from {len(articles)} articles")
         return chunked_data
     
-    def embed_and_store(self, chunks: List[Dict[str, Any]]):
-        """Generate embeddings for chunks and store them in the vector database."""
-        if not chunks:
-            return
-        
-        # Reset vector database for new query
-        self._setup_vector_db()
+    def encode(self, texts: List[str]) -> List[List[float]]:
+        """Embed texts, reusing the cached embeddings of texts seen before."""
+        if self.embedding_cache is None:
+            return self.embedding_model.encode(texts).tolist()
+        return self.embedding_cache.encode(texts, self.embedding_model.encode).tolist()
+    
+    def embed_and_store(self, chunks: List[Dict[str, Any]]) -> int:
+        """
+        Embed the chunks the vector index doesn't have yet and add them to it.
         
-        # Prepare data for vector database
-        ids = [chunk["metadata"]["chunk_id"] for chunk in chunks]
-        texts = [chunk["text"] for chunk in chunks]
-        metadatas = [chunk["metadata"] for chunk in chunks]
+        Returns:
+            The number of chunks embedded
+        """
+        if not chunks:
+            return 0
         
-        # Generate embeddings
         try:
-            embeddings = self.embedding_model.encode(texts)
-            
-            # Add to vector database
-            self.collection.add(
-                ids=ids,
-                embeddings=embeddings.tolist(),
-                documents=texts,
-                metadatas=metadatas
-            )
-            
-            print(f"Added {len(chunks)} embedded chunks to vector database")
+            embedded = self.vector_index.add(chunks, self.encode)
+            print(f"Added {embedded} embedded chunks to vector database, {len(chunks) - embedded} already indexed")
+            return embedded
         except Exception as e:
             print(f"Failed to embed or store chunks: {e}")
             raise
     
-    def retrieve_relevant_chunks(self, query: str, top_k: int = TOP_K_RESULTS) -> List[str]:
-        """Retrieve the most relevant chunks for a given query."""
+    def retrieve_relevant_chunks(self, query: str, chunks: List[Dict[str, Any]], top_k: int = TOP_K_RESULTS) -> List[str]:
+        """Retrieve the most relevant chunks for a given query among the chunks of the current articles."""
         try:
             # Generate embedding for the query
-            query_embedding = self.embedding_model.encode(query).tolist()
+            query_embedding = self.encode([query])[0]
             
             # Query the vector database
-            results = self.collection.query(
-                query_embeddings=[query_embedding],
-                n_results=top_k
-            )
+            relevant_chunks = self.vector_index.query(query_embedding, top_k, chunks)
             
             # Extract the documents
-            if results and "documents" in results and results["documents"]:
-                chunks = results["documents"][0]  # First query result
-                print(f"Retrieved {len(chunks)} relevant chunks")
-                return chunks
+            if relevant_chunks:
+                print(f"Retrieved {len(relevant_chunks)} relevant chunks")
             else:
                 print("No relevant chunks found")
-                return []
+            return relevant_chunks
                 
         except Exception as e:
             print(f"Failed to retrieve relevant chunks: {e}")
@@ -472,27 +502,40 @@ class PubMedRAGPipeline:
         prompt = prompt_template.format(context=context, query=query)
         return prompt
     
-    def query_llm(self, prompt: str) -> str:
+    async def query_llm(self, prompt: str) -> str:
         """Query the LLM with the constructed prompt."""
         try:
             # Use the existing Drugsy LLM (Gemini)
-            response = llm.invoke(prompt)
+            response = await llm.ainvoke(prompt)
             return response.content
         except Exception as e:
             print(f"Failed to query LLM: {e}")
             return f"Error querying LLM: {str(e)}"
     
-    def run_pipeline(self, query: str) -> str:
-        """Execute the complete RAG pipeline end-to-end."""
+    async def run_pipeline(self, query: str) -> str:
+        """
+        Execute the complete RAG pipeline end-to-end.
+        
+        HTTP and LLM calls are awaited; chunking, embedding and vector search are
+        CPU-bound and run in a worker thread so the event loop stays responsive.
+        """
         try:
-            # Step 1: Search PubMed and get articles with full text when available
+            # Step 1: Search PubMed and get the articles and their PMC IDs
             print(f"Step 1: Searching PubMed for '{query}'")
-            articles = self.search_pubmed(query, MAX_ARTICLES)
+            stage_started = time.perf_counter()
+            articles = await self.search_pubmed(query, MAX_ARTICLES)
+            await report_stage("search", stage_started, articles=len(articles))
             print(f"Found {len(articles)} articles for '{query}'")
             if not articles:
                 print(f"No PubMed articles found for '{query}'")
                 return f"No PubMed articles found for '{query}'."
             
+            # Step 1b: Fetch the PMC full texts of the articles that have one
+            stage_started = time.perf_counter()
+            await self.add_full_texts(articles)
+            await report_stage("full_text", stage_started,
+                               articles=sum(1 for article in articles if article.get("pmcid")))
+            
             # Log article sources
             full_text_count = sum(1 for article in articles if article.get('text_source') == 'FullTextFetched')
             abstract_only_count = sum(1 for article in articles if article.get('text_source') == 'AbstractOnly')
@@ -502,17 +545,23 @@ class PubMedRAGPipeline:
             
             # Step 2: Chunk the articles (abstracts + full text when available)
             print(f"Step 2: Chunking {len(articles)} articles (abstracts + full text when available)")
-            chunks = self.chunk_abstracts(articles)
+            stage_started = time.perf_counter()
+            chunks = await asyncio.to_thread(self.chunk_abstracts, articles)
+            await report_stage("chunk", stage_started, chunks=len(chunks))
             print(f"Created {len(chunks)} chunks from articles")
             
             # Step 3: Embed and store chunks
             print(f"Step 3: Embedding and storing chunks")
-            self.embed_and_store(chunks)
+            stage_started = time.perf_counter()
+            embedded = await asyncio.to_thread(self.embed_and_store, chunks)
+            await report_stage("embed", stage_started, embedded=embedded)
             print(f"Chunks embedded and stored in vector DB")
             
             # Step 4: Retrieve relevant chunks for the query
             print(f"Step 4: Retrieving relevant chunks for '{query}'")
-            relevant_chunks = self.retrieve_relevant_chunks(query, TOP_K_RESULTS)
+            stage_started = time.perf_counter()
+            relevant_chunks = await asyncio.to_thread(self.retrieve_relevant_chunks, query, chunks, TOP_K_RESULTS)
+            await report_stage("retrieve", stage_started)
             print(f"Retrieved {len(relevant_chunks)} relevant chunks")
             if not relevant_chunks:
                 print(f"No relevant chunks found for '{query}'")
@@ -527,7 +576,9 @@ class PubMedRAGPipeline:
             
             # Step 6: Query LLM and get response
             print(f"Step 6: Querying LLM")
-            response = self.query_llm(prompt)
+            stage_started = time.perf_counter()
+            response = await self.query_llm(prompt)
+            await report_stage("llm", stage_started)
             print(f"LLM response received (first 200 chars): {response[:200]}...")
             
             return response
@@ -538,20 +589,24 @@ class PubMedRAGPipeline:
 
 # Initialize the RAG pipeline as a global instance
 _rag_pipeline = None
+_rag_pipeline_lock = threading.Lock()
 
 def get_rag_pipeline() -> PubMedRAGPipeline:
     """Get or create the RAG pipeline instance."""
     global _rag_pipeline
-    if _rag_pipeline is None:
-        try:
-            _rag_pipeline = PubMedRAGPipeline()
-        except Exception as e:
-            print(f"Failed to initialize RAG pipeline: {e}")
-            raise
-    return _rag_pipeline
+    if _rag_pipeline is not None:
+        return _rag_pipeline
+    # Created under the lock so concurrent first queries share one model and one index
+    with _rag_pipeline_lock:
+        if _rag_pipeline is None:
+            try:
+                _rag_pipeline = PubMedRAGPipeline()
+            except Exception as e:
+                print(f"Failed to initialize RAG pipeline: {e}")
+                raise
+        return _rag_pipeline
 
-@tool
-def query_pubmed_api(query: str) -> str:
+def _query_pubmed_api(query: str) -> str:
     """
     Searches PubMed for research articles related to the query (e.g., a drug),
     processes the abstracts through a RAG pipeline, and returns a comprehensive answer.
@@ -559,23 +614,35 @@ def query_pubmed_api(query: str) -> str:
     Parameters:
     - query: A search string (e.g., drug name, medical condition, or specific question).
     """
+    async def run_and_close():
+        try:
+            return await _aquery_pubmed_api(query)
+        finally:
+            # The connections belong to this temporary event loop
+            await http_client.aclose_clients()
+
+    return asyncio.run(run_and_close())
+
+async def _aquery_pubmed_api(query: str) -> str:
+    """Async version of query_pubmed_api, used when the graph runs with ainvoke."""
     import sys
     sys.stderr.write(f"\n\n*** PUBMED TOOL CALLED: {query} ***\n\n")
     sys.stderr.flush()
     try:
         # Get the RAG pipeline instance
         print(f"Starting PubMed RAG pipeline for query: {query}")
-        pipeline = get_rag_pipeline()
+        # Loading the embedding model is slow, so keep it off the event loop
+        pipeline = await asyncio.to_thread(get_rag_pipeline)
         print("Pipeline initialized successfully")
         
         # Run the complete pipeline
         print("Running pipeline...")
-        result = pipeline.run_pipeline(query)
+        result = await pipeline.run_pipeline(query)
         
         # Log the result directly to file
         import datetime
         timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        with open("/Users/damianargento/Desktop/Drugsy/backend/pubmed_tool_results.log", "a") as f:
+        with open(PUBMED_RESULTS_LOG, "a") as f:
             f.write(f"\n[{timestamp}] RESULT (first 200 chars): {result[:200]}...\n")
             
         print(f"Pipeline completed with result: {result[:100]}..." if result else "Pipeline returned empty result")
@@ -588,3 +655,10 @@ def query_pubmed_api(query: str) -> str:
         print(f"Error details:\n{error_details}")
         
         return f"An error occurred while processing your query: {str(e)}"
+
+query_pubmed_api = StructuredTool.from_function(
+    func=_query_pubmed_api,
+    coroutine=_aquery_pubmed_api,
+    name="query_pubmed_api",
+    description=_query_pubmed_api.__doc__.strip(),
+)
@@ -1,40 +1,97 @@
-from langchain.tools import tool
-import requests
+from langchain_core.tools import StructuredTool
 import os
 import dotenv
+from . import http_client
+from .usda_food_index import get_food_index
 
 dotenv.load_dotenv()
 
-@tool
-def query_usda_food_data(food_query: str) -> dict:
-    """
-    Makes a query to the USDA FoodData Central API to get nutritional information for a given food.
-    """
-    api_key = os.getenv("USDA_API_KEY")
-    search_url = f"https://api.nal.usda.gov/fdc/v1/foods/search?api_key={api_key}&query={food_query}"
-    headers = {"Content-Type": "application/json"}
+# Base URL of the FoodData Central API, overridable to point at a local stand-in
+USDA_API_BASE_URL = os.getenv("USDA_API_BASE_URL", "https://api.nal.usda.gov/fdc/v1").rstrip("/")
+USDA_SEARCH_URL = f"{USDA_API_BASE_URL}/foods/search"
+# Seconds to wait for the USDA API
+REQUEST_TIMEOUT = 30
+# Candidate foods returned per query: the best match in full, the others by name
+USDA_TOP_K = int(os.getenv("USDA_TOP_K", "3"))
+
+def _candidate(food: dict) -> dict:
+    return {
+        "description": food.get("description"),
+        "fdcId": food.get("fdcId"),
+        "dataType": food.get("dataType"),
+        "brandOwner": food.get("brandOwner"),
+    }
 
-    response = requests.get(search_url, headers=headers)
-    
-    if response.status_code == 200:
-        data = response.json()
+def _parse_response(status_code: int, data, food_query: str) -> dict:
+    if status_code == 200:
         if data["foods"]:
             food = data["foods"][0]
             result = {
-                "description": food.get("description"),
-                "fdcId": food.get("fdcId"),
-                "dataType": food.get("dataType"),
-                "brandOwner": food.get("brandOwner"),
+                **_candidate(food),
                 "ingredients": food.get("ingredients"),
+                # /foods/search returns nutrientName/value, the abridged food format name/amount
                 "nutrients": {
-                    nutrient["name"]: nutrient["amount"]
+                    nutrient.get("nutrientName", nutrient.get("name")): nutrient.get("value", nutrient.get("amount"))
                     for nutrient in food.get("foodNutrients", [])
-                }
+                },
+                "other_matches": [_candidate(other) for other in data["foods"][1:USDA_TOP_K]],
             }
         else:
             result = {"message": f"No matches found for '{food_query}'."}
     else:
-        result = {"message": f"Error while consulting the USDA API: {response.status_code}"}
+        result = {"message": f"Error while consulting the USDA API: {status_code}"}
 
     print(f"[USDA Tool Response] Input: '{food_query}' → Output: {result}")
     return result
+
+def _local_result(index, food_query: str) -> dict:
+    """Answer a query from the local FoodData Central mirror."""
+    matches = index.search(food_query, top_k=USDA_TOP_K)
+    if matches:
+        result = {
+            **index.food(matches[0][0]),
+            "other_matches": [_candidate(index.food(row, with_nutrients=False)) for row, _ in matches[1:]],
+        }
+    else:
+        result = {"message": f"No matches found for '{food_query}'."}
+    print(f"[USDA Tool Response] Input: '{food_query}' → Output: {result}")
+    return result
+
+def _query_usda_food_data(food_query: str) -> dict:
+    """
+    Makes a query to the USDA FoodData Central API to get nutritional information for a given food.
+    Returns the best matching food with its nutrients, and other close matches by name in other_matches.
+    """
+    index = get_food_index()
+    if index is not None:
+        return _local_result(index, food_query)
+
+    api_key = os.getenv("USDA_API_KEY")
+    search_url = f"{USDA_SEARCH_URL}?api_key={api_key}&query={food_query}&pageSize={USDA_TOP_K}"
+    headers = {"Content-Type": "application/json"}
+
+    response = http_client.get(search_url, headers=headers, timeout=REQUEST_TIMEOUT)
+    data = response.json() if response.status_code == 200 else None
+    return _parse_response(response.status_code, data, food_query)
+
+async def _aquery_usda_food_data(food_query: str) -> dict:
+    """Async version of query_usda_food_data, used when the graph runs with ainvoke."""
+    index = get_food_index()
+    if index is not None:
+        # Local lookups take well under a millisecond, so they run on the event loop
+        return _local_result(index, food_query)
+
+    api_key = os.getenv("USDA_API_KEY")
+    search_url = f"{USDA_SEARCH_URL}?api_key={api_key}&query={food_query}&pageSize={USDA_TOP_K}"
+    headers = {"Content-Type": "application/json"}
+
+    response = await http_client.aget(search_url, headers=headers, timeout=REQUEST_TIMEOUT)
+    data = response.json() if response.status_code == 200 else None
+    return _parse_response(response.status_code, data, food_query)
+
+query_usda_food_data = StructuredTool.from_function(
+    func=_query_usda_food_data,
+    coroutine=_aquery_usda_food_data,
+    name="query_usda_food_data",
+    description=_query_usda_food_data.__doc__.strip(),
+)
@@ -0,0 +1,430 @@
+"""
+Local USDA FoodData Central mirror.
+
+The FoodData Central CSV releases (Foundation, SR Legacy, FNDDS and Branded,
+as downloaded .zip files or extracted directories) are loaded into a compact
+columnar store:
+    - nutrients.npy: float32 matrix of nutrient amounts per food (NaN when
+      missing), memory-mapped so only the rows returned are read
+    - fdc_ids.npy / data_types.npy and UTF-8 string columns with offsets for
+      descriptions, brand owners and ingredients
+    - a trigram index (CSR postings per trigram) for fuzzy description search
+
+query_usda_food_data answers from the mirror when it exists, so requests no
+longer need USDA_API_KEY.
+
+Usage (from the backend directory):
+    python -m tools.usda_food_index build FoodData_Central_foundation_food_csv_2024-10-31.zip \\
+        FoodData_Central_sr_legacy_food_csv_2018-04.zip ...
+    python -m tools.usda_food_index search "cheddar cheese" --top-k 5
+    python -m tools.usda_food_index stats
+"""
+import argparse
+import io
+import json
+import math
+import os
+import shutil
+import threading
+import time
+import unicodedata
+import zipfile
+from typing import Iterator, List, Optional
+
+import dotenv
+import numpy as np
+import pandas as pd
+
+dotenv.load_dotenv()
+
+# Directory of the mirror
+USDA_FOOD_INDEX_DIR = os.getenv("USDA_FOOD_INDEX_DIR", "data/usda_food_index")
+# Minimum trigram similarity (0-1) of a description to count as a match
+USDA_MIN_SCORE = float(os.getenv("USDA_MIN_SCORE", "0.25"))
+# Similarity thresholds tried in turn before USDA_MIN_SCORE
+SEARCH_THRESHOLDS = (0.8, 0.6, 0.4)
+# Food types loaded by default, the ones the FoodData Central search returns
+DEFAULT_DATA_TYPES = ["foundation_food", "sr_legacy_food", "survey_fndds_food", "branded_food"]
+# Rows of food_nutrient.csv read at a time
+CSV_CHUNK_ROWS = 1_000_000
+# Seconds between checks for a new or rebuilt mirror
+INDEX_RECHECK_SECONDS = 60
+
+# Trigram alphabet: space, a-z and 0-9
+ALPHABET = " abcdefghijklmnopqrstuvwxyz0123456789"
+ALPHABET_SIZE = len(ALPHABET)
+CHAR_CODES = {char: code for code, char in enumerate(ALPHABET)}
+# Trigram counts are stored as uint16
+MAX_TRIGRAMS = np.iinfo(np.uint16).max
+TEXT_COLUMNS = ["description", "brand_owner", "ingredients"]
+# Data type labels as the FoodData Central API reports them
+DATA_TYPE_NAMES = {
+    "foundation_food": "Foundation",
+    "sr_legacy_food": "SR Legacy",
+    "survey_fndds_food": "Survey (FNDDS)",
+    "branded_food": "Branded",
+}
+
+
+def _normalize(text: str) -> str:
+    """Lowercase ASCII letters and digits separated by single spaces."""
+    text = unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode().lower()
+    return " ".join("".join(char if char in CHAR_CODES else " " for char in text).split())
+
+
+def trigrams(text: str) -> List[int]:
+    """Distinct trigram codes of a text, padded so word starts and ends count."""
+    padded = f" {_normalize(text)} "
+    codes = {
+        (CHAR_CODES[padded[i]] * ALPHABET_SIZE + CHAR_CODES[padded[i + 1]]) * ALPHABET_SIZE + CHAR_CODES[padded[i + 2]]
+        for i in range(len(padded) - 2)
+    }
+    return sorted(codes)
+
+
+def _write_strings(directory: str, name: str, values: List[str]):
+    """Write a string column as concatenated UTF-8 bytes plus row offsets."""
+    offsets = np.zeros(len(values) + 1, dtype=np.int64)
+    with open(os.path.join(directory, f"{name}.bin"), "wb") as f:
+        for row, value in enumerate(values):
+            # Missing values are NaN in pandas columns
+            data = value.encode("utf-8") if isinstance(value, str) else b""
+            f.write(data)
+            offsets[row + 1] = offsets[row] + len(data)
+    np.save(os.path.join(directory, f"{name}.offsets.npy"), offsets)
+
+
+class _StringColumn:
+    """Read-only, memory-mapped string column written by _write_strings."""
+
+    def __init__(self, directory: str, name: str):
+        self.offsets = np.load(os.path.join(directory, f"{name}.offsets.npy"), mmap_mode="r")
+        path = os.path.join(directory, f"{name}.bin")
+        self.data = np.memmap(path, dtype=np.uint8, mode="r") if os.path.getsize(path) else np.zeros(0, np.uint8)
+
+    def __getitem__(self, row: int) -> Optional[str]:
+        start, end = int(self.offsets[row]), int(self.offsets[row + 1])
+        return self.data[start:end].tobytes().decode("utf-8") if end > start else None
+
+    def lengths(self, rows: np.ndarray) -> np.ndarray:
+        return self.offsets[rows + 1] - self.offsets[rows]
+
+
+def _open_csv(source: str, name: str) -> Optional[io.IOBase]:
+    """Open a CSV file of a FoodData Central release, zipped or extracted, or return None."""
+    if zipfile.is_zipfile(source):
+        archive = zipfile.ZipFile(source)
+        for member in archive.namelist():
+            if os.path.basename(member) == name:
+                return archive.open(member)
+        return None
+    for root, _, files in os.walk(source):
+        if name in files:
+            return open(os.path.join(root, name), "rb")
+    return None
+
+
+def _read_csv(source: str, name: str, columns: List[str], **kwargs):
+    f = _open_csv(source, name)
+    if f is None:
+        return None
+    with f:
+        return pd.read_csv(f, usecols=columns, **kwargs)
+
+
+def _iter_food_nutrients(sources: List[str]) -> Iterator[pd.DataFrame]:
+    for source in sources:
+        f = _open_csv(source, "food_nutrient.csv")
+        if f is None:
+            continue
+        with f:
+            for chunk in pd.read_csv(f, usecols=["fdc_id", "nutrient_id", "amount"], chunksize=CSV_CHUNK_ROWS):
+                yield chunk.dropna()
+
+
+def build_index(sources: List[str], directory: str = USDA_FOOD_INDEX_DIR,
+                data_types: Optional[List[str]] = None) -> dict:
+    """
+    Build the mirror from FoodData Central CSV releases.
+
+    The mirror is written next to the target directory and swapped in when
+    complete, so a running server keeps answering from the previous one.
+
+    Args:
+        sources: Release .zip files or extracted directories
+        directory: Directory of the mirror
+        data_types: Food types to load (food.csv data_type values)
+
+    Returns:
+        Counts of foods and nutrients loaded
+    """
+    started = time.perf_counter()
+    data_types = data_types or DEFAULT_DATA_TYPES
+
+    foods, nutrients = [], []
+    for source in sources:
+        food = _read_csv(source, "food.csv", ["fdc_id", "data_type", "description"], dtype={"description": str})
+        if food is None:
+            raise ValueError(f"{source} does not contain food.csv")
+        food = food[food["data_type"].isin(data_types)]
+        branded = _read_csv(source, "branded_food.csv", ["fdc_id", "brand_owner", "ingredients"], dtype=str)
+        if branded is not None:
+            branded["fdc_id"] = branded["fdc_id"].astype(np.int64)
+            food = food.merge(branded, on="fdc_id", how="left")
+        foods.append(food)
+        nutrient = _read_csv(source, "nutrient.csv", ["id", "name", "unit_name", "rank"])
+        if nutrient is not None:
+            nutrients.append(nutrient)
+    foods = pd.concat(foods, ignore_index=True).drop_duplicates("fdc_id", keep="last").reset_index(drop=True)
+    for column in TEXT_COLUMNS:
+        if column not in foods:
+            foods[column] = None
+    nutrients = pd.concat(nutrients, ignore_index=True).drop_duplicates("id", keep="last")
+
+    # Foods are numbered by their number of description trigrams, so each
+    # trigram's postings are also ordered by description length and searches
+    # can skip descriptions too short or too long to match
+    food_trigrams = [trigrams(description) for description in foods["description"].fillna("")]
+    counts = np.minimum([len(food_codes) for food_codes in food_trigrams], MAX_TRIGRAMS).astype(np.uint16)
+    order = np.argsort(counts, kind="stable")
+    foods = foods.iloc[order].reset_index(drop=True)
+    food_trigrams = [food_trigrams[row] for row in order]
+    counts = counts[order]
+    food_rows = pd.Index(foods["fdc_id"])
+
+    # First pass: nutrients reported for the loaded foods become the matrix columns
+    used = set()
+    for chunk in _iter_food_nutrients(sources):
+        chunk = chunk[food_rows.get_indexer(chunk["fdc_id"]) >= 0]
+        used.update(chunk["nutrient_id"].astype(np.int64).unique().tolist())
+    nutrients = nutrients[nutrients["id"].isin(used)].sort_values(["rank", "id"], na_position="last")
+    nutrient_columns = pd.Index(nutrients["id"].astype(np.int64))
+
+    temp_directory = f"{directory.rstrip(os.sep)}.building"
+    shutil.rmtree(temp_directory, ignore_errors=True)
+    os.makedirs(temp_directory)
+
+    # Second pass: fill the memory-mapped nutrient matrix
+    matrix = np.lib.format.open_memmap(
+        os.path.join(temp_directory, "nutrients.npy"), mode="w+", dtype=np.float32,
+        shape=(len(foods), len(nutrient_columns)))
+    matrix[:] = np.nan
+    for chunk in _iter_food_nutrients(sources):
+        rows = food_rows.get_indexer(chunk["fdc_id"])
+        columns = nutrient_columns.get_indexer(chunk["nutrient_id"].astype(np.int64))
+        keep = (rows >= 0) & (columns >= 0)
+        matrix[rows[keep], columns[keep]] = chunk["amount"].to_numpy(np.float32)[keep]
+    matrix.flush()
+    del matrix
+
+    type_names = sorted(foods["data_type"].unique().tolist())
+    np.save(os.path.join(temp_directory, "fdc_ids.npy"), foods["fdc_id"].to_numpy(np.int64))
+    np.save(os.path.join(temp_directory, "data_types.npy"),
+            pd.Categorical(foods["data_type"], categories=type_names).codes.astype(np.uint8))
+    for column in TEXT_COLUMNS:
+        _write_strings(temp_directory, column, foods[column].tolist())
+
+    # Trigram postings in CSR form: the foods of trigram t are postings[offsets[t]:offsets[t + 1]]
+    codes = np.fromiter((code for food_codes in food_trigrams for code in food_codes), dtype=np.int32)
+    rows = np.repeat(np.arange(len(foods), dtype=np.int32), [len(food_codes) for food_codes in food_trigrams])
+    order = np.argsort(codes, kind="stable")
+    offsets = np.zeros(ALPHABET_SIZE ** 3 + 1, dtype=np.int64)
+    np.cumsum(np.bincount(codes, minlength=ALPHABET_SIZE ** 3), out=offsets[1:])
+    np.save(os.path.join(temp_directory, "trigram_offsets.npy"), offsets)
+    np.save(os.path.join(temp_directory, "trigram_postings.npy"), rows[order])
+    np.save(os.path.join(temp_directory, "trigram_counts.npy"), counts)
+
+    meta = {
+        "foods": len(foods),
+        "data_types": type_names,
+        "nutrients": [
+            {"id": int(nutrient.id), "name": nutrient.name, "unit": nutrient.unit_name}
+            for nutrient in nutrients.itertuples()
+        ],
+        "sources": [os.path.basename(source.rstrip(os.sep)) for source in sources],
+        "built_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    with open(os.path.join(temp_directory, "meta.json"), "w") as f:
+        json.dump(meta, f)
+
+    old_directory = f"{directory.rstrip(os.sep)}.old"
+    shutil.rmtree(old_directory, ignore_errors=True)
+    if os.path.exists(directory):
+        os.rename(directory, old_directory)
+    os.rename(temp_directory, directory)
+    shutil.rmtree(old_directory, ignore_errors=True)
+
+    elapsed = time.perf_counter() - started
+    print(f"Built USDA food index in {directory}: {len(foods)} foods, {len(nutrient_columns)} nutrients in {elapsed:.1f}s")
+    return {"foods": len(foods), "nutrients": len(nutrient_columns)}
+
+
+class USDAFoodIndex:
+    """Read-only view of a mirror written by build_index."""
+
+    def __init__(self, directory: str = USDA_FOOD_INDEX_DIR):
+        self.directory = directory
+        with open(os.path.join(directory, "meta.json")) as f:
+            self.meta = json.load(f)
+        self.nutrient_names = [nutrient["name"] for nutrient in self.meta["nutrients"]]
+        self.nutrients = np.load(os.path.join(directory, "nutrients.npy"), mmap_mode="r")
+        self.fdc_ids = np.load(os.path.join(directory, "fdc_ids.npy"))
+        self.data_types = np.load(os.path.join(directory, "data_types.npy"))
+        types = self.meta["data_types"]
+        self.branded_code = types.index("branded_food") if "branded_food" in types else -1
+        self.columns = {column: _StringColumn(directory, column) for column in TEXT_COLUMNS}
+        self.trigram_offsets = np.load(os.path.join(directory, "trigram_offsets.npy"))
+        self.trigram_postings = np.load(os.path.join(directory, "trigram_postings.npy"), mmap_mode="r")
+        self.trigram_counts = np.load(os.path.join(directory, "trigram_counts.npy"))
+
+    def search(self, query: str, top_k: int = 3, min_score: float = USDA_MIN_SCORE) -> List[tuple]:
+        """
+        Find the foods whose description best matches a query.
+
+        Descriptions are ranked by trigram similarity (shared trigrams over the
+        trigrams of either text), shorter descriptions first on ties.
+
+        Returns:
+            Up to top_k (row, score) pairs, best first
+        """
+        codes = trigrams(query)
+        if not codes:
+            return []
+        postings = [self.trigram_postings[self.trigram_offsets[code]:self.trigram_offsets[code + 1]] for code in codes]
+        # Strict thresholds read far fewer postings; if top_k foods pass one, no
+        # food below it can rank higher, so the result is the same as at min_score
+        for threshold in SEARCH_THRESHOLDS:
+            if threshold <= min_score:
+                break
+            rows, scores = self._candidates(codes, postings, threshold)
+            if len(rows) >= top_k:
+                return self._top(rows, scores, top_k)
+        rows, scores = self._candidates(codes, postings, min_score)
+        return self._top(rows, scores, top_k)
+
+    def _candidates(self, codes: List[int], postings: List[np.ndarray], threshold: float):
+        """Rows and scores of the foods scoring at least threshold."""
+        # Such a food has between threshold * len(codes) and len(codes) / threshold
+        # trigrams; rows are ordered by trigram count, so they form a row range
+        first, last = self.row_range(math.ceil(threshold * len(codes)), math.floor(len(codes) / threshold))
+        postings = [posting[np.searchsorted(posting, first):np.searchsorted(posting, last)] for posting in postings]
+        candidates = np.concatenate(postings)
+        if not len(candidates):
+            return candidates, np.zeros(0)
+        # Shared trigrams per row of the range; a matching food shares at least threshold * len(codes)
+        shared = np.bincount(candidates - first, minlength=last - first)
+        rows = np.flatnonzero(shared >= math.ceil(threshold * len(codes)))
+        shared = shared[rows]
+        rows = rows.astype(np.int32) + first
+        scores = shared / (len(codes) + self.trigram_counts[rows].astype(np.float64) - shared)
+        keep = scores >= threshold
+        return rows[keep], scores[keep]
+
+    def row_range(self, shortest: int, longest: int):
+        """First and past-the-end rows of the foods with shortest to longest trigrams."""
+        # Needles of the array's dtype, or numpy converts the whole array first
+        counts = self.trigram_counts
+        first = counts.searchsorted(counts.dtype.type(min(shortest, MAX_TRIGRAMS)), "left")
+        last = counts.searchsorted(counts.dtype.type(min(longest, MAX_TRIGRAMS)), "right")
+        return np.int32(first), np.int32(last)
+
+    def _top(self, rows: np.ndarray, scores: np.ndarray, top_k: int) -> List[tuple]:
+        if len(rows) > top_k:
+            # Keep every food tied with the k-th score so the tie-break below sees them all
+            cutoff = np.partition(scores, len(scores) - top_k)[len(scores) - top_k]
+            keep = scores >= cutoff
+            rows, scores = rows[keep], scores[keep]
+        # Ties go to reference foods over branded products, then to shorter descriptions
+        branded = self.data_types[rows] == self.branded_code
+        order = np.lexsort((self.columns["description"].lengths(rows), branded, -scores))[:top_k]
+        return [(int(rows[i]), float(scores[i])) for i in order]
+
+    def food(self, row: int, with_nutrients: bool = True) -> dict:
+        """Return a food in the shape of the FoodData Central search results."""
+        result = {
+            "description": self.columns["description"][row],
+            "fdcId": int(self.fdc_ids[row]),
+            "dataType": DATA_TYPE_NAMES.get(self.meta["data_types"][self.data_types[row]],
+                                            self.meta["data_types"][self.data_types[row]]),
+            "brandOwner": self.columns["brand_owner"][row],
+            "ingredients": self.columns["ingredients"][row],
+        }
+        if with_nutrients:
+            values = np.asarray(self.nutrients[row])
+            result["nutrients"] = {
+                self.nutrient_names[column]: round(float(values[column]), 4)
+                for column in np.flatnonzero(~np.isnan(values))
+            }
+        return result
+
+    def stats(self) -> dict:
+        return {
+            "directory": self.directory,
+            "foods": self.meta["foods"],
+            "nutrients": len(self.nutrient_names),
+            "sources": self.meta["sources"],
+            "built_at": self.meta["built_at"],
+        }
+
+
+_index: Optional[USDAFoodIndex] = None
+_index_mtime = None
+_index_checked_at = float("-inf")
+_index_lock = threading.Lock()
+
+
+def get_food_index() -> Optional[USDAFoodIndex]:
+    """
+    Return the mirror in USDA_FOOD_INDEX_DIR, or None if it has not been built.
+
+    A mirror built or rebuilt while the server runs is picked up within
+    INDEX_RECHECK_SECONDS.
+    """
+    global _index, _index_mtime, _index_checked_at
+    if _index is not None and time.monotonic() - _index_checked_at < INDEX_RECHECK_SECONDS:
+        return _index
+    # Checked under the lock so callers arriving while the mirror loads wait for it
+    with _index_lock:
+        now = time.monotonic()
+        if now - _index_checked_at >= INDEX_RECHECK_SECONDS:
+            try:
+                mtime = os.path.getmtime(os.path.join(USDA_FOOD_INDEX_DIR, "meta.json"))
+            except OSError:
+                mtime = None
+            if mtime is not None and mtime != _index_mtime:
+                _index = USDAFoodIndex(USDA_FOOD_INDEX_DIR)
+                _index_mtime = mtime
+                print(f"Using local USDA food index at {USDA_FOOD_INDEX_DIR}: {_index.meta['foods']} foods")
+            _index_checked_at = now
+        return _index
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--index", default=USDA_FOOD_INDEX_DIR, help="Directory of the mirror")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="Build the mirror from FoodData Central CSV releases")
+    build.add_argument("sources", nargs="+", help="Release .zip files or extracted directories")
+    build.add_argument("--data-types", nargs="+", default=DEFAULT_DATA_TYPES)
+    search = commands.add_parser("search", help="Search food descriptions")
+    search.add_argument("query")
+    search.add_argument("--top-k", type=int, default=5)
+    commands.add_parser("stats", help="Show mirror statistics")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        build_index(args.sources, args.index, args.data_types)
+    index = USDAFoodIndex(args.index)
+    if args.command == "search":
+        started = time.perf_counter()
+        matches = index.search(args.query, args.top_k)
+        elapsed = (time.perf_counter() - started) * 1000
+        for row, score in matches:
+            food = index.food(row, with_nutrients=False)
+            print(f"{score:.2f}  {food['fdcId']:>8}  {food['dataType']:<15} {food['description']}")
+        print(f"{len(matches)} matches in {elapsed:.3f} ms")
+    print(index.stats())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""
+Long-lived vector index of PubMed article chunks.
+
+One persistent Chroma collection holds the chunks of every article seen so far,
+keyed by chunk ID. A chunk ID includes a hash of the article text it was cut
+from, so an article whose text changes (e.g. once its PMC full text is
+available) gets new chunks. Only chunks the index doesn't have yet are
+embedded, and queries are restricted to the chunks of the articles of the
+current search, in their current version, with a metadata filter.
+
+Chunks are garbage-collected by age and by count, oldest indexed first;
+chunks of earlier article versions are never queried again and age out.
+"""
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List
+
+import chromadb
+import dotenv
+
+dotenv.load_dotenv()
+
+# Directory of the persistent index
+VECTOR_INDEX_PATH = os.getenv("VECTOR_INDEX_PATH", "cache/pubmed_chroma")
+# Most chunks kept, and seconds a chunk is kept after it was indexed
+VECTOR_INDEX_MAX_CHUNKS = int(os.getenv("VECTOR_INDEX_MAX_CHUNKS", "200000"))
+VECTOR_INDEX_MAX_AGE = float(os.getenv("VECTOR_INDEX_MAX_AGE", str(30 * 86400)))
+# Seconds between garbage collections
+VECTOR_INDEX_GC_INTERVAL = float(os.getenv("VECTOR_INDEX_GC_INTERVAL", "600"))
+
+COLLECTION_NAME = "pubmed_chunks"
+# Chroma limits the number of records of a single call
+_BATCH = 5000
+
+
+class VectorIndex:
+    """
+    Persistent Chroma collection of article chunks.
+
+    Args:
+        path: Directory of the index
+        embedding_model: Name of the model the embeddings come from; the
+                         collection is rebuilt when it changes
+        max_chunks: Most chunks kept
+        max_age_seconds: Seconds a chunk is kept after it was indexed
+        gc_interval: Seconds between garbage collections
+    """
+
+    def __init__(self, path: str = VECTOR_INDEX_PATH, embedding_model: str = "",
+                 max_chunks: int = VECTOR_INDEX_MAX_CHUNKS, max_age_seconds: float = VECTOR_INDEX_MAX_AGE,
+                 gc_interval: float = VECTOR_INDEX_GC_INTERVAL):
+        self.max_chunks = max_chunks
+        self.max_age_seconds = max_age_seconds
+        self.gc_interval = gc_interval
+        os.makedirs(path, exist_ok=True)
+        self.client = chromadb.PersistentClient(path=path)
+        metadata = {"hnsw:space": "cosine", "embedding_model": embedding_model}
+        self.collection = self.client.get_or_create_collection(name=COLLECTION_NAME, metadata=metadata)
+        if (self.collection.metadata or {}).get("embedding_model") != embedding_model:
+            # Embeddings of another model can't be compared with the new ones
+            print(f"Embedding model changed to {embedding_model}, rebuilding the vector index")
+            self.client.delete_collection(COLLECTION_NAME)
+            self.collection = self.client.create_collection(name=COLLECTION_NAME, metadata=metadata)
+        self._gc_lock = threading.Lock()
+        self._last_gc = 0.0
+        print(f"Opened vector index in {path} ({self.collection.count()} chunks)")
+
+    def add(self, chunks: List[Dict[str, Any]], embed: Callable[[List[str]], list]) -> int:
+        """
+        Index the chunks the index doesn't have yet.
+
+        Args:
+            chunks: Dictionaries with text and metadata (chunk_id, pmid and text_hash)
+            embed: Turns a list of texts into a list of embeddings
+
+        Returns:
+            The number of chunks embedded
+        """
+        ids = list(dict.fromkeys(chunk["metadata"]["chunk_id"] for chunk in chunks))
+        known = set()
+        for start in range(0, len(ids), _BATCH):
+            known.update(self.collection.get(ids=ids[start:start + _BATCH], include=[])["ids"])
+        unseen = [chunk for chunk in chunks if chunk["metadata"]["chunk_id"] not in known]
+        unseen = list({chunk["metadata"]["chunk_id"]: chunk for chunk in unseen}.values())
+        if unseen:
+            embeddings = embed([chunk["text"] for chunk in unseen])
+            now = time.time()
+            for start in range(0, len(unseen), _BATCH):
+                batch = unseen[start:start + _BATCH]
+                self.collection.upsert(
+                    ids=[chunk["metadata"]["chunk_id"] for chunk in batch],
+                    embeddings=[list(embedding) for embedding in embeddings[start:start + _BATCH]],
+                    documents=[chunk["text"] for chunk in batch],
+                    metadatas=[{**chunk["metadata"], "indexed_at": now} for chunk in batch],
+                )
+        self.maybe_gc()
+        return len(unseen)
+
+    def query(self, query_embedding: list, top_k: int, chunks: List[Dict[str, Any]]) -> List[str]:
+        """
+        Return the texts of the top_k chunks closest to the query embedding,
+        among the chunks of the articles chunks come from.
+        """
+        pmids = sorted({chunk["metadata"]["pmid"] for chunk in chunks})
+        text_hashes = sorted({chunk["metadata"]["text_hash"] for chunk in chunks})
+        if not pmids:
+            return []
+        results = self.collection.query(
+            query_embeddings=[query_embedding],
+            n_results=top_k,
+            where={"$and": [{"pmid": {"$in": pmids}}, {"text_hash": {"$in": text_hashes}}]},
+        )
+        if results and results.get("documents"):
+            return results["documents"][0]
+        return []
+
+    def maybe_gc(self):
+        """Garbage-collect if the last collection is more than gc_interval seconds old."""
+        if time.time() - self._last_gc < self.gc_interval or not self._gc_lock.acquire(blocking=False):
+            return
+        try:
+            self._last_gc = time.time()
+            self.gc()
+        finally:
+            self._gc_lock.release()
+
+    def gc(self) -> int:
+        """
+        Delete the chunks older than max_age_seconds, then the oldest ones
+        beyond max_chunks.
+
+        Returns:
+            The number of chunks deleted
+        """
+        before = self.collection.count()
+        self.collection.delete(where={"indexed_at": {"$lt": time.time() - self.max_age_seconds}})
+        excess = self.collection.count() - self.max_chunks
+        if excess > 0:
+            entries = self.collection.get(include=["metadatas"])
+            by_age = sorted(zip(entries["metadatas"], entries["ids"]), key=lambda entry: entry[0].get("indexed_at", 0))
+            oldest = [chunk_id for _, chunk_id in by_age[:excess]]
+            for start in range(0, len(oldest), _BATCH):
+                self.collection.delete(ids=oldest[start:start + _BATCH])
+        deleted = before - self.collection.count()
+        if deleted:
+            print(f"Vector index garbage collection deleted {deleted} chunks")
+        return deleted
+
+    def stats(self) -> dict:
+        return {"chunks": self.collection.count(), "max_chunks": self.max_chunks,
+                "max_age_seconds": self.max_age_seconds}